@@ -0,0 +1,137 @@
+"""
+Helper script to measure how long the API takes to start and answer its first request.
+
+Each run starts a fresh Python process with `python -X importtime`, imports the app, and sends one request to it
+using the test client. The median times across all the runs are printed, along with the slowest imports from the
+last run, so you can see what is slowing down a cold start. Run this from the llama_store folder.
+
+Import times are a little slower with -X importtime turned on, so compare these numbers with each other rather
+than with a real server.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+# The code run in each child process. The test client is imported before the timer starts, so only the app is timed.
+CHILD_CODE = """
+import json
+import sys
+import time
+
+from starlette.testclient import TestClient
+
+start = time.perf_counter()
+from main import app
+
+imported = time.perf_counter()
+response = TestClient(app).get(sys.argv[1])
+responded = time.perf_counter()
+
+print(json.dumps({"import": imported - start, "request": responded - imported, "status": response.status_code}))
+"""
+
+parser = argparse.ArgumentParser(prog="benchmark_startup.py")
+parser.add_argument("--runs", help="The number of times to start the API", type=int, default=5)
+parser.add_argument("--path", help="The path to send the first request to", default="/llama")
+parser.add_argument("--read-only", help="Start the API in read only mode", action="store_true")
+parser.add_argument("--top", help="The number of slowest imports to show", type=int, default=15)
+parser.add_argument(
+    "--max-ms",
+    help="Exit with an error if the median time to the first response is more than this many milliseconds",
+    type=float,
+    default=None,
+)
+
+
+def parse_import_times(output: str, module: str = "main") -> List[Tuple[int, int, str]]:
+    """
+    Parses the output of python -X importtime, keeping only the module and the imports it caused.
+
+    :param str output: The standard error of the child process.
+    :param str module: The module to keep the imports for.
+    :return: The self time in microseconds, the cumulative time in microseconds, and the name of each import.
+    :rtype: List[Tuple[int, int, str]]
+    """
+    import_times = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time, cumulative_time, name = line[len("import time:") :].split("|")
+        # Skip the header line
+        if not self_time.strip().isdigit():
+            continue
+
+        # Imports are listed after the imports they caused, indented by one more space for each level. A top level
+        # import that isn't the module starts a new tree, so throw away what came before it.
+        if len(name) - len(name.lstrip()) == 1 and name.strip() != module:
+            import_times = []
+            continue
+        import_times.append((int(self_time), int(cumulative_time), name.rstrip()))
+        if name.strip() == module:
+            break
+    return import_times
+
+
+def run_once(path: str, env: dict) -> Tuple[dict, List[Tuple[int, int, str]]]:
+    """
+    Starts the API in a new process and sends it one request.
+
+    :param str path: The path to send the request to.
+    :param dict env: The environment variables for the process.
+    :return: The timings from the child process, with the process wall time added, and the import times.
+    :rtype: Tuple[dict, List[Tuple[int, int, str]]]
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_CODE, path],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process"] = time.perf_counter() - start
+    return timings, parse_import_times(result.stderr)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    child_env = dict(os.environ)
+    if args.read_only:
+        child_env["ALLOW_WRITE"] = "false"
+
+    print(f"starting the API {args.runs} times, sending the first request to {args.path}")
+    runs = []
+    last_import_times = []
+    for _ in range(args.runs):
+        run_timings, last_import_times = run_once(args.path, child_env)
+        runs.append(run_timings)
+
+    def median_ms(key: str) -> float:
+        """
+        Gets the median of a timing across all the runs, in milliseconds.
+        """
+        return statistics.median(run[key] for run in runs) * 1000
+
+    first_response_ms = median_ms("import") + median_ms("request")
+    print(f"first request status:   {runs[-1]['status']}")
+    print(f"import main:            {median_ms('import'):8.1f} ms")
+    print(f"first request:          {median_ms('request'):8.1f} ms")
+    print(f"time to first response: {first_response_ms:8.1f} ms")
+    print(f"whole process:          {median_ms('process'):8.1f} ms")
+
+    print("\nslowest imports from the last run (cumulative, self):")
+    slowest_imports = sorted(last_import_times, key=lambda item: item[1], reverse=True)[: args.top]
+    for self_us, cumulative_us, module_name in slowest_imports:
+        print(f"{cumulative_us / 1000:8.1f} ms {self_us / 1000:8.1f} ms {module_name}")
+
+    if args.max_ms is not None and first_response_ms > args.max_ms:
+        print(f"\ntime to first response is over the limit of {args.max_ms} ms")
+        sys.exit(1)
@@ -0,0 +1,290 @@
+"""
+Pushes changes to llamas and their pictures to clients as they happen, using server-sent events.
+
+Each process has one broadcaster, which follows the change log and passes each new change on to every connected
+client. The write routers wake the broadcaster as soon as they have written, and it also checks the change log
+regularly, so clients also see changes written by other worker processes, or by the writer if this is a read
+replica.
+
+Each client has its own bounded queue. A client that can't keep up, so its queue fills, is disconnected rather than
+holding up the other clients or using more and more memory. Events are numbered with the change sequence number, so
+clients can reconnect with the Last-Event-ID header and carry on from the change log where they left off.
+"""
+
+# pylint: disable=invalid-name
+
+import asyncio
+import contextlib
+import logging
+import os
+from typing import AsyncIterator, Iterator, List, Optional, Set, Tuple
+
+import anyio
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from data.change_crud import get_changes_since, get_latest_change_seq
+from data.database import SessionLocal
+from models.change import Change
+
+logger = logging.getLogger(__name__)
+
+# The most changes queued for each client. Clients that fall this far behind are disconnected.
+CHANGE_STREAM_QUEUE_SIZE = int(os.environ.get("CHANGE_STREAM_QUEUE_SIZE", "256"))
+
+# How often the change log is checked for changes made by other processes, in seconds
+CHANGE_STREAM_POLL_INTERVAL = float(os.environ.get("CHANGE_STREAM_POLL_INTERVAL_SECONDS", "1"))
+
+# How often a comment is sent to idle clients, in seconds, so proxies don't close the connection
+CHANGE_STREAM_KEEP_ALIVE = float(os.environ.get("CHANGE_STREAM_KEEP_ALIVE_SECONDS", "15"))
+
+# The number of changes read from the change log at a time
+CHANGE_STREAM_BATCH_SIZE = 1000
+
+# How long clients should wait before reconnecting, in milliseconds
+CHANGE_STREAM_RETRY_MS = 1000
+
+
+class ChangeSubscriber:  # pylint: disable=too-few-public-methods
+    """
+    A client connected to the change stream.
+    """
+
+    def __init__(self, queue_size: int, start_seq: Optional[int]) -> None:
+        """
+        :param int queue_size: The most changes to queue for the client.
+        :param Optional[int] start_seq: The sequence number of the last change before the client connected. Every
+            change after this is put in the queue. This is None if the broadcaster hasn't read the change log yet.
+        """
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.start_seq = start_seq
+        self.overflowed = asyncio.Event()
+
+
+class ChangeBroadcaster:
+    """
+    Follows the change log, and passes new changes on to the connected clients.
+    """
+
+    def __init__(self, queue_size: int = CHANGE_STREAM_QUEUE_SIZE) -> None:
+        self.queue_size = queue_size
+        self.subscribers: Set[ChangeSubscriber] = set()
+        self.last_seq: Optional[int] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def subscribe(self) -> ChangeSubscriber:
+        """
+        Connects a client. This must be called on the event loop.
+
+        :return: The subscriber, which gets every change after its start sequence number.
+        :rtype: ChangeSubscriber
+        """
+        subscriber = ChangeSubscriber(self.queue_size, self.last_seq)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: ChangeSubscriber) -> None:
+        """
+        Disconnects a client.
+
+        :param ChangeSubscriber subscriber: The subscriber.
+        """
+        self.subscribers.discard(subscriber)
+
+    def publish(self, changes: List[Change]) -> None:
+        """
+        Passes changes on to every connected client. Clients whose queue is full are disconnected. This must be
+        called on the event loop.
+
+        :param List[Change] changes: The changes, in order.
+        """
+        for change in changes:
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.queue.put_nowait(change)
+                except asyncio.QueueFull:
+                    logger.warning("Disconnecting a change stream client that fell %d changes behind", self.queue_size)
+                    self.unsubscribe(subscriber)
+                    subscriber.overflowed.set()
+            self.last_seq = change.seq
+
+    def notify(self) -> None:
+        """
+        Wakes the broadcaster to check the change log straight away. This can be called from any thread.
+        """
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def read_new_changes(self) -> Tuple[int, List[Change]]:
+        """
+        Reads the changes after the last one that was published. The first time this is called, it only reads the
+        latest sequence number, so clients only get changes made after the broadcaster started.
+
+        :return: The latest sequence number, and the new changes.
+        :rtype: Tuple[int, List[Change]]
+        """
+        db = SessionLocal()
+        try:
+            if self.last_seq is None:
+                return get_latest_change_seq(db), []
+
+            changes = []
+            while True:
+                batch = get_changes_since(db, changes[-1].seq if changes else self.last_seq, CHANGE_STREAM_BATCH_SIZE)
+                changes += batch
+                if len(batch) < CHANGE_STREAM_BATCH_SIZE:
+                    return changes[-1].seq if changes else self.last_seq, changes
+        finally:
+            db.close()
+
+    async def check_for_changes(self) -> None:
+        """
+        Reads the new changes from the change log, and publishes them.
+        """
+        latest_seq, changes = await asyncio.to_thread(self.read_new_changes)
+        self.publish(changes)
+        self.last_seq = latest_seq
+
+    async def run(self) -> None:
+        """
+        Checks the change log forever, whenever the write routers wake the broadcaster, or every
+        CHANGE_STREAM_POLL_INTERVAL seconds.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await self.check_for_changes()
+            except Exception:  # pylint: disable=broad-except
+                # Try again next time, clients will get the changes then
+                logger.exception("Failed to check the change log")
+
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), CHANGE_STREAM_POLL_INTERVAL)
+            self._wake.clear()
+
+
+# The change broadcaster for this process
+change_broadcaster = ChangeBroadcaster()
+
+
+def notify_change_stream() -> Iterator[None]:
+    """
+    A dependency for the write routers, that wakes the broadcaster once the request has been handled, so clients
+    get the changes without waiting for the next check.
+    """
+    yield
+    change_broadcaster.notify()
+
+
+def format_change_event(change: Change) -> str:
+    """
+    Formats a change as a server-sent event. The event ID is the change sequence number.
+
+    :param Change change: The change.
+    :return: The event.
+    :rtype: str
+    """
+    return f"id: {change.seq}\nevent: change\ndata: {change.model_dump_json(by_alias=True, exclude_none=True)}\n\n"
+
+
+def read_changes_between(since: int, until: int) -> List[Change]:
+    """
+    Reads a batch of the changes after one sequence number, up to and including another.
+
+    :param int since: The sequence number of the last change already sent.
+    :param int until: The sequence number of the last change to read.
+    :return: The changes.
+    :rtype: List[Change]
+    """
+    db = SessionLocal()
+    try:
+        return [change for change in get_changes_since(db, since, CHANGE_STREAM_BATCH_SIZE) if change.seq <= until]
+    finally:
+        db.close()
+
+
+def read_latest_change_seq() -> int:
+    """
+    Reads the sequence number of the latest change.
+
+    :return: The sequence number.
+    :rtype: int
+    """
+    db = SessionLocal()
+    try:
+        return get_latest_change_seq(db)
+    finally:
+        db.close()
+
+
+async def stream_changes(subscriber: ChangeSubscriber, last_event_id: Optional[int]) -> AsyncIterator[str]:
+    """
+    Streams changes to a client as server-sent events. Clients that send the ID of the last event they got are sent
+    the changes they missed from the change log first, up to where the subscriber's queue starts, so no change is
+    missed or sent twice.
+
+    :param ChangeSubscriber subscriber: The subscriber for the client.
+    :param Optional[int] last_event_id: The sequence number of the last change the client got, if it is resuming.
+    :return: The events.
+    :rtype: AsyncIterator[str]
+    """
+    yield f"retry: {CHANGE_STREAM_RETRY_MS}\n\n"
+
+    # The broadcaster hasn't started following the change log yet, so start from the latest change
+    if subscriber.start_seq is None:
+        subscriber.start_seq = await asyncio.to_thread(read_latest_change_seq)
+
+    # Send the changes the client missed
+    since = last_event_id
+    while since is not None and since < subscriber.start_seq:
+        changes = await asyncio.to_thread(read_changes_between, since, subscriber.start_seq)
+        if not changes:
+            break
+        for change in changes:
+            yield format_change_event(change)
+        since = changes[-1].seq
+
+    # Send the changes as they happen, skipping any that were already sent from the change log
+    while True:
+        try:
+            change = await asyncio.wait_for(subscriber.queue.get(), CHANGE_STREAM_KEEP_ALIVE)
+        except asyncio.TimeoutError:
+            yield ": keep-alive\n\n"
+            continue
+        if since is None or change.seq > since:
+            yield format_change_event(change)
+
+
+class ChangeStreamResponse(StreamingResponse):
+    """
+    A streaming response for the change stream, that closes the connection if the client falls too far behind.
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(self, broadcaster: ChangeBroadcaster, subscriber: ChangeSubscriber, content: AsyncIterator[str]):
+        """
+        :param ChangeBroadcaster broadcaster: The broadcaster the subscriber is connected to.
+        :param ChangeSubscriber subscriber: The subscriber for the client.
+        :param AsyncIterator[str] content: The events.
+        """
+        super().__init__(content, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.broadcaster = broadcaster
+        self.subscriber = subscriber
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async def close_when_overflowed() -> None:
+            # Stop sending, even if a send is waiting on a client that has stopped reading. The response is left
+            # unfinished, so the server closes the connection.
+            await self.subscriber.overflowed.wait()
+            task_group.cancel_scope.cancel()
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                task_group.start_soon(close_when_overflowed)
+                await super().__call__(scope, receive, send)
+                task_group.cancel_scope.cancel()
+        finally:
+            self.broadcaster.unsubscribe(self.subscriber)
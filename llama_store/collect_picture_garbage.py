@@ -0,0 +1,42 @@
+"""
+Helper script to remove orphaned llama pictures in one go.
+
+This removes picture rows for llamas that no longer exist or whose picture file is missing, and picture files
+that have no row. Run this from the llama_store folder, with the same environment variables as the API.
+"""
+
+import argparse
+
+from data.database import SessionLocal
+from data.picture_gc import GC_BATCH_SIZE, GC_MIN_FILE_AGE, PictureGarbageCollector
+
+parser = argparse.ArgumentParser(prog="collect_picture_garbage.py")
+parser.add_argument(
+    "--min-file-age",
+    help="Only delete picture files without a row that are at least this many seconds old",
+    type=int,
+    default=GC_MIN_FILE_AGE,
+)
+parser.add_argument(
+    "--batch-size", help="The number of rows or files to check at a time", type=int, default=GC_BATCH_SIZE
+)
+parser.add_argument("--dry-run", help="Report what would be deleted without deleting it", action="store_true")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    collector = PictureGarbageCollector(
+        min_file_age=args.min_file_age, batch_size=args.batch_size, dry_run=args.dry_run
+    )
+
+    print("collecting orphaned llama pictures" + (" (dry run)" if args.dry_run else ""))
+    db = SessionLocal()
+    try:
+        collector.collect(db)
+    finally:
+        db.close()
+
+    stats = collector.stats
+    print(f"checked {stats.rows_checked} picture rows and {stats.files_checked} picture files")
+    print(f"found {stats.rows_deleted} orphaned picture rows and {stats.files_deleted} orphaned picture files")
+    print(f"reclaimed {stats.bytes_reclaimed} bytes")
@@ -0,0 +1,196 @@
+"""
+Compression for API responses. Responses are compressed with Brotli or gzip, depending on what the client accepts in
+the Accept-Encoding header. The brotli package is in the requirements. If it is missing, a warning is logged when the
+API starts and responses are only compressed with gzip.
+
+Only responses sent in one piece are compressed, and only if they are big enough to be worth it. Pictures, zip
+archives, event streams and responses that are already encoded are sent as they are. Compressed bodies are kept in
+a cache keyed by a hash of the body, so popular responses such as the list of llamas are only compressed once.
+Large bodies are compressed on a worker thread, so compressing them doesn't hold up other requests.
+
+Every response that could be compressed has a Vary: Accept-Encoding header, even when it is sent uncompressed, so
+caches don't send a response compressed for one client to a client that doesn't accept it, or the other way around.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+from typing import List, Optional
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from data.byte_cache import ByteBudgetLRU
+from http_caching import choose_content_encoding
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:
+    # Without Brotli, responses are only compressed with gzip
+    brotli = None
+    logger.warning("The brotli package is not installed, so responses will only be compressed with gzip")
+
+# Turn compression on or off
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "true").lower() == "true"
+
+# Responses smaller than this many bytes are not compressed, as the saving is too small to be worth it
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+
+# Bodies at least this many bytes are compressed on a worker thread, rather than on the event loop
+COMPRESSION_THREAD_MIN_SIZE = int(os.environ.get("COMPRESSION_THREAD_MIN_SIZE", str(16 * 1024)))
+
+# The maximum size of the cache of compressed response bodies, in bytes. Set to 0 to turn off the cache.
+COMPRESSION_CACHE_BYTES = int(os.environ.get("COMPRESSION_CACHE_BYTES", str(8 * 1024 * 1024)))
+
+# The compression levels used for responses. These favour speed, as responses are compressed while the client waits.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Media types that are already compressed, or are streamed, so are never compressed
+UNCOMPRESSED_MEDIA_TYPE_PREFIXES = ("image/", "application/zip", "text/event-stream")
+
+
+def get_available_codings() -> List[str]:
+    """
+    Gets the content codings responses can be compressed with, in order of preference.
+
+    :return: The content codings.
+    :rtype: List[str]
+    """
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(body: bytes, coding: str, best: bool = False) -> bytes:
+    """
+    Compresses a body with a content coding.
+
+    :param bytes body: The body to compress.
+    :param str coding: The content coding, br or gzip.
+    :param bool best: Set to True to compress as small as possible, for bodies that are compressed ahead of time.
+    :return: The compressed body.
+    :rtype: bytes
+    """
+    if coding == "br":
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    # The modified time is left out of the gzip header, so the compressed bytes are the same every time
+    return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses responses, if the client accepts a coding the API supports.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MIN_SIZE,
+        cache_bytes: int = COMPRESSION_CACHE_BYTES,
+        thread_minimum_size: int = COMPRESSION_THREAD_MIN_SIZE,
+    ) -> None:
+        """
+        Create the middleware.
+
+        :param app: The app to compress responses from.
+        :param int minimum_size: The smallest response body to compress, in bytes.
+        :param int cache_bytes: The maximum size of the cache of compressed bodies, in bytes.
+        :param int thread_minimum_size: The smallest response body to compress on a worker thread, in bytes.
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_minimum_size = thread_minimum_size
+        self.cache = ByteBudgetLRU(cache_bytes) if cache_bytes > 0 else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        coding = choose_content_encoding(Headers(scope=scope).get("accept-encoding"), get_available_codings())
+
+        # The start of the response is held back until the body is known, so the headers can be changed if the
+        # body is compressed
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = MutableHeaders(scope=message)
+                compressible = (
+                    message["status"] == 200
+                    and "content-encoding" not in headers
+                    and not headers.get("content-type", "").startswith(UNCOMPRESSED_MEDIA_TYPE_PREFIXES)
+                )
+                # Some responses, such as the precompressed OpenAPI documents, already vary by Accept-Encoding
+                vary = [value.strip().lower() for value in headers.get("vary", "").split(",")]
+                if compressible and "accept-encoding" not in vary:
+                    headers.add_vary_header("Accept-Encoding")
+
+                passthrough = not compressible or coding == "identity"
+                if passthrough:
+                    await send(message)
+                return
+
+            # Only bodies sent in one piece are compressed. Anything else, such as a streamed body or a file sent
+            # with the zero copy extension, is sent as it is.
+            body = message.get("body", b"")
+            if (
+                message["type"] != "http.response.body"
+                or message.get("more_body", False)
+                or len(body) < self.minimum_size
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = await self.compress_body(body, coding)
+            headers = MutableHeaders(scope=start_message)
+            headers["Content-Encoding"] = coding
+            headers["Content-Length"] = str(len(compressed))
+
+            # The compressed body is a different representation, so a strong ETag from the app becomes weak
+            etag = headers.get("etag")
+            if etag is not None and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    async def compress_body(self, body: bytes, coding: str) -> bytes:
+        """
+        Compresses a response body, using the cache if the same body has been compressed before. Large bodies are
+        compressed on a worker thread.
+
+        :param bytes body: The response body.
+        :param str coding: The content coding to compress with.
+        :return: The compressed body.
+        :rtype: bytes
+        """
+        key = None
+        if self.cache is not None:
+            key = (coding, hashlib.blake2b(body, digest_size=16).digest())
+            compressed = self.cache.get(key)
+            if compressed is not None:
+                return compressed
+
+        if len(body) >= self.thread_minimum_size:
+            compressed = await anyio.to_thread.run_sync(compress, body, coding)
+        else:
+            compressed = compress(body, coding)
+
+        if key is not None:
+            self.cache.put(key, compressed, len(compressed))
+        return compressed
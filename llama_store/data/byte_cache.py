@@ -0,0 +1,113 @@
+"""
+A thread safe least recently used cache that evicts entries once the total size of the entries grows
+beyond a byte budget.
+"""
+
+from collections import OrderedDict
+import threading
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+
+class ByteBudgetLRU:
+    """
+    A least recently used cache with a budget in bytes rather than a number of entries.
+
+    Each entry is stored with its size in bytes. When adding an entry takes the total size over the budget,
+    the least recently used entries are evicted until the cache fits again. An optional callback is called
+    for every evicted entry, so callers can clean up anything the entry refers to, such as a file on disk.
+    """
+
+    def __init__(self, max_bytes: int, on_evict: Optional[Callable[[Hashable, Any], None]] = None) -> None:
+        """
+        Create the cache.
+
+        :param int max_bytes: The maximum total size of all the entries in bytes.
+        :param on_evict: An optional callback called with the key and value of each evicted entry.
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._on_evict = on_evict
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Get an entry from the cache, marking it as the most recently used.
+
+        :param key: The key of the entry.
+        :return: The value of the entry, or None if the key is not in the cache.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> bool:
+        """
+        Add or replace an entry in the cache, evicting the least recently used entries if the cache is too big.
+
+        Entries that are bigger than the whole budget are not cached, and any entry they would have replaced is
+        evicted. The callback is not called for them, so the caller still owns whatever the value refers to.
+
+        :param key: The key of the entry.
+        :param value: The value of the entry.
+        :param int size: The size of the entry in bytes.
+        :return: True if the entry was cached, False if it is too big.
+        :rtype: bool
+        """
+        evicted: List[Tuple[Hashable, Any]] = []
+        with self._lock:
+            if key in self._entries:
+                replaced_value, replaced_size = self._entries.pop(key)
+                self.total_bytes -= replaced_size
+                if size > self.max_bytes:
+                    evicted.append((key, replaced_value))
+            if size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self.total_bytes += size
+            while self.total_bytes > self.max_bytes and self._entries:
+                evicted_key, (evicted_value, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                evicted.append((evicted_key, evicted_value))
+
+        # Run the callbacks outside of the lock, as they may be slow
+        for evicted_key, evicted_value in evicted:
+            self._evicted(evicted_key, evicted_value)
+        return size <= self.max_bytes
+
+    def remove_where(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Remove all the entries with a key that matches the predicate.
+
+        :param predicate: A function that returns True for the keys to remove.
+        """
+        removed: List[Tuple[Hashable, Any]] = []
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                value, size = self._entries.pop(key)
+                self.total_bytes -= size
+                removed.append((key, value))
+
+        for key, value in removed:
+            self._evicted(key, value)
+
+    def clear(self) -> None:
+        """
+        Remove all the entries from the cache.
+        """
+        self.remove_where(lambda _: True)
+
+    def _evicted(self, key: Hashable, value: Any) -> None:
+        """
+        Call the eviction callback for an entry, if there is one.
+        """
+        if self._on_evict is not None:
+            self._on_evict(key, value)
@@ -0,0 +1,83 @@
+"""
+This file contains the functions that will be used to read the llama change log in the database.
+"""
+
+# pylint: disable=invalid-name
+
+from typing import List
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from data.schema import DBLlamaChange
+from models.change import Change, ChangeEntity, ChangeFeed, ChangeOperation
+from models.llama import LlamaBase
+
+
+def create_change(db_change: DBLlamaChange) -> Change:
+    """
+    Create a change model from a row in the change log.
+
+    :param DBLlamaChange db_change: The change log row.
+    :return: The change.
+    :rtype: Change
+    """
+    # Only llamas that were created or updated have their details logged
+    llama = None
+    if db_change.entity == ChangeEntity.LLAMA and db_change.operation != ChangeOperation.DELETED:
+        llama = LlamaBase.model_validate(db_change)
+
+    return Change(
+        seq=db_change.seq,
+        entity=db_change.entity,
+        operation=db_change.operation,
+        llama_id=db_change.llama_id,
+        llama=llama,
+        changed_at=db_change.changed_at,
+    )
+
+
+def get_changes_since(db: Session, since: int, limit: int) -> List[Change]:
+    """
+    Get the changes made after a sequence number, in order. This uses the primary key, so only reads the
+    changes that are returned.
+
+    :param Session db: The database session.
+    :param int since: The sequence number of the last change already seen.
+    :param int limit: The most changes to get.
+    :return: The changes.
+    :rtype: List[Change]
+    """
+    statement = select(DBLlamaChange).where(DBLlamaChange.seq > since).order_by(DBLlamaChange.seq).limit(limit)
+    return list(map(create_change, db.execute(statement).scalars()))
+
+
+def get_change_feed(db: Session, since: int, limit: int) -> ChangeFeed:
+    """
+    Get a page of changes made after a sequence number.
+
+    :param Session db: The database session.
+    :param int since: The sequence number of the last change already seen.
+    :param int limit: The most changes to get.
+    :return: The changes, and the sequence number to get the next page from.
+    :rtype: ChangeFeed
+    """
+    # Get one more change than asked for, to see if there are more
+    changes = get_changes_since(db, since, limit + 1)
+    return ChangeFeed(
+        changes=changes[:limit],
+        next_since=changes[:limit][-1].seq if changes else since,
+        has_more=len(changes) > limit,
+    )
+
+
+def get_latest_change_seq(db: Session) -> int:
+    """
+    Get the sequence number of the latest change.
+
+    :param Session db: The database session.
+    :return: The sequence number, or 0 if nothing has changed.
+    :rtype: int
+    """
+    # pylint: disable-next=not-callable
+    return db.execute(select(func.max(DBLlamaChange.seq))).scalar() or 0
@@ -1,15 +1,58 @@
 """
 Code to interact with the SQLite database
+
+In read replica mode, the database file is opened read only. If the file is never changed while the API is running,
+such as when it is baked into a container image, it can also be opened as immutable so SQLite skips locking.
 """
 
 # pylint: disable=invalid-name
 
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./.appdata/sql_app.db"
+# The path to the SQLite database file
+DATABASE_PATH = "./.appdata/sql_app.db"
+
+# Run as a read replica, with the database opened read only and the llamas and users held in memory
+READ_REPLICA: bool = os.environ.get("READ_REPLICA", "false").lower() == "true"
+
+# Open the database as immutable in read replica mode. Only set this if nothing writes to the database file.
+DATABASE_IMMUTABLE: bool = os.environ.get("DATABASE_IMMUTABLE", "false").lower() == "true"
+
+
+def get_database_url(read_only: bool = False, immutable: bool = False) -> str:
+    """
+    Get the URL of the SQLite database.
+
+    :param bool read_only: Open the database read only.
+    :param bool immutable: Open the database as immutable. This is only used if the database is read only.
+    :return: The database URL.
+    :rtype: str
+    """
+    if not read_only:
+        return f"sqlite:///{DATABASE_PATH}"
+
+    # Open the database with a URI so the read only and immutable flags can be passed to SQLite
+    return f"sqlite:///file:{DATABASE_PATH}?mode=ro{'&immutable=1' if immutable else ''}&uri=true"
+
+
+SQLALCHEMY_DATABASE_URL = get_database_url(READ_REPLICA, DATABASE_IMMUTABLE)
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+
+
+@event.listens_for(engine, "connect")
+def enable_foreign_keys(dbapi_connection, _) -> None:
+    """
+    SQLite only enforces foreign keys, including cascading deletes, if they are turned on for each connection.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -1,37 +1,33 @@
 """
-Methods for interacting with files. Llama pictures are stored on the file system, not in the database.
+Methods for interacting with files. Llama pictures are stored by the picture storage backend, not in the database.
+
+Pillow is slow to import, so it is imported the first time a picture is decoded rather than when the API starts.
 """
 
+import base64
+import hashlib
 import io
-import os
-
-from PIL import Image
-
-
-# The root path for all the llama pictures
-ROOT_PATH = ".appdata/llama_store_data/pictures"
-
+import time
+from typing import Iterable, Iterator, List, Tuple
+import zipfile
 
-def create_root_folder_if_not_exists() -> None:
-    """
-    Creates a folder if it does not already exist.
-    """
-    if not os.path.exists(ROOT_PATH):
-        os.makedirs(ROOT_PATH)
+from data.storage import get_picture_storage
+from models.llama_picture import LlamaPictureMetadata
 
 
-def write_llama_picture_to_file(llama_id: int, body: bytes) -> str:
+def write_llama_picture_to_file(llama_id: int, body: bytes) -> Tuple[str, LlamaPictureMetadata]:
     """
-    Writes a llama picture to a file with the name <llama_id>.png.
+    Writes a llama picture to the picture storage with the name <llama_id>.png.
 
-    If the image is not a PNG, it is converted.
+    If the image is not a PNG, it is converted. The details of the picture are worked out from the decoded image
+    while it is in memory, so the stored picture doesn't need to be read back.
 
     :param llama_id: The ID of the llama.
     :param body: The body of the request.
-    :return: The file name.
-    :rtype: str
+    :return: The location of the stored picture, and the details of the picture.
+    :rtype: Tuple[str, LlamaPictureMetadata]
     """
-    create_root_folder_if_not_exists()
+    from PIL import Image  # pylint: disable=import-outside-toplevel
 
     # Open the image with PIL to check it is a valid image, and to get the file extension
     image = Image.open(io.BytesIO(body))
@@ -42,21 +38,140 @@ def write_llama_picture_to_file(llama_id: int, body: bytes) -> str:
     # Reopen the image after verifying
     image = Image.open(io.BytesIO(body))
 
-    # Save the image to a file as a png
-    file_name = f"{ROOT_PATH}/{llama_id}.png"
-    image.save(file_name)
+    # Convert the image to a png
+    png = io.BytesIO()
+    image.save(png, format="PNG")
+    png_body = png.getvalue()
+
+    # Store the picture, and return the location along with the details of the stored PNG
+    metadata = _get_metadata_for_image(llama_id, image, png_body)
+    return get_picture_storage().put(f"{llama_id}.png", png_body), metadata
+
+
+# The maximum width and height of the placeholder image created for each picture
+PLACEHOLDER_SIZE = 8
+
+
+def _get_metadata_for_image(llama_id: int, image, body: bytes) -> LlamaPictureMetadata:
+    """
+    Gets the details of a decoded llama picture. The image is shrunk to create the placeholder.
+
+    :param int llama_id: The ID of the llama.
+    :param image: The decoded picture, as a PIL image.
+    :param bytes body: The bytes of the stored PNG picture.
+    :return: The details of the picture.
+    :rtype: LlamaPictureMetadata
+    """
+    width, height = image.size
+
+    # Create the placeholder by shrinking the picture down to a few pixels
+    image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    placeholder = io.BytesIO()
+    image.save(placeholder, format="PNG", optimize=True)
+
+    return LlamaPictureMetadata(
+        llama_id=llama_id,
+        width=width,
+        height=height,
+        byte_size=len(body),
+        content_hash=hashlib.sha256(body).hexdigest(),
+        placeholder="data:image/png;base64," + base64.b64encode(placeholder.getvalue()).decode(),
+    )
+
+
+def get_llama_picture_metadata(llama_id: int, image_file_location: str) -> LlamaPictureMetadata:
+    """
+    Gets the details of a llama picture file - the dimensions, size, hash, and a tiny placeholder image.
+
+    :param int llama_id: The ID of the llama.
+    :param str image_file_location: The location of the image file.
+    :return: The details of the picture.
+    :rtype: LlamaPictureMetadata
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
 
-    # Return the file name
-    return file_name
+    with get_picture_storage().open(image_file_location) as file:
+        body = file.read()
+
+    with Image.open(io.BytesIO(body)) as image:
+        return _get_metadata_for_image(llama_id, image, body)
 
 
 def delete_llama_picture_file(image_file_location: str) -> None:
     """
-    Deletes a llama picture from the file system.
+    Deletes a llama picture from the picture storage.
 
     :param image_file_location: The location of the image file.
     """
-    create_root_folder_if_not_exists()
+    get_picture_storage().delete(image_file_location)
+
+
+class _ChunkWriter(io.RawIOBase):
+    """
+    A write-only, unseekable stream that holds what is written to it until it is taken.
+    This is used to stream a zip file as it is written, without holding the whole file in memory.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
 
-    if os.path.exists(image_file_location):
-        os.remove(image_file_location)
+    def write(self, b) -> int:  # pylint: disable=invalid-name
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def take(self) -> bytes:
+        """
+        Take everything written since the last call.
+        """
+        chunk = b"".join(self._chunks)
+        self._chunks.clear()
+        return chunk
+
+
+# The size of the chunks read from each picture file when creating an archive
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+
+def stream_llama_pictures_as_zip(pictures: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Streams a zip archive containing llama pictures. The archive is created as it is streamed, reading each
+    picture in chunks, so memory use doesn't grow with the number or size of the pictures.
+
+    Pictures are already compressed, so they are stored in the archive without compressing them again.
+    Pictures with a missing file are left out of the archive.
+
+    :param pictures: The name to use in the archive, and the location of the file, for each picture.
+    :return: The chunks of the zip archive.
+    :rtype: Iterator[bytes]
+    """
+    storage = get_picture_storage()
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for archive_name, image_file_location in pictures:
+            picture_stat = storage.stat(image_file_location)
+            if picture_stat is None:
+                continue
+
+            zip_info = zipfile.ZipInfo(archive_name, date_time=time.localtime(picture_stat.mtime)[:6])
+            zip_info.file_size = picture_stat.size
+            try:
+                source = storage.open(image_file_location)
+            except FileNotFoundError:
+                continue
+
+            with source, archive.open(zip_info, mode="w") as entry:
+                while chunk := source.read(ARCHIVE_CHUNK_SIZE):
+                    entry.write(chunk)
+                    if archive_chunk := writer.take():
+                        yield archive_chunk
+
+            # Closing the entry writes the size and checksum of the picture
+            if archive_chunk := writer.take():
+                yield archive_chunk
+
+    # Closing the archive writes the central directory
+    yield writer.take()
@@ -0,0 +1,236 @@
+"""
+Idempotency keys for requests that create things. Clients that retry a request, for example after a timeout, can
+send the same Idempotency-Key header with each attempt. The first attempt is handled as normal, and its response is
+stored. Retries get the stored response straight back, without the request being validated or handled again, so
+a retried picture upload doesn't process the picture again, and a retried llama doesn't get a 409.
+
+Keys belong to the user that sent them, and expire after IDEMPOTENCY_KEY_TTL seconds. Only successful responses are
+stored, so a request that fails can be retried with the same key. Keys are claimed and given up on a worker thread,
+so the database writes don't hold up the event loop.
+"""
+
+# pylint: disable=invalid-name
+
+import hashlib
+import os
+import time
+from typing import Annotated, AsyncIterator, Optional
+
+import anyio
+from fastapi import Depends, Header, HTTPException, Request, Response, status
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from data.database import get_db
+from data.schema import DBIdempotencyKey
+from data.user_crud import get_current_user_from_api_token
+from models.user import User
+
+# How long responses are kept for retries, in seconds
+IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL_SECONDS", "86400"))
+
+# How long a key is held for a request that is still being handled, in seconds. If the server stops before the
+# request finishes, the key can be used again after this.
+IDEMPOTENCY_KEY_LOCK_TIMEOUT = int(os.environ.get("IDEMPOTENCY_KEY_LOCK_TIMEOUT_SECONDS", "60"))
+
+# The most expired keys deleted each time a key is used, so the table is cleaned up a little at a time
+IDEMPOTENCY_KEY_PURGE_BATCH_SIZE = 100
+
+# How many times a key is claimed again when the request that held it gives it up at the same time
+IDEMPOTENCY_KEY_CLAIM_ATTEMPTS = 3
+
+# The header sent with replayed responses
+IDEMPOTENT_REPLAYED_HEADER = "Idempotent-Replayed"
+
+
+class IdempotentReplay(Exception):
+    """
+    Raised to answer a retried request with the response stored for the first attempt.
+    """
+
+    def __init__(self, status_code: int, body: bytes) -> None:
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.body = body
+
+
+def replay_idempotent_response(_: Request, replay: IdempotentReplay) -> Response:
+    """
+    The exception handler for IdempotentReplay, that sends the stored response.
+
+    :param Request _: The request.
+    :param IdempotentReplay replay: The stored response.
+    :return: The stored response.
+    :rtype: Response
+    """
+    return Response(
+        replay.body,
+        status_code=replay.status_code,
+        media_type="application/json",
+        headers={IDEMPOTENT_REPLAYED_HEADER: "true"},
+    )
+
+
+def hash_value(*parts: bytes) -> bytes:
+    """
+    Hashes values into a compact, fixed size key.
+
+    :param bytes parts: The values to hash.
+    :return: A 16 byte hash.
+    :rtype: bytes
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        # Prefix each part with its length, so different parts can't run together into the same hash
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.digest()
+
+
+def claim_idempotency_key(db: Session, key_hash: bytes, request_hash: bytes) -> Optional[DBIdempotencyKey]:
+    """
+    Claims an idempotency key for a request, unless it has already been claimed.
+
+    :param Session db: The database session.
+    :param bytes key_hash: The hash of the user and the key.
+    :param bytes request_hash: The hash of the request.
+    :return: None if the key was claimed for this request, otherwise the existing key.
+    :rtype: Optional[DBIdempotencyKey]
+    :raises HTTPException: If the key is given up and claimed again by other requests on every attempt.
+    """
+    now = int(time.time())
+
+    # Delete a batch of expired keys, including this one if it has expired
+    expired = select(DBIdempotencyKey.key_hash).where(DBIdempotencyKey.expires_at < now)
+    db.execute(
+        delete(DBIdempotencyKey).where(DBIdempotencyKey.key_hash.in_(expired.limit(IDEMPOTENCY_KEY_PURGE_BATCH_SIZE)))
+    )
+    db.execute(delete(DBIdempotencyKey).where(DBIdempotencyKey.key_hash == key_hash, DBIdempotencyKey.expires_at < now))
+
+    for _ in range(IDEMPOTENCY_KEY_CLAIM_ATTEMPTS):
+        # Claim the key with a row that has no response yet. If two requests race for a key, only one insert wins.
+        result = db.execute(
+            insert(DBIdempotencyKey)
+            .values(key_hash=key_hash, request_hash=request_hash, expires_at=now + IDEMPOTENCY_KEY_LOCK_TIMEOUT)
+            .on_conflict_do_nothing()
+        )
+        db.commit()
+        if result.rowcount == 1:
+            return None
+
+        # Get the existing key. If the request that claimed it failed and gave it up in the meantime, try again.
+        existing = db.get(DBIdempotencyKey, key_hash, populate_existing=True)
+        if existing is not None:
+            return existing
+
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT, detail="A request with this idempotency key is still being handled"
+    )
+
+
+class IdempotentRequest:
+    """
+    A request that may have an idempotency key. Handlers save their response with this, so retries can get it.
+    """
+
+    def __init__(self, db: Session, key_hash: Optional[bytes]) -> None:
+        """
+        :param Session db: The database session.
+        :param Optional[bytes] key_hash: The hash of the user and the key, or None if the request has no key.
+        """
+        self.db = db
+        self.key_hash = key_hash
+        self.saved = False
+
+    def save(self, status_code: int, response: BaseModel) -> BaseModel:
+        """
+        Saves the response to the request, if it has an idempotency key.
+
+        :param int status_code: The status code of the response.
+        :param BaseModel response: The response.
+        :return: The response, so handlers can return the result of this.
+        :rtype: BaseModel
+        """
+        if self.key_hash is not None:
+            self.db.execute(
+                update(DBIdempotencyKey)
+                .where(DBIdempotencyKey.key_hash == self.key_hash)
+                .values(
+                    status_code=status_code,
+                    response_body=response.model_dump_json(by_alias=True, exclude_none=True).encode(),
+                    expires_at=int(time.time()) + IDEMPOTENCY_KEY_TTL,
+                )
+            )
+            self.db.commit()
+            self.saved = True
+        return response
+
+    def release(self) -> None:
+        """
+        Gives up the idempotency key if no response was saved, so the request can be retried with the same key.
+        """
+        if self.key_hash is not None and not self.saved:
+            self.db.rollback()
+            self.db.execute(
+                delete(DBIdempotencyKey).where(
+                    DBIdempotencyKey.key_hash == self.key_hash, DBIdempotencyKey.status_code.is_(None)
+                )
+            )
+            self.db.commit()
+
+
+async def get_idempotent_request(
+    request: Request,
+    user: Annotated[User, Depends(get_current_user_from_api_token)],
+    idempotency_key: Annotated[
+        Optional[str],
+        Header(
+            description="A unique key for this request, such as a UUID. If a request with the same key was "
+            "already handled successfully, its response is sent again without creating anything. Use the same key "
+            "when retrying a request.",
+            min_length=1,
+            max_length=255,
+        ),
+    ] = None,
+    db: Session = Depends(get_db),
+) -> AsyncIterator[IdempotentRequest]:
+    """
+    A dependency that handles the Idempotency-Key header. If the key has a stored response, that response is sent
+    before the request is validated or handled. This is resolved before the request body is validated.
+
+    This is async so it can read the request body, and runs its database work on a worker thread.
+
+    :return: The request, for the handler to save its response with.
+    :rtype: AsyncIterator[IdempotentRequest]
+    """
+    if idempotency_key is None:
+        yield IdempotentRequest(db, None)
+        return
+
+    # The request hash covers what was asked for, so a key can't be reused for a different request
+    key_hash = hash_value(str(user.id).encode(), idempotency_key.encode())
+    request_hash = hash_value(request.method.encode(), request.url.path.encode(), await request.body())
+
+    existing = await anyio.to_thread.run_sync(claim_idempotency_key, db, key_hash, request_hash)
+    if existing is not None:
+        if existing.request_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="This idempotency key was already used for a different request",
+            )
+        if existing.status_code is None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this idempotency key is still being handled",
+            )
+        raise IdempotentReplay(existing.status_code, existing.response_body)
+
+    idempotent_request = IdempotentRequest(db, key_hash)
+    try:
+        yield idempotent_request
+    finally:
+        # Give up the key even if the request was cancelled
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(idempotent_request.release)
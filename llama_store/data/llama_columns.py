@@ -0,0 +1,238 @@
+"""
+A columnar, in-memory copy of the llamas. Read replicas use this to list llamas without going through the database
+or creating a model for every llama.
+
+Each llama field is held in a compact array, with one item for each llama, in llama ID order. Colors are stored as
+a small code, and names are UTF-8 encoded into one bytes string, with an array of where each name starts. Filtering,
+sorting and paging work on whole columns at once, using NumPy, and only the llamas in the requested page are turned
+into Llama models. If NumPy is not installed, the same work is done in pure Python.
+"""
+
+# pylint: disable=invalid-name
+
+import operator
+from array import array
+from bisect import bisect_left
+from functools import cached_property, lru_cache
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from models.llama import Llama, LlamaColor, LlamaQuery
+
+# The llama colors, indexed by their color code
+COLORS = list(LlamaColor)
+
+# The color code for each color value
+COLOR_CODES = {color.value: code for code, color in enumerate(COLORS)}
+
+# A condition on a column, as the column, the comparison, and the value to compare with
+Condition = Tuple[array, Callable[[object, object], object], int]
+
+
+@lru_cache(maxsize=None)
+def get_numpy():
+    """
+    Gets NumPy, if it is installed. NumPy is imported when it is first needed, as it is slow to import.
+
+    :return: The numpy module, or None if it isn't installed, so the pure Python fallback is used.
+    """
+    try:
+        import numpy  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return numpy
+
+
+class LlamaColumns:
+    """
+    The llamas, stored as one array for each field. This is shared between requests, so must not be changed once
+    it has been created.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, str, int, str, int, int]]) -> None:
+        """
+        Creates the columns from rows of llama ID, name, age, color, rating and version.
+
+        :param Iterable rows: The rows, in ascending llama ID order.
+        """
+        self.llama_ids = array("q")
+        self.ages = array("q")
+        self.ratings = array("b")
+        self.color_codes = array("b")
+        self.versions = array("q")
+        self.name_offsets = array("q", [0])
+        names = bytearray()
+
+        for llama_id, name, age, color, rating, version in rows:
+            self.llama_ids.append(llama_id)
+            self.ages.append(age)
+            self.ratings.append(rating)
+            self.color_codes.append(COLOR_CODES[color])
+            self.versions.append(version)
+            names += name.encode()
+            self.name_offsets.append(len(names))
+
+        self.names = bytes(names)
+
+    def __len__(self) -> int:
+        return len(self.llama_ids)
+
+    def get_name(self, row: int) -> bytes:
+        """
+        Gets the UTF-8 encoded name of the llama in a row.
+
+        :param int row: The row.
+        :return: The encoded name.
+        :rtype: bytes
+        """
+        return self.names[self.name_offsets[row] : self.name_offsets[row + 1]]
+
+    def get_llama(self, row: int) -> Llama:
+        """
+        Creates the llama model for a row. The values were validated when they were written, so they are not
+        validated again.
+
+        :param int row: The row.
+        :return: The llama.
+        :rtype: Llama
+        """
+        return Llama.model_construct(
+            llama_id=self.llama_ids[row],
+            name=self.get_name(row).decode(),
+            age=self.ages[row],
+            color=COLORS[self.color_codes[row]],
+            rating=self.ratings[row],
+            version=self.versions[row],
+        )
+
+    def get_llama_by_id(self, llama_id: int) -> Optional[Llama]:
+        """
+        Gets a llama by ID. The IDs are sorted, so this is a binary search.
+
+        :param int llama_id: The ID of the llama to get.
+        :return: The llama, or None if there is no llama with that ID.
+        :rtype: Optional[Llama]
+        """
+        row = bisect_left(self.llama_ids, llama_id)
+        if row == len(self) or self.llama_ids[row] != llama_id:
+            return None
+        return self.get_llama(row)
+
+    def get_llama_by_name(self, name: str) -> Optional[Llama]:
+        """
+        Gets a llama by name, by searching the packed names for one that starts and ends where a name does.
+
+        :param str name: The name of the llama to get.
+        :return: The llama, or None if there is no llama with that name.
+        :rtype: Optional[Llama]
+        """
+        encoded = name.encode()
+        position = self.names.find(encoded)
+        while position != -1:
+            # Check each name that starts here, as empty names share their start with the next name
+            row = bisect_left(self.name_offsets, position)
+            while row < len(self) and self.name_offsets[row] == position:
+                if self.name_offsets[row + 1] == position + len(encoded):
+                    return self.get_llama(row)
+                row += 1
+            position = self.names.find(encoded, position + 1)
+        return None
+
+    @cached_property
+    def name_ranks(self) -> array:
+        """
+        The position of each llama's name in name order, used to sort by name. This is only worked out the first
+        time llamas are sorted by name. The UTF-8 bytes sort in the same order as the names, and as SQLite sorts them.
+
+        :return: The rank of each row's name.
+        :rtype: array
+        """
+        ranks = array("q", bytes(8 * len(self)))
+        for rank, row in enumerate(sorted(range(len(self)), key=self.get_name)):
+            ranks[row] = rank
+        return ranks
+
+    def get_conditions(self, query: LlamaQuery) -> List[Condition]:
+        """
+        Gets the conditions a llama must match for a query.
+
+        :param LlamaQuery query: The query.
+        :return: The conditions.
+        :rtype: List[Condition]
+        """
+        conditions = [
+            (self.color_codes, operator.eq, None if query.color is None else COLOR_CODES[query.color.value]),
+            (self.ages, operator.ge, query.min_age),
+            (self.ages, operator.le, query.max_age),
+            (self.ratings, operator.ge, query.min_rating),
+            (self.ratings, operator.le, query.max_rating),
+        ]
+        return [condition for condition in conditions if condition[2] is not None]
+
+    def get_sort_column(self, query: LlamaQuery) -> Optional[array]:
+        """
+        Gets the column to sort by for a query.
+
+        :param LlamaQuery query: The query.
+        :return: The column, or None to sort by llama ID, which is the order the rows are already in.
+        :rtype: Optional[array]
+        """
+        if query.sort.field == "name":
+            return self.name_ranks
+        return {"age": self.ages, "rating": self.ratings}.get(query.sort.field)
+
+    def select_rows_vectorized(self, query: LlamaQuery) -> Sequence[int]:
+        """
+        Gets the rows that match a query, in order, using NumPy. The arrays are used by NumPy without being copied.
+
+        :param LlamaQuery query: The query.
+        :return: The matching rows.
+        :rtype: Sequence[int]
+        """
+        np = get_numpy()
+
+        # Filter the rows, one whole column at a time
+        mask = np.ones(len(self), dtype=bool)
+        for column, compare, value in self.get_conditions(query):
+            mask &= compare(np.frombuffer(column, dtype=column.typecode), value)
+        rows = np.flatnonzero(mask)
+
+        # Sort the matching rows. The sort is stable, so llamas that sort the same stay in ID order.
+        column = self.get_sort_column(query)
+        if column is None:
+            return rows[::-1] if query.sort.descending else rows
+        keys = np.frombuffer(column, dtype=column.typecode)[rows].astype(np.int64)
+        return rows[np.argsort(-keys if query.sort.descending else keys, kind="stable")]
+
+    def select_rows(self, query: LlamaQuery) -> Sequence[int]:
+        """
+        Gets the rows that match a query, in order, in pure Python.
+
+        :param LlamaQuery query: The query.
+        :return: The matching rows.
+        :rtype: Sequence[int]
+        """
+        # Filter the rows, one column at a time
+        rows: Sequence[int] = range(len(self))
+        for column, compare, value in self.get_conditions(query):
+            rows = [row for row in rows if compare(column[row], value)]
+
+        # Sort the matching rows. Python's sort is stable, even in reverse, so llamas that sort the same stay in ID
+        # order.
+        column = self.get_sort_column(query)
+        if column is None:
+            return rows[::-1] if query.sort.descending else rows
+        return sorted(rows, key=column.__getitem__, reverse=query.sort.descending)
+
+    def query(self, query: LlamaQuery) -> Tuple[int, List[Llama]]:
+        """
+        Filters, sorts and pages the llamas.
+
+        :param LlamaQuery query: The query.
+        :return: The number of llamas that match the filter, and the llamas in the requested page.
+        :rtype: Tuple[int, List[Llama]]
+        """
+        rows = self.select_rows_vectorized(query) if get_numpy() is not None else self.select_rows(query)
+
+        # Only create models for the llamas in the page
+        end = None if query.limit is None else query.offset + query.limit
+        return len(rows), [self.get_llama(int(row)) for row in rows[query.offset : end]]
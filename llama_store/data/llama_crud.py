@@ -4,11 +4,14 @@ This file contains the functions that will be used to interact with llamas in th
 
 # pylint: disable=invalid-name
 
-from typing import List
+from typing import List, Optional, Tuple, Union
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.orm import Session
 
-from data.schema import DBLlama
-from models.llama import Llama, LlamaCreate
+from data.llama_stats import load_llama_stats
+from data.replica import get_replica_snapshot
+from data.schema import DBLlama, DBLlamaPicture
+from models.llama import Llama, LlamaCreate, LlamaPatch, LlamaQuery, LlamaStats
 
 
 def get_db_llama_by_id(db: Session, llama_id: int) -> DBLlama:
@@ -32,6 +35,11 @@ def get_llama_by_id(db: Session, llama_id: int) -> Llama:
     :return: The llama with the given ID.
     :rtype: Llama
     """
+    # Read replicas have all the llamas in memory
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        return snapshot.llamas.get_llama_by_id(llama_id)
+
     db_llama = get_db_llama_by_id(db, llama_id)
     return None if db_llama is None else Llama.model_validate(db_llama)
 
@@ -45,6 +53,10 @@ def get_llama_by_name(db: Session, llama_name: str) -> Llama:
     :return: The llama with the given name.
     :rtype: Llama
     """
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        return snapshot.llamas.get_llama_by_name(llama_name)
+
     db_llama = db.query(DBLlama).filter(DBLlama.name == llama_name).first()
     return None if db_llama is None else Llama.model_validate(db_llama)
 
@@ -57,7 +69,64 @@ def get_all_llamas(db: Session) -> List[Llama]:
     :return: All llamas.
     :rtype: List[Llama]
     """
-    return list(map(Llama.model_validate, db.query(DBLlama).all()))
+    return get_llamas(db, LlamaQuery())[1]
+
+
+def get_llamas(db: Session, query: LlamaQuery) -> Tuple[int, List[Llama]]:
+    """
+    Get a filtered, sorted page of llamas.
+
+    :param Session db: The database session.
+    :param LlamaQuery query: The filter, sort order and page.
+    :return: The number of llamas that match the filter, and the llamas in the page.
+    :rtype: Tuple[int, List[Llama]]
+    """
+    # Read replicas filter and sort their in-memory columns
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        return snapshot.llamas.query(query)
+
+    # Build the filter
+    conditions = [
+        DBLlama.color == query.color.value if query.color is not None else None,
+        DBLlama.age >= query.min_age if query.min_age is not None else None,
+        DBLlama.age <= query.max_age if query.max_age is not None else None,
+        DBLlama.rating >= query.min_rating if query.min_rating is not None else None,
+        DBLlama.rating <= query.max_rating if query.max_rating is not None else None,
+    ]
+    statement = select(DBLlama).where(*[condition for condition in conditions if condition is not None])
+
+    # Sort by the requested field, then by ID, so llamas that sort the same are always in the same order
+    column = getattr(DBLlama, query.sort.field)
+    order_by = [column.desc() if query.sort.descending else column]
+    if query.sort.field != "llama_id":
+        order_by.append(DBLlama.llama_id)
+    statement = statement.order_by(*order_by)
+
+    llamas = list(map(Llama.model_validate, db.execute(statement.offset(query.offset).limit(query.limit)).scalars()))
+
+    # Only count the matching llamas separately if this is a page of them
+    if query.offset == 0 and (query.limit is None or len(llamas) < query.limit):
+        return len(llamas), llamas
+    # pylint: disable-next=not-callable
+    total = db.execute(select(func.count()).select_from(statement.order_by(None).subquery())).scalar()
+    return total, llamas
+
+
+def get_llama_stats(db: Session) -> LlamaStats:
+    """
+    Get statistics about all the llamas.
+
+    :param Session db: The database session.
+    :return: The statistics.
+    :rtype: LlamaStats
+    """
+    # Read replicas load the statistics along with the llamas
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        return snapshot.llama_stats
+
+    return load_llama_stats(db)
 
 
 def create_llama(db: Session, llama: LlamaCreate) -> Llama:
@@ -76,32 +145,69 @@ def create_llama(db: Session, llama: LlamaCreate) -> Llama:
     return Llama.model_validate(db_llama)
 
 
-def update_llama(db: Session, llama: LlamaCreate, llama_id: int) -> Llama:
+def update_llama(
+    db: Session, llama: Union[LlamaCreate, LlamaPatch], llama_id: int, versions: Optional[List[int]] = None
+) -> Optional[Llama]:
     """
-    Update a llama.
+    Update a llama, and bump its version. Only the fields set on the llama are written, so a patch only touches the
+    columns it changes. The version is checked in the same UPDATE statement that writes the llama, so concurrent
+    updates can't overwrite each other without a lock.
 
     :param Session db: The database session.
-    :param Llama llama: The llama to update.
-    :return: The updated llama.
-    :rtype: Llama
+    :param Union[LlamaCreate, LlamaPatch] llama: The llama to update, or the changes to make to it.
+    :param int llama_id: The ID of the llama to update.
+    :param Optional[List[int]] versions: The versions the llama must be at to be updated, or None to update it
+        whatever its version.
+    :return: The updated llama, or None if the llama doesn't exist or isn't at one of the versions.
+    :rtype: Optional[Llama]
     """
-    db_llama = get_db_llama_by_id(db, llama_id)
-    db_llama.name = llama.name
-    db_llama.age = llama.age
-    db_llama.color = llama.color
-    db_llama.rating = llama.rating
+    conditions = [DBLlama.llama_id == llama_id]
+    if versions is not None:
+        conditions.append(DBLlama.version.in_(versions))
+
+    # A patch that changes nothing isn't written, so the version and change log stay as they are
+    values = llama.model_dump(exclude_unset=True)
+    if not values:
+        db_llama = db.execute(select(DBLlama).where(*conditions)).scalar()
+        return None if db_llama is None else Llama.model_validate(db_llama)
+
+    # Nothing is updated if the version has moved on
+    statement = (
+        update(DBLlama)
+        .where(*conditions)
+        .values(**values, version=DBLlama.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if db.execute(statement).rowcount == 0:
+        db.rollback()
+        return None
+
+    # Read the llama back in the same transaction, so it is the llama as this update left it
+    updated_llama = Llama.model_validate(db.get(DBLlama, llama_id, populate_existing=True))
     db.commit()
-    db.refresh(db_llama)
-    return Llama.model_validate(db_llama)
+    return updated_llama
 
 
-def delete_llama(db: Session, llama_id: int) -> None:
+def delete_llama(db: Session, llama_id: int) -> Optional[str]:
     """
-    Delete a llama.
+    Delete a llama, along with its picture, in a single transaction.
+
+    The picture file is not deleted, as that can't be rolled back. Delete the file once this has returned.
 
     :param Session db: The database session.
     :param int llama_id: The ID of the llama to delete.
+    :return: The location of the llama's picture file, or None if the llama didn't have a picture.
+    :rtype: str
     """
-    db_llama = get_db_llama_by_id(db, llama_id)
-    db.delete(db_llama)
+    # Get the location of the picture file before the row is deleted
+    image_file_location = db.execute(
+        select(DBLlamaPicture.image_file_location).where(DBLlamaPicture.llama_id == llama_id)
+    ).scalar()
+
+    # The foreign key deletes the picture row along with the llama. The picture row is also deleted here, so this
+    # doesn't rely on foreign keys being turned on for the connection.
+    db.execute(delete(DBLlamaPicture).where(DBLlamaPicture.llama_id == llama_id))
+    db.execute(delete(DBLlama).where(DBLlama.llama_id == llama_id))
     db.commit()
+
+    return image_file_location
@@ -4,22 +4,29 @@ This file contains the functions that will be used to interact with llamas in th
 
 # pylint: disable=invalid-name
 
+from typing import List, Optional, Set, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
 
-from data.schema import DBLlamaPicture
-from models.llama_picture import LlamaPicture
+from data.replica import get_replica_snapshot
+from data.schema import DBLlama, DBLlamaPicture
+from models.llama import LlamaColor
+from models.llama_picture import LlamaPicture, LlamaPictureMetadata
 
 
 def get_db_llama_picture_by_id(db: Session, llama_id: int) -> DBLlamaPicture:
     """
     Get a llama picture by ID from the database as a database record.
 
+    Each llama has at most one picture, so this is a single lookup on the unique llama ID index.
+
     :param Session db: The database session.
     :param int llama_picture_id: The ID of the llama picture to get.
     :return: The llama picture with the given ID.
     :rtype: DBLlamaPicture
     """
-    return db.query(DBLlamaPicture).filter(DBLlamaPicture.llama_id == llama_id).first()
+    return db.execute(select(DBLlamaPicture).where(DBLlamaPicture.llama_id == llama_id)).scalar_one_or_none()
 
 
 def get_llama_picture_by_id(db: Session, llama_id: int) -> LlamaPicture:
@@ -35,32 +42,94 @@ def get_llama_picture_by_id(db: Session, llama_id: int) -> LlamaPicture:
     return None if db_llama_picture is None else LlamaPicture.model_validate(db_llama_picture)
 
 
-def create_or_update_llama_picture(db: Session, llama_id: int, file_path: str) -> LlamaPicture:
+def get_llama_and_picture_location(db: Session, llama_id: int) -> Tuple[bool, Optional[str]]:
     """
-    Create a new llama picture. If one already exists for this llama, overwrite it.
+    Check a llama exists, and get the location of its picture, in a single query.
 
     :param Session db: The database session.
     :param int llama_id: The ID of the llama.
-    :param str file_path: The path to the llama picture file.
-    :return: The llama picture.
-    :rtype: LlamaPicture
+    :return: Whether the llama exists, and the location of its picture, or None if it doesn't have one.
+    :rtype: Tuple[bool, Optional[str]]
     """
-    # Get the llama picture from the database
-    db_llama_picture = get_db_llama_picture_by_id(db, llama_id)
+    row = db.execute(
+        select(DBLlama.llama_id, DBLlamaPicture.image_file_location)
+        .outerjoin(DBLlamaPicture, DBLlamaPicture.llama_id == DBLlama.llama_id)
+        .where(DBLlama.llama_id == llama_id)
+    ).first()
+    return (False, None) if row is None else (True, row.image_file_location)
+
+
+def get_llama_ids_with_pictures(db: Session, llama_ids: Optional[List[int]] = None) -> Set[int]:
+    """
+    Get the IDs of the llamas that have a picture.
+
+    :param Session db: The database session.
+    :param List[int] llama_ids: The IDs of the llamas to check, or None to check all llamas.
+    :return: The IDs of the llamas with a picture.
+    :rtype: Set[int]
+    """
+    # Read replicas already have the IDs in memory
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        with_pictures = snapshot.llama_ids_with_pictures
+        return set(with_pictures if llama_ids is None else with_pictures.intersection(llama_ids))
+
+    query = select(DBLlamaPicture.llama_id)
+    if llama_ids is not None:
+        query = query.where(DBLlamaPicture.llama_id.in_(llama_ids))
+    return set(db.execute(query).scalars())
+
+
+def get_llama_pictures(
+    db: Session, llama_ids: Optional[List[int]] = None, color: Optional[LlamaColor] = None
+) -> List[LlamaPicture]:
+    """
+    Get the pictures for a set of llamas, ordered by llama ID. Llamas without a picture are skipped.
+
+    :param Session db: The database session.
+    :param List[int] llama_ids: The IDs of the llamas to get the pictures for, or None for all llamas.
+    :param LlamaColor color: Only get pictures for llamas of this color, or None for all colors.
+    :return: The llama pictures.
+    :rtype: List[LlamaPicture]
+    """
+    query = db.query(DBLlamaPicture)
+    if llama_ids is not None:
+        query = query.filter(DBLlamaPicture.llama_id.in_(llama_ids))
+    if color is not None:
+        query = query.join(DBLlama, DBLlama.llama_id == DBLlamaPicture.llama_id).filter(DBLlama.color == color.value)
+    return list(map(LlamaPicture.model_validate, query.order_by(DBLlamaPicture.llama_id).all()))
 
-    # If the llama picture does not exist, create it
-    if db_llama_picture is None:
-        db_llama_picture = DBLlamaPicture(llama_id=llama_id, image_file_location=file_path)
-        db.add(db_llama_picture)
-        db.commit()
-    else:
-        # If the llama picture does exist, update it
-        db_llama_picture.image_file_location = file_path
-        db.commit()
 
-    # Refresh the llama picture from the database
-    db.refresh(db_llama_picture)
-    return LlamaPicture.model_validate(db_llama_picture)
+def create_or_update_llama_picture(
+    db: Session, llama_id: int, file_path: str, metadata: Optional[LlamaPictureMetadata] = None
+) -> None:
+    """
+    Create a new llama picture. If one already exists for this llama, overwrite it.
+
+    This is a single upsert, relying on the unique index on the llama ID, so two requests for the same llama
+    at the same time can never create two pictures.
+
+    :param Session db: The database session.
+    :param int llama_id: The ID of the llama.
+    :param str file_path: The path to the llama picture file.
+    :param LlamaPictureMetadata metadata: The details of the picture, such as the dimensions.
+    """
+    values = {"image_file_location": file_path}
+
+    # Record the details of the picture
+    if metadata is not None:
+        values.update(
+            width=metadata.width,
+            height=metadata.height,
+            byte_size=metadata.byte_size,
+            content_hash=metadata.content_hash,
+            placeholder=metadata.placeholder,
+        )
+
+    # Insert the picture, or update it if this llama already has one
+    statement = insert(DBLlamaPicture).values(llama_id=llama_id, **values)
+    db.execute(statement.on_conflict_do_update(index_elements=[DBLlamaPicture.llama_id], set_=values))
+    db.commit()
 
 
 def delete_llama_picture(db: Session, llama_picture_id: int) -> None:
@@ -70,6 +139,5 @@ def delete_llama_picture(db: Session, llama_picture_id: int) -> None:
     :param Session db: The database session.
     :param int llama_picture_id: The ID of the llama picture to delete.
     """
-    db_llama_picture = get_db_llama_picture_by_id(db, llama_picture_id)
-    db.delete(db_llama_picture)
+    db.execute(delete(DBLlamaPicture).where(DBLlamaPicture.llama_id == llama_picture_id))
     db.commit()
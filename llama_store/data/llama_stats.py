@@ -0,0 +1,76 @@
+"""
+Statistics about the llamas. These are worked out from the llama count tables, which triggers keep up to date as
+llamas are written, so getting the statistics never scans the llamas table. The count tables only have a row for
+each color, rating and age, so the time taken doesn't depend on the number of llamas.
+"""
+
+# pylint: disable=invalid-name
+
+from math import ceil
+from typing import List, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from data.schema import DBLlamaAgeCount, DBLlamaColorCount, DBLlamaRatingCount
+from models.llama import LlamaAgeStats, LlamaColor, LlamaStats
+
+# The percentiles in the age statistics, by field name
+AGE_PERCENTILES = {"p25": 25, "median": 50, "p75": 75, "p90": 90, "p99": 99}
+
+
+def get_percentile(age_counts: List[Tuple[int, int]], llama_count: int, percentile: float) -> int:
+    """
+    Gets a percentile from the number of llamas of each age, using the nearest rank.
+
+    :param List[Tuple[int, int]] age_counts: Each age, and the number of llamas of that age, in age order.
+    :param int llama_count: The total number of llamas. This must not be 0.
+    :param float percentile: The percentile, from 0 to 100.
+    :return: The youngest age that at least the percentile of llamas are no older than.
+    :rtype: int
+    """
+    rank = max(1, ceil(percentile / 100 * llama_count))
+    seen = 0
+    for age, count in age_counts:
+        seen += count
+        if seen >= rank:
+            return age
+    return age_counts[-1][0]
+
+
+def load_llama_stats(db: Session) -> LlamaStats:
+    """
+    Loads the llama statistics from the llama count tables.
+
+    :param Session db: The database session.
+    :return: The statistics.
+    :rtype: LlamaStats
+    """
+    color_counts = dict(db.execute(select(DBLlamaColorCount.color, DBLlamaColorCount.llama_count)).all())
+    rating_counts = dict(db.execute(select(DBLlamaRatingCount.rating, DBLlamaRatingCount.llama_count)).all())
+    age_counts = db.execute(
+        select(DBLlamaAgeCount.age, DBLlamaAgeCount.llama_count).order_by(DBLlamaAgeCount.age)
+    ).all()
+
+    # Every llama has one color, so the color counts add up to the number of llamas
+    llama_count = sum(color_counts.values())
+
+    # There is no average or ages without any llamas
+    average_rating = None
+    age_stats = None
+    if llama_count > 0:
+        average_rating = sum(rating * count for rating, count in rating_counts.items()) / llama_count
+        age_stats = LlamaAgeStats(
+            minimum=age_counts[0][0],
+            maximum=age_counts[-1][0],
+            mean=sum(age * count for age, count in age_counts) / llama_count,
+            **{field: get_percentile(age_counts, llama_count, value) for field, value in AGE_PERCENTILES.items()},
+        )
+
+    return LlamaStats(
+        llama_count=llama_count,
+        color_counts={color: color_counts.get(color.value, 0) for color in LlamaColor},
+        rating_counts={rating: rating_counts.get(rating, 0) for rating in range(1, 6)},
+        average_rating=average_rating,
+        age=age_stats,
+    )
@@ -0,0 +1,245 @@
+"""
+Garbage collection for llama pictures.
+
+Pictures can be orphaned in two ways. A picture row can be left behind when its llama is deleted, or when its
+file has gone missing. A picture file can be left behind when an upload fails after the file is written but before
+the row is saved. The garbage collector walks the picture rows and the stored pictures in batches, and removes
+orphans in both directions.
+
+The collector keeps its place between batches, so it can run in the background a little at a time without holding
+up requests. It can also be run in one go with the collect_picture_garbage.py script.
+
+Only one process needs to collect garbage. When the API runs with several worker processes, serve.py picks one of
+them to run the background garbage collection, and turns it off in the others.
+"""
+
+# pylint: disable=invalid-name
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+import anyio
+from sqlalchemy.orm import Session
+
+from data.database import SessionLocal
+from data.picture_memory_cache import delete_cached_llama_pictures
+from data.picture_variants import delete_llama_picture_variants
+from data.schema import DBLlama, DBLlamaPicture
+from data.storage import PictureStorage, get_picture_storage
+
+logger = logging.getLogger(__name__)
+
+# How often a background garbage collection pass starts, in seconds. 0 turns off background garbage collection.
+GC_INTERVAL = int(os.environ.get("PICTURE_GC_INTERVAL_SECONDS", "3600"))
+
+# Whether this process runs the background garbage collection. serve.py turns this off in all but one worker.
+run_in_this_process = True
+
+# Picture files without a row are only deleted once they are at least this old, in seconds, so pictures that are
+# being uploaded are never deleted before their row is saved
+GC_MIN_FILE_AGE = int(os.environ.get("PICTURE_GC_MIN_FILE_AGE_SECONDS", "3600"))
+
+# The number of rows or files checked in each batch
+GC_BATCH_SIZE = int(os.environ.get("PICTURE_GC_BATCH_SIZE", "500"))
+
+# How long each background garbage collection step can run for before it gives way to requests, in seconds
+GC_TIME_BUDGET = float(os.environ.get("PICTURE_GC_TIME_BUDGET_SECONDS", "0.5"))
+
+
+class PictureGCStats:  # pylint: disable=too-few-public-methods
+    """
+    Running totals of what the garbage collector has done.
+    """
+
+    def __init__(self) -> None:
+        self.passes = 0
+        self.rows_checked = 0
+        self.files_checked = 0
+        self.rows_deleted = 0
+        self.files_deleted = 0
+        self.bytes_reclaimed = 0
+
+    def __str__(self) -> str:
+        return (
+            f"passes={self.passes} rows_checked={self.rows_checked} files_checked={self.files_checked} "
+            f"rows_deleted={self.rows_deleted} files_deleted={self.files_deleted} "
+            f"bytes_reclaimed={self.bytes_reclaimed}"
+        )
+
+
+class PictureGarbageCollector:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """
+    Removes picture rows without a llama or a file, and picture files without a row.
+
+    Each pass first walks the picture rows in order of llama ID, then walks the stored pictures in order of
+    location. The place in each walk is kept between calls to collect, so a pass can be spread over many calls.
+    """
+
+    def __init__(
+        self,
+        storage_factory: Callable[[], PictureStorage] = get_picture_storage,
+        min_file_age: int = GC_MIN_FILE_AGE,
+        batch_size: int = GC_BATCH_SIZE,
+        dry_run: bool = False,
+    ) -> None:
+        """
+        Create the garbage collector.
+
+        :param storage_factory: A function that gets the picture storage.
+        :param int min_file_age: Only delete picture files without a row that are at least this old, in seconds.
+        :param int batch_size: The number of rows or files checked in each batch.
+        :param bool dry_run: If this is True, orphans are counted but not deleted.
+        """
+        self.stats = PictureGCStats()
+        self._storage_factory = storage_factory
+        self._min_file_age = min_file_age
+        self._batch_size = batch_size
+        self._dry_run = dry_run
+        self._last_llama_id = 0
+        self._rows_done = False
+        self._last_location: Optional[str] = None
+
+    def collect(self, db: Session, time_budget: Optional[float] = None) -> bool:
+        """
+        Collects garbage in batches until the pass is finished, or the time budget runs out. At least one batch is
+        always run.
+
+        :param Session db: The database session.
+        :param float time_budget: The number of seconds to run for, or None to finish the pass.
+        :return: True if the pass is finished, False if there is more to do.
+        :rtype: bool
+        """
+        deadline = None if time_budget is None else time.monotonic() + time_budget
+
+        while True:
+            if not self._rows_done:
+                self._collect_row_batch(db)
+            elif self._collect_file_batch(db):
+                # Both walks are finished, so start again from the beginning next time
+                self.stats.passes += 1
+                self._last_llama_id, self._rows_done, self._last_location = 0, False, None
+                return True
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def _collect_row_batch(self, db: Session) -> None:
+        """
+        Checks the next batch of picture rows, deleting those without a llama or without a stored picture.
+        """
+        storage = self._storage_factory()
+
+        # Get the next batch of rows, along with whether the llama still exists
+        rows = (
+            db.query(DBLlamaPicture, DBLlama.llama_id)
+            .outerjoin(DBLlama, DBLlama.llama_id == DBLlamaPicture.llama_id)
+            .filter(DBLlamaPicture.llama_id > self._last_llama_id)
+            .order_by(DBLlamaPicture.llama_id)
+            .limit(self._batch_size)
+            .all()
+        )
+
+        if rows:
+            self._last_llama_id = rows[-1][0].llama_id
+
+        for db_picture, existing_llama_id in rows:
+            self.stats.rows_checked += 1
+            picture_stat = storage.stat(db_picture.image_file_location)
+            if existing_llama_id is not None and picture_stat is not None:
+                continue
+
+            # The picture is orphaned, so remove the row, and the file if there is one
+            self.stats.rows_deleted += 1
+            if picture_stat is not None:
+                self.stats.files_deleted += 1
+                self.stats.bytes_reclaimed += picture_stat.size
+
+            if not self._dry_run:
+                if picture_stat is not None:
+                    storage.delete(db_picture.image_file_location)
+                db.delete(db_picture)
+                delete_llama_picture_variants(db_picture.llama_id)
+                delete_cached_llama_pictures(db_picture.llama_id)
+
+        db.commit()
+
+        if len(rows) < self._batch_size:
+            self._rows_done = True
+
+    def _collect_file_batch(self, db: Session) -> bool:
+        """
+        Checks the next batch of stored pictures, deleting those that are old enough and have no row.
+        Returns True when there are no more stored pictures to check.
+        """
+        storage = self._storage_factory()
+        pictures = storage.list_pictures(start_after=self._last_location, limit=self._batch_size)
+        if not pictures:
+            return True
+
+        # Find which of these pictures have a row, with a single query for the whole batch
+        locations = [location for location, _ in pictures]
+        referenced = {
+            location
+            for (location,) in db.query(DBLlamaPicture.image_file_location).filter(
+                DBLlamaPicture.image_file_location.in_(locations)
+            )
+        }
+
+        oldest_mtime = time.time() - self._min_file_age
+        for location, picture_stat in pictures:
+            self.stats.files_checked += 1
+            if location in referenced or picture_stat.mtime > oldest_mtime:
+                continue
+
+            self.stats.files_deleted += 1
+            self.stats.bytes_reclaimed += picture_stat.size
+            if not self._dry_run:
+                storage.delete(location)
+
+        self._last_location = locations[-1]
+        return len(pictures) < self._batch_size
+
+
+picture_garbage_collector = PictureGarbageCollector()
+
+
+def is_picture_gc_enabled() -> bool:
+    """
+    Checks if this process should run the background garbage collection.
+
+    :return: True if background garbage collection is turned on, and this process has been picked to run it.
+    :rtype: bool
+    """
+    return GC_INTERVAL > 0 and run_in_this_process
+
+
+def _collect_picture_garbage_step() -> bool:
+    """
+    Runs one time limited step of garbage collection with its own database session.
+    """
+    db = SessionLocal()
+    try:
+        return picture_garbage_collector.collect(db, time_budget=GC_TIME_BUDGET)
+    finally:
+        db.close()
+
+
+async def run_picture_garbage_collection() -> None:
+    """
+    Runs garbage collection in the background forever, starting a new pass every GC_INTERVAL seconds.
+
+    Each step runs on a worker thread for at most GC_TIME_BUDGET seconds, then gives way to requests before the
+    next step. The running totals are logged at the end of each pass.
+    """
+    while True:
+        await asyncio.sleep(GC_INTERVAL)
+
+        try:
+            while not await anyio.to_thread.run_sync(_collect_picture_garbage_step):
+                await asyncio.sleep(GC_TIME_BUDGET)
+            logger.info("Picture garbage collection finished: %s", picture_garbage_collector.stats)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Picture garbage collection failed")
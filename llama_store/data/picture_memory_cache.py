@@ -0,0 +1,122 @@
+"""
+An optional in-memory cache of llama pictures.
+
+A few llama pictures get most of the reads, so keeping the bytes of these in memory saves a database lookup and
+reading the file for every request. The cache has a budget in bytes, and evicts the least recently used pictures
+when it is full. It is turned off unless the PICTURE_MEMORY_CACHE_BYTES environment variable is set.
+
+Pictures changed through this process are removed from the cache straight away. Pictures changed by another worker
+process are served from the cache for at most PICTURE_MEMORY_CACHE_TTL_SECONDS, so cache hits never need to check
+the picture storage, which would be a request to the object store for S3 storage.
+"""
+
+import os
+import time
+from typing import NamedTuple, Optional, Tuple
+
+from data.byte_cache import ByteBudgetLRU
+from data.storage import PictureStorage
+from http_caching import make_etag
+
+# The maximum total size of the pictures held in memory, in bytes. 0 turns the cache off.
+MAX_PICTURE_MEMORY_CACHE_BYTES = int(os.environ.get("PICTURE_MEMORY_CACHE_BYTES", "0"))
+
+# Pictures bigger than this are always served from the picture storage
+MAX_CACHED_PICTURE_BYTES = int(os.environ.get("PICTURE_MEMORY_CACHE_MAX_ITEM_BYTES", str(1024 * 1024)))
+
+# How long a picture is served from the cache before it is read again, in seconds
+PICTURE_MEMORY_CACHE_TTL = float(os.environ.get("PICTURE_MEMORY_CACHE_TTL_SECONDS", "5"))
+
+# A cached picture is identified by the llama ID, the requested width and height, and the format
+CachedPictureKey = Tuple[int, int, int, str]
+
+
+class CachedPicture(NamedTuple):
+    """
+    The bytes of a picture, along with the details needed to send it.
+    """
+
+    body: bytes
+    media_type: str
+    storage: PictureStorage
+    location: str
+    mtime: float
+    etag: str
+    expires_at: float
+
+
+picture_cache = ByteBudgetLRU(MAX_PICTURE_MEMORY_CACHE_BYTES)
+
+
+def is_picture_memory_cache_enabled() -> bool:
+    """
+    Checks if the in-memory picture cache is turned on.
+
+    :return: True if the cache is turned on.
+    :rtype: bool
+    """
+    return picture_cache.max_bytes > 0
+
+
+def get_cached_picture(key: CachedPictureKey) -> Optional[CachedPicture]:
+    """
+    Gets a picture from the cache. Pictures that have been cached for longer than the TTL are removed, so
+    pictures changed by another process are read again.
+
+    :param key: The llama ID, width, height and format of the picture.
+    :return: The cached picture, or None if it is not cached or has expired.
+    :rtype: CachedPicture
+    """
+    cached = picture_cache.get(key)
+    if cached is None:
+        return None
+
+    if time.monotonic() >= cached.expires_at:
+        picture_cache.remove_where(lambda cached_key: cached_key == key)
+        return None
+
+    return cached
+
+
+def load_picture_into_cache(
+    key: CachedPictureKey, storage: PictureStorage, location: str, media_type: str
+) -> Optional[CachedPicture]:
+    """
+    Reads a picture from a picture storage, and adds it to the cache if it is small enough.
+
+    :param key: The llama ID, width, height and format of the picture.
+    :param PictureStorage storage: The storage the picture is in.
+    :param str location: The location of the picture in the storage.
+    :param str media_type: The media type of the picture.
+    :return: The cached picture, or None if the picture is too big to cache.
+    :rtype: CachedPicture
+    """
+    picture_stat = storage.stat(location)
+    if picture_stat is None:
+        raise FileNotFoundError(location)
+    if picture_stat.size > MAX_CACHED_PICTURE_BYTES:
+        return None
+
+    with storage.open(location) as file:
+        body = file.read()
+
+    cached = CachedPicture(
+        body=body,
+        media_type=media_type,
+        storage=storage,
+        location=location,
+        mtime=picture_stat.mtime,
+        etag=make_etag(picture_stat.mtime, picture_stat.size),
+        expires_at=time.monotonic() + PICTURE_MEMORY_CACHE_TTL,
+    )
+    picture_cache.put(key, cached, len(body))
+    return cached
+
+
+def delete_cached_llama_pictures(llama_id: int) -> None:
+    """
+    Removes all the cached pictures for a llama. Call this whenever the picture changes.
+
+    :param int llama_id: The ID of the llama.
+    """
+    picture_cache.remove_where(lambda key: key[0] == llama_id)
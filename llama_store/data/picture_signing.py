@@ -0,0 +1,139 @@
+"""
+Signed, time limited URLs for llama pictures.
+
+A signed URL lets anyone who has it download a llama picture until it expires, without an API token. This means
+picture requests can be authorized without decoding a JWT or looking up the user, and can be cached by a CDN.
+
+URLs are signed with an HMAC using a key derived from the secret in the secrets table. The secret is loaded once
+and kept in memory, so checking a signature never touches the database.
+"""
+
+# pylint: disable=invalid-name
+
+import base64
+import functools
+import hashlib
+import hmac
+import os
+import time
+from typing import Annotated, Optional
+
+from fastapi import Depends, HTTPException, Path, Query, Request, status
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy.orm import Session
+
+from data.database import SessionLocal, get_db
+from data.security import optional_bearer_scheme
+from data.user_crud import get_current_user_from_api_token, get_secret_key
+
+# How long signed picture URLs are valid for, in seconds. URLs are valid for between this and twice this long.
+PICTURE_URL_EXPIRY = int(os.environ.get("PICTURE_URL_EXPIRY_SECONDS", "300"))
+
+
+@functools.lru_cache()
+def get_picture_signing_key() -> bytes:
+    """
+    Gets the key used to sign picture URLs. This is derived from the secret key, so picture signatures can never be
+    used as, or confused with, JWT signatures.
+
+    :return: The signing key.
+    :rtype: bytes
+    """
+    db = SessionLocal()
+    try:
+        secret_key = get_secret_key(db)
+    finally:
+        db.close()
+
+    return hmac.new(secret_key.encode(), b"llama-picture-url", hashlib.sha256).digest()
+
+
+def create_picture_signature(llama_id: int, expires: int) -> str:
+    """
+    Creates the signature for a llama picture URL.
+
+    :param int llama_id: The ID of the llama.
+    :param int expires: The time the URL expires, as a Unix timestamp.
+    :return: The signature.
+    :rtype: str
+    """
+    digest = hmac.new(get_picture_signing_key(), f"{llama_id}:{expires}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def get_picture_url_expiry() -> int:
+    """
+    Gets the expiry time for picture URLs created now.
+
+    The expiry time is rounded up, so every URL created for a picture in the same window is the same. This lets
+    clients and CDNs cache the picture using the URL.
+
+    :return: The expiry time, as a Unix timestamp.
+    :rtype: int
+    """
+    return (int(time.time()) // PICTURE_URL_EXPIRY + 2) * PICTURE_URL_EXPIRY
+
+
+def create_signed_picture_url(request: Request, llama_id: int) -> str:
+    """
+    Creates a signed URL for a llama's picture.
+
+    :param Request request: The current request, used to get the base URL of the API.
+    :param int llama_id: The ID of the llama.
+    :return: The signed URL.
+    :rtype: str
+    """
+    expires = get_picture_url_expiry()
+    signature = create_picture_signature(llama_id, expires)
+    return f"{request.url_for('get_llama_picture', llama_id=llama_id)}?expires={expires}&signature={signature}"
+
+
+def is_picture_signature_valid(llama_id: int, expires: int, signature: str) -> bool:
+    """
+    Checks the signature for a llama picture URL, and that it hasn't expired. The signature is compared in
+    constant time.
+
+    :param int llama_id: The ID of the llama.
+    :param int expires: The time the URL expires, as a Unix timestamp.
+    :param str signature: The signature from the URL.
+    :return: True if the signature is valid and has not expired.
+    :rtype: bool
+    """
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(create_picture_signature(llama_id, expires), signature)
+
+
+def authorize_llama_picture_request(
+    llama_id: Annotated[int, Path()],
+    token: Annotated[Optional[HTTPAuthorizationCredentials], Depends(optional_bearer_scheme)],
+    expires: Annotated[
+        Optional[int], Query(description="The expiry time of a signed picture URL. Use this with signature.")
+    ] = None,
+    signature: Annotated[
+        Optional[str], Query(description="The signature of a signed picture URL. Use this instead of an API token.")
+    ] = None,
+    db: Session = Depends(get_db),
+) -> Optional[int]:
+    """
+    Authorizes a request for a llama picture, using either a signed URL or an API token.
+
+    :param int llama_id: The ID of the llama.
+    :param HTTPAuthorizationCredentials token: The API token, if one was sent.
+    :param int expires: The expiry time of the signed URL, if one was used.
+    :param str signature: The signature of the signed URL, if one was used.
+    :param Session db: The database session, only used if an API token is sent.
+    :return: The expiry time of the signed URL, or None if an API token was used.
+    :rtype: int
+    """
+    # Signed URLs are checked without going to the database
+    if signature is not None and expires is not None:
+        if not is_picture_signature_valid(llama_id, expires, signature):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired picture URL")
+        return expires
+
+    # Otherwise, check the API token in the same way as the other endpoints
+    if token is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authenticated")
+    get_current_user_from_api_token(token, db)
+    return None
@@ -0,0 +1,341 @@
+"""
+Methods for creating resized and transcoded variants of llama pictures.
+
+Variants are generated once in a pool of worker threads, and stored in an on-disk cache on each API node, wherever
+the pictures themselves are stored.
+When the cache grows beyond its byte budget, the least recently used variants are deleted. Variants for a llama
+are invalidated whenever the llama's picture changes or is deleted. Each llama has a generation that is bumped when
+its variants are invalidated, so a variant of the old picture that is still being generated is never added to the
+cache.
+
+Pictures are stored as PNGs, but can be served as WebP, or AVIF if the installed Pillow supports it, to clients
+that ask for these formats in their Accept header.
+
+Pillow is slow to import, so it is imported the first time it is needed rather than when the API starts.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
+import glob
+import hashlib
+import io
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from data.byte_cache import ByteBudgetLRU
+from data.storage import FileSystemStorage, get_picture_storage
+from http_caching import make_etag, parse_quality_values
+
+# The root path for all the llama picture variants
+VARIANT_ROOT_PATH = ".appdata/llama_store_data/variants"
+
+# The maximum size of the variant cache on disk, in bytes
+MAX_VARIANT_CACHE_BYTES = int(os.environ.get("PICTURE_VARIANT_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# The number of worker threads used to generate variants
+VARIANT_WORKERS = int(os.environ.get("PICTURE_VARIANT_WORKERS", "2"))
+
+# The largest width or height that can be requested for a variant
+MAX_VARIANT_DIMENSION = 2048
+
+# The picture formats that can be served, with their media types, in order of preference when a client accepts
+# more than one equally. PNG is the format the pictures are stored in, and is always the fallback.
+PICTURE_MEDIA_TYPES = {
+    "avif": "image/avif",
+    "webp": "image/webp",
+    "png": "image/png",
+}
+
+# The options passed to Pillow when encoding each format
+PICTURE_SAVE_OPTIONS = {
+    "avif": {"quality": 60},
+    "webp": {"quality": 80, "method": 4},
+    "png": {},
+}
+
+# A variant is identified by the llama ID, the requested width and height, and the format. 0 means no limit.
+VariantKey = Tuple[int, int, int, str]
+
+
+class PictureVariant(NamedTuple):
+    """
+    A variant of a llama picture. Variants are kept in the cache on disk, apart from variants that are bigger than
+    the whole cache, which are kept in memory and only sent to the requests waiting for them.
+    """
+
+    file_name: Optional[str]
+    body: Optional[bytes] = None
+    etag: Optional[str] = None
+    mtime: float = 0.0
+
+
+@functools.lru_cache()
+def get_supported_picture_formats() -> List[str]:
+    """
+    Gets the picture formats the installed version of Pillow can encode, in order of preference.
+
+    :return: The supported formats.
+    :rtype: List[str]
+    """
+    from PIL import Image, features  # pylint: disable=import-outside-toplevel
+
+    supported = []
+    if ".avif" in Image.registered_extensions():
+        supported.append("avif")
+    if features.check("webp"):
+        supported.append("webp")
+    supported.append("png")
+    return supported
+
+
+def choose_picture_format(accept: Optional[str]) -> str:
+    """
+    Chooses the format to send a picture in, based on the Accept header of the request.
+
+    Formats other than PNG are only used if the client asks for them by name. Wildcards such as image/* are treated
+    as asking for PNG, so clients that don't know about the other formats get the same PNGs as they always have.
+
+    :param str accept: The Accept header of the request, or None if there isn't one.
+    :return: The picture format, such as png or webp.
+    :rtype: str
+    """
+    if not accept:
+        return "png"
+
+    qualities = parse_quality_values(accept)
+
+    def quality_of(picture_format: str) -> float:
+        media_type = PICTURE_MEDIA_TYPES[picture_format]
+        if media_type in qualities:
+            return qualities[media_type]
+        if picture_format == "png":
+            return qualities.get("image/*", qualities.get("*/*", 0.0))
+        return 0.0
+
+    # Pick the format with the highest quality value, using the order of preference to break ties
+    best_format, best_quality = "png", quality_of("png")
+    for picture_format in get_supported_picture_formats():
+        quality = quality_of(picture_format)
+        if quality > best_quality:
+            best_format, best_quality = picture_format, quality
+    return best_format
+
+
+def _parse_variant_file_name(file_name: str) -> Optional[VariantKey]:
+    """
+    Gets the key of a variant from its file name, such as 1_64x0.webp.
+
+    :param str file_name: The path of the file.
+    :return: The key, or None if this is not a finished variant, such as a temporary file that is being written.
+    :rtype: Optional[VariantKey]
+    """
+    name, _, picture_format = os.path.basename(file_name).partition(".")
+    llama_id, _, dimensions = name.partition("_")
+    width, _, height = dimensions.partition("x")
+    if picture_format not in PICTURE_MEDIA_TYPES or not (llama_id + width + height).isdecimal():
+        return None
+    return int(llama_id), int(width), int(height), picture_format
+
+
+def _delete_variant_file(_: VariantKey, file_name: str) -> None:
+    """
+    Deletes a variant file when it is evicted from the cache.
+    """
+    if os.path.exists(file_name):
+        os.remove(file_name)
+
+
+def _encode_variant(body: bytes, width: int, height: int, picture_format: str) -> bytes:
+    """
+    Scales a picture to fit inside a width and height, and encodes it in a format. 0 means no limit.
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    with Image.open(io.BytesIO(body)) as image:
+        # Thumbnail keeps the aspect ratio, and never makes the picture bigger
+        image.thumbnail((width or image.width, height or image.height))
+        variant = io.BytesIO()
+        image.save(variant, format=picture_format, **PICTURE_SAVE_OPTIONS[picture_format])
+    return variant.getvalue()
+
+
+def _in_memory_variant(key: VariantKey, body: bytes) -> PictureVariant:
+    """
+    Makes a variant that is sent from memory rather than kept in the cache, with an ETag based on its content.
+    """
+    return PictureVariant(None, body, make_etag(key, hashlib.blake2b(body, digest_size=16).hexdigest()), time.time())
+
+
+class PictureVariantCache:
+    """
+    An on-disk cache of resized and transcoded llama pictures, with least recently used eviction by total bytes.
+    """
+
+    def __init__(self, root_path: str, max_bytes: int, workers: int) -> None:
+        self.root_path = root_path
+        self._index = ByteBudgetLRU(max_bytes, on_evict=_delete_variant_file)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="picture-variant")
+        self._in_flight: Dict[VariantKey, Future] = {}
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def get_variant(  # pylint: disable=too-many-arguments
+        self, llama_id: int, source_file: str, width: Optional[int], height: Optional[int], picture_format: str
+    ) -> PictureVariant:
+        """
+        Gets a variant of a llama picture, generating it if it is not already cached.
+
+        :param int llama_id: The ID of the llama.
+        :param str source_file: The location of the full size llama picture.
+        :param int width: The maximum width of the variant, or None to only limit by height.
+        :param int height: The maximum height of the variant, or None to only limit by width.
+        :param str picture_format: The format of the variant, such as png or webp.
+        :return: The variant.
+        :rtype: PictureVariant
+        """
+        self._load_index()
+        key = (llama_id, width or 0, height or 0, picture_format)
+
+        file_name = self._index.get(key)
+        if file_name is not None and os.path.exists(file_name):
+            return PictureVariant(file_name)
+
+        # If another request is already generating this variant, wait for that rather than doing it twice
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._pool.submit(self._generate, key, source_file, self._generations.get(llama_id, 0))
+                self._in_flight[key] = future
+
+        return future.result()
+
+    def invalidate(self, llama_id: int) -> None:
+        """
+        Deletes all the variants of a llama's picture.
+
+        :param int llama_id: The ID of the llama.
+        """
+        self._load_index()
+
+        # Bump the generation, so variants of the old picture that are still being generated are thrown away, and
+        # new requests don't wait for them
+        with self._lock:
+            self._generations[llama_id] = self._generations.get(llama_id, 0) + 1
+            for key in [key for key in self._in_flight if key[0] == llama_id]:
+                del self._in_flight[key]
+
+        self._index.remove_where(lambda key: key[0] == llama_id)
+
+        # Remove any variant files that were not in the index, such as ones written by another process. Temporary
+        # files are left for the thread writing them.
+        for file_name in glob.glob(f"{self.root_path}/{llama_id}_*.*"):
+            if _parse_variant_file_name(file_name) is not None:
+                _delete_variant_file((llama_id, 0, 0, ""), file_name)
+
+    def _generate(self, key: VariantKey, source_file: str, generation: int) -> PictureVariant:
+        """
+        Generates a variant and adds it to the cache, unless the llama's variants were invalidated while it was
+        being generated. This runs on the worker pool.
+        """
+        llama_id, width, height, picture_format = key
+        try:
+            file_name = f"{self.root_path}/{llama_id}_{width}x{height}.{picture_format}"
+
+            # The picture may not be on the local file system, so read it all from the storage first
+            with get_picture_storage().open(source_file) as source:
+                body = _encode_variant(source.read(), width, height, picture_format)
+
+            # A variant bigger than the whole cache would be evicted as soon as it was added, so send it from memory.
+            # A variant of a picture that has since changed is also only sent to the requests that were waiting for it.
+            if len(body) > self._index.max_bytes or self._generations.get(llama_id, 0) != generation:
+                return _in_memory_variant(key, body)
+
+            # Write to a temporary file first so readers never see a partially written variant. The temporary file is
+            # named after the process and thread, as workers forked from the same process can have the same thread ID
+            temp_file_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_file_name, "wb") as temp_file:
+                    temp_file.write(body)
+
+                # Check the generation again while holding the lock, so the variant is either added before the
+                # llama's variants are invalidated, and deleted with them, or not added at all
+                with self._lock:
+                    current = self._generations.get(llama_id, 0) == generation
+                    if current:
+                        os.replace(temp_file_name, file_name)
+                        self._index.put(key, file_name, len(body))
+                if not current:
+                    os.remove(temp_file_name)
+                    return _in_memory_variant(key, body)
+            except BaseException:
+                # Don't leave the temporary file behind if the variant couldn't be written
+                if os.path.exists(temp_file_name):
+                    os.remove(temp_file_name)
+                raise
+
+            return PictureVariant(file_name)
+        finally:
+            # If the llama's variants were invalidated, the in flight entry has already been removed, and the key
+            # may belong to a newer generation
+            with self._lock:
+                if self._generations.get(llama_id, 0) == generation:
+                    self._in_flight.pop(key, None)
+
+    def _load_index(self) -> None:
+        """
+        Loads the existing variants on disk into the cache index, oldest first, the first time the cache is used.
+        """
+        if self._loaded:
+            return
+
+        with self._lock:
+            if self._loaded:
+                return
+
+            if not os.path.exists(self.root_path):
+                os.makedirs(self.root_path)
+
+            file_names = sorted(glob.glob(f"{self.root_path}/*_*x*.*"), key=os.path.getmtime)
+            for file_name in file_names:
+                key = _parse_variant_file_name(file_name)
+                if key is None:
+                    # Skip temporary files from a variant that was being written when the app stopped
+                    continue
+                self._index.put(key, file_name, os.path.getsize(file_name))
+
+            self._loaded = True
+
+
+variant_cache = PictureVariantCache(VARIANT_ROOT_PATH, MAX_VARIANT_CACHE_BYTES, VARIANT_WORKERS)
+
+# Variants are always kept on the local file system, so they can be read like stored pictures
+variant_storage = FileSystemStorage(VARIANT_ROOT_PATH)
+
+
+def get_llama_picture_variant(
+    llama_id: int, source_file: str, width: Optional[int], height: Optional[int], picture_format: str = "png"
+) -> PictureVariant:
+    """
+    Gets a variant of a llama picture, scaled to fit inside the given width and height, in the given format.
+
+    :param int llama_id: The ID of the llama.
+    :param str source_file: The location of the full size llama picture.
+    :param int width: The maximum width of the variant, or None to only limit by height.
+    :param int height: The maximum height of the variant, or None to only limit by width.
+    :param str picture_format: The format of the variant, such as png or webp.
+    :return: The variant.
+    :rtype: PictureVariant
+    """
+    return variant_cache.get_variant(llama_id, source_file, width, height, picture_format)
+
+
+def delete_llama_picture_variants(llama_id: int) -> None:
+    """
+    Deletes all the variants of a llama picture. Call this whenever the picture changes.
+
+    :param int llama_id: The ID of the llama.
+    """
+    variant_cache.invalidate(llama_id)
@@ -0,0 +1,156 @@
+"""
+Read replica support. In read replica mode, the secret key, users, llamas and the IDs of the llamas with pictures
+are all loaded into memory, along with the llama statistics, so reading llamas and checking API tokens doesn't run
+any SQL. The llamas are held in compact columns, so even a very large catalogue fits in memory and can be filtered
+and sorted quickly.
+
+The writer bumps a change version in the database whenever any of these change. Each replica polls the change
+version, and reloads its copy of the data when it changes. Each replica process keeps its own copy, so replicas
+share nothing and can be scaled out by adding more of them.
+"""
+
+# pylint: disable=invalid-name
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from data.database import DATABASE_IMMUTABLE, READ_REPLICA, SessionLocal
+from data.llama_columns import LlamaColumns
+from data.llama_stats import load_llama_stats
+from data.schema import DBChangeVersion, DBLlama, DBLlamaPicture, DBSecretKey, DBUser
+from models.llama import LlamaStats
+from models.user import User
+
+# How often replicas check the change version, in seconds
+REPLICA_REFRESH_INTERVAL = float(os.environ.get("REPLICA_REFRESH_INTERVAL_SECONDS", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaSnapshot(NamedTuple):
+    """
+    A copy of the data a read replica serves, as of a change version. The llamas and users are shared between
+    requests, so must not be changed.
+    """
+
+    version: int
+    secret_key: Optional[str]
+    llamas: LlamaColumns
+    llama_stats: LlamaStats
+    llama_ids_with_pictures: FrozenSet[int]
+    users_by_email: Dict[str, Tuple[User, str]]
+
+
+def get_change_version(db: Session) -> int:
+    """
+    Get the current change version from the database.
+
+    :param Session db: The database session.
+    :return: The change version, or 0 if there isn't one.
+    :rtype: int
+    """
+    return db.execute(select(DBChangeVersion.version).where(DBChangeVersion.id == 1)).scalar() or 0
+
+
+def load_replica_snapshot(db: Session) -> ReplicaSnapshot:
+    """
+    Load a snapshot of the data from the database.
+
+    The change version is read first, so if anything changes while the snapshot is loading, the version will have
+    moved on by the next check and the snapshot is loaded again.
+
+    :param Session db: The database session.
+    :return: The snapshot.
+    :rtype: ReplicaSnapshot
+    """
+    version = get_change_version(db)
+    return ReplicaSnapshot(
+        version=version,
+        secret_key=db.execute(select(DBSecretKey.secret_key)).scalar(),
+        # Load the llamas as plain rows rather than ORM objects, straight into the columns
+        llamas=LlamaColumns(
+            db.execute(
+                select(
+                    DBLlama.llama_id, DBLlama.name, DBLlama.age, DBLlama.color, DBLlama.rating, DBLlama.version
+                ).order_by(DBLlama.llama_id)
+            )
+        ),
+        llama_stats=load_llama_stats(db),
+        llama_ids_with_pictures=frozenset(db.execute(select(DBLlamaPicture.llama_id)).scalars()),
+        users_by_email={
+            db_user.email: (User.model_validate(db_user), db_user.hashed_password)
+            for db_user in db.execute(select(DBUser)).scalars()
+        },
+    )
+
+
+class ReadReplica:
+    """
+    Holds the current snapshot for a read replica, and reloads it when the change version changes.
+    """
+
+    def __init__(self) -> None:
+        self.snapshot: Optional[ReplicaSnapshot] = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """
+        Reload the snapshot if the change version has changed since it was loaded.
+
+        :return: True if the snapshot was reloaded.
+        :rtype: bool
+        """
+        with self._lock:
+            db = SessionLocal()
+            try:
+                if self.snapshot is not None and get_change_version(db) == self.snapshot.version:
+                    return False
+                # Swap the whole snapshot in one go, so requests never see half of an update
+                self.snapshot = load_replica_snapshot(db)
+            finally:
+                db.close()
+
+        logger.info("Loaded read replica snapshot at change version %d", self.snapshot.version)
+        return True
+
+    async def run_refresh(self) -> None:
+        """
+        Check the change version forever, reloading the snapshot when it changes.
+        """
+        while True:
+            await asyncio.sleep(REPLICA_REFRESH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception:  # pylint: disable=broad-except
+                # Keep serving the old snapshot, and try again next time
+                logger.exception("Failed to refresh the read replica snapshot")
+
+
+# The read replica for this process
+read_replica = ReadReplica()
+
+
+def get_replica_snapshot() -> Optional[ReplicaSnapshot]:
+    """
+    Get the snapshot to read from, if this is a read replica.
+
+    :return: The snapshot, or None if this is not a read replica, so reads should go to the database.
+    :rtype: Optional[ReplicaSnapshot]
+    """
+    return read_replica.snapshot if READ_REPLICA else None
+
+
+def is_replica_refresh_needed() -> bool:
+    """
+    Check if the read replica needs to poll the change version. Immutable databases never change.
+
+    :return: True if this is a read replica that needs to check for changes.
+    :rtype: bool
+    """
+    return READ_REPLICA and not DATABASE_IMMUTABLE
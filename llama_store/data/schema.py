@@ -1,10 +1,17 @@
 """
 The schema models used by the ORM to store data in the database.
+
+Some tables are kept up to date by SQLite triggers. The triggers are created here when the tables are created from
+the schema. The migrations that add the triggers keep their own copy of the SQL. Batch operations in migrations
+recreate the table they change, which drops the table's triggers, so a migration that changes a table with triggers
+using a batch operation needs to create the triggers again.
 """
 
 # pylint: disable=too-few-public-methods
 
-from sqlalchemy import Column, Integer, String
+from typing import List
+
+from sqlalchemy import Column, ForeignKey, Integer, LargeBinary, String, event, text
 
 from .database import Base
 
@@ -43,16 +50,246 @@ class DBLlama(Base):
     age = Column(Integer, index=False, nullable=False)
     color = Column(String, index=False, nullable=False)
     rating = Column(Integer, index=False, nullable=False)
+    # Bumped on every update, and sent as the ETag, so updates can be made conditional with If-Match
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
 
 class DBLlamaPicture(Base):
     """
     A picture of a llama. Pictures are stored in the file system, not in the database.
-    The database records the location of the picture.
+    The database records the location of the picture. The picture is deleted along with its llama.
     """
 
     __tablename__ = "llama_picture_locations"
 
     llama_picture_id = Column(Integer, primary_key=True, index=True)
-    llama_id = Column(Integer, index=True)
+    llama_id = Column(Integer, ForeignKey("llamas.llama_id", ondelete="CASCADE"), unique=True, index=True)
     image_file_location = Column(String, index=False, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    byte_size = Column(Integer, nullable=True)
+    content_hash = Column(String, nullable=True)
+    placeholder = Column(String, nullable=True)
+
+
+class DBChangeVersion(Base):
+    """
+    A counter that is bumped by triggers whenever the secrets, users, llamas or pictures change. There is only
+    one row. Read replicas poll this to know when to reload their copy of the data.
+    """
+
+    __tablename__ = "change_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+# The tables that bump the change version when they are written to
+CHANGE_VERSION_TABLES = ["secrets", "users", "llamas", "llama_picture_locations"]
+
+
+def get_change_version_triggers() -> List[str]:
+    """
+    Gets the SQL to create the triggers that bump the change version. The version is bumped in the same transaction
+    as every write, so it can never miss a change.
+
+    :return: The SQL for each trigger.
+    :rtype: List[str]
+    """
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS bump_change_version_after_{operation}_{table} AFTER {operation.upper()} "
+        f"ON {table} BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END"
+        for table in CHANGE_VERSION_TABLES
+        for operation in ["insert", "update", "delete"]
+    ]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_change_version_triggers(_, connection, **__) -> None:
+    """
+    Creates the change version row and triggers for databases created from the schema rather than by the
+    migrations. This runs every time the tables are created, so only creates what is missing.
+    """
+    connection.execute(text("INSERT OR IGNORE INTO change_version (id, version) VALUES (1, 0)"))
+    for trigger in get_change_version_triggers():
+        connection.execute(text(trigger))
+
+
+class DBLlamaColorCount(Base):
+    """
+    The number of llamas of each color. This is kept up to date by triggers on the llamas table.
+    """
+
+    __tablename__ = "llama_color_counts"
+
+    color = Column(String, primary_key=True)
+    llama_count = Column(Integer, nullable=False)
+
+
+class DBLlamaRatingCount(Base):
+    """
+    The number of llamas with each rating. This is kept up to date by triggers on the llamas table.
+    """
+
+    __tablename__ = "llama_rating_counts"
+
+    rating = Column(Integer, primary_key=True)
+    llama_count = Column(Integer, nullable=False)
+
+
+class DBLlamaAgeCount(Base):
+    """
+    The number of llamas of each age. This is kept up to date by triggers on the llamas table.
+    """
+
+    __tablename__ = "llama_age_counts"
+
+    age = Column(Integer, primary_key=True)
+    llama_count = Column(Integer, nullable=False)
+
+
+# The llama count tables, and the llama column each one counts
+LLAMA_COUNT_TABLES = {"llama_color_counts": "color", "llama_rating_counts": "rating", "llama_age_counts": "age"}
+
+
+def get_llama_count_triggers() -> List[str]:
+    """
+    Gets the SQL to create the triggers that keep the llama count tables up to date. Each write to a llama adds
+    one to the counts for its new values, and takes one from the counts for its old values. Counts that reach zero
+    are deleted, so the tables only hold the values llamas have.
+
+    :return: The SQL for each trigger.
+    :rtype: List[str]
+    """
+    add = "".join(
+        f"INSERT OR IGNORE INTO {table} ({column}, llama_count) VALUES (NEW.{column}, 0); "
+        f"UPDATE {table} SET llama_count = llama_count + 1 WHERE {column} = NEW.{column}; "
+        for table, column in LLAMA_COUNT_TABLES.items()
+    )
+    remove = "".join(
+        f"UPDATE {table} SET llama_count = llama_count - 1 WHERE {column} = OLD.{column}; "
+        f"DELETE FROM {table} WHERE {column} = OLD.{column} AND llama_count = 0; "
+        for table, column in LLAMA_COUNT_TABLES.items()
+    )
+    columns = ", ".join(LLAMA_COUNT_TABLES.values())
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS count_llamas_after_insert AFTER INSERT ON llamas BEGIN {add}END",
+        f"CREATE TRIGGER IF NOT EXISTS count_llamas_after_update AFTER UPDATE OF {columns} ON llamas "
+        f"BEGIN {remove}{add}END",
+        f"CREATE TRIGGER IF NOT EXISTS count_llamas_after_delete AFTER DELETE ON llamas BEGIN {remove}END",
+    ]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_llama_count_triggers(_, connection, **__) -> None:
+    """
+    Creates the llama count triggers for databases created from the schema rather than by the migrations, and
+    fills in the counts for any llamas that were added before the count tables existed. The triggers keep the
+    counts of every value a llama has, so the counts only need filling in if they are empty.
+    """
+    for trigger in get_llama_count_triggers():
+        connection.execute(text(trigger))
+    for table, column in LLAMA_COUNT_TABLES.items():
+        connection.execute(
+            text(
+                f"INSERT INTO {table} ({column}, llama_count) SELECT {column}, COUNT(*) FROM llamas "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table}) GROUP BY {column}"
+            )
+        )
+
+
+class DBLlamaChange(Base):
+    """
+    A change to a llama or its picture. This is an append only log, written by triggers in the same transaction as
+    each write, so clients can sync by reading the changes since the last one they saw. The sequence number is
+    never reused, even if the latest changes are deleted.
+    """
+
+    __tablename__ = "llama_changes"
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    operation = Column(String, nullable=False)
+    llama_id = Column(Integer, nullable=False)
+    name = Column(String, nullable=True)
+    age = Column(Integer, nullable=True)
+    color = Column(String, nullable=True)
+    rating = Column(Integer, nullable=True)
+    changed_at = Column(String, nullable=False)
+
+
+# The time a change was made, as an ISO 8601 UTC timestamp written by SQLite
+CHANGED_AT_SQL = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+
+def get_llama_change_triggers() -> List[str]:
+    """
+    Gets the SQL to create the triggers that write the llama change log. Llama changes record the llama's new
+    values, so clients can apply them without fetching the llama. Deletes and picture changes only record the ID.
+
+    :return: The SQL for each trigger.
+    :rtype: List[str]
+    """
+    columns = "entity, operation, llama_id, name, age, color, rating, changed_at"
+    triggers = []
+    for operation, past_tense in [("insert", "created"), ("update", "updated"), ("delete", "deleted")]:
+        row = "OLD" if operation == "delete" else "NEW"
+        llama_values = (
+            "NULL, NULL, NULL, NULL" if operation == "delete" else f"{row}.name, {row}.age, {row}.color, {row}.rating"
+        )
+        triggers.append(
+            f"CREATE TRIGGER IF NOT EXISTS log_llama_change_after_{operation} AFTER {operation.upper()} ON llamas "
+            f"BEGIN INSERT INTO llama_changes ({columns}) "
+            f"VALUES ('llama', '{past_tense}', {row}.llama_id, {llama_values}, {CHANGED_AT_SQL}); END"
+        )
+        triggers.append(
+            f"CREATE TRIGGER IF NOT EXISTS log_picture_change_after_{operation} AFTER {operation.upper()} "
+            f"ON llama_picture_locations BEGIN INSERT INTO llama_changes ({columns}) "
+            f"VALUES ('picture', '{past_tense}', {row}.llama_id, NULL, NULL, NULL, NULL, {CHANGED_AT_SQL}); END"
+        )
+    return triggers
+
+
+@event.listens_for(Base.metadata, "after_create")
+def create_llama_change_triggers(_, connection, **__) -> None:
+    """
+    Creates the change log triggers for databases created from the schema rather than by the migrations. If the
+    change log is empty, the existing llamas and pictures are logged as created, so replaying the log from the
+    start gives the full catalogue.
+    """
+    for trigger in get_llama_change_triggers():
+        connection.execute(text(trigger))
+    if connection.execute(text("SELECT 1 FROM llama_changes LIMIT 1")).first() is not None:
+        return
+
+    connection.execute(
+        text(
+            "INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+            f"SELECT 'llama', 'created', llama_id, name, age, color, rating, {CHANGED_AT_SQL} FROM llamas "
+            "ORDER BY llama_id"
+        )
+    )
+    connection.execute(
+        text(
+            "INSERT INTO llama_changes (entity, operation, llama_id, changed_at) "
+            f"SELECT 'picture', 'created', llama_id, {CHANGED_AT_SQL} FROM llama_picture_locations ORDER BY llama_id"
+        )
+    )
+
+
+class DBIdempotencyKey(Base):
+    """
+    The response to a request sent with an idempotency key, so a retry of the request can be answered with the same
+    response without doing the work again. Keys are stored as a hash of the user and the key, and rows are deleted
+    once they expire. The status code and response are empty while the first request is still being handled.
+    """
+
+    __tablename__ = "idempotency_keys"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    key_hash = Column(LargeBinary, primary_key=True)
+    request_hash = Column(LargeBinary, nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    expires_at = Column(Integer, nullable=False, index=True)
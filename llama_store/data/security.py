@@ -1,17 +1,18 @@
 """
 This file contains functions to help with API security. This includes password hashing, token creation
 and token validation.
+
+The password hashing and JWT libraries are slow to import, so they are imported the first time they are used
+rather than when the API starts.
 """
 
 # pylint: disable=invalid-name
 
 from datetime import datetime, timedelta
-from fastapi.security import HTTPBearer
-
-from jose import jwt
+import functools
+from typing import Optional
 
-from passlib.context import CryptContext
-from passlib.exc import UnknownHashError
+from fastapi.security import HTTPBearer
 from pydantic import BaseModel, constr
 
 from models.user import EMAIL_REGEX
@@ -19,12 +20,12 @@ from models.user import EMAIL_REGEX
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# The password context to use for hashing and verifying passwords
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # The bearer security scheme to use for authentication
 bearer_scheme = HTTPBearer(scheme_name="Bearer", bearerFormat="JWT")
 
+# The same bearer security scheme, for endpoints that can also be called without a token
+optional_bearer_scheme = HTTPBearer(scheme_name="Bearer", bearerFormat="JWT", auto_error=False)
+
 
 class TokenData(BaseModel):
     """
@@ -34,6 +35,19 @@ class TokenData(BaseModel):
     email: constr(min_length=5, max_length=254, pattern=EMAIL_REGEX)
 
 
+@functools.lru_cache()
+def get_password_context():
+    """
+    Get the password context to use for hashing and verifying passwords.
+
+    :return: The password context.
+    :rtype: CryptContext
+    """
+    from passlib.context import CryptContext  # pylint: disable=import-outside-toplevel
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
 def verify_password(plain_password, hashed_password) -> bool:
     """
     Verify a password against the hashed password.
@@ -43,8 +57,10 @@ def verify_password(plain_password, hashed_password) -> bool:
     :return: Whether the password is correct.
     :rtype: bool
     """
+    from passlib.exc import UnknownHashError  # pylint: disable=import-outside-toplevel
+
     try:
-        result = pwd_context.verify(plain_password, hashed_password)
+        result = get_password_context().verify(plain_password, hashed_password)
         return result
     except UnknownHashError:
         return False
@@ -58,7 +74,7 @@ def get_password_hash(password) -> str:
     :return: The hashed password.
     :rtype: str
     """
-    return pwd_context.hash(password)
+    return get_password_context().hash(password)
 
 
 def create_access_token(user_email: str, secret_key: str) -> str:
@@ -70,6 +86,8 @@ def create_access_token(user_email: str, secret_key: str) -> str:
     :return: The access token.
     :rtype: str
     """
+    from jose import jwt  # pylint: disable=import-outside-toplevel
+
     # The default token expiry time is 30 minutes
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     # Create the token with the user email and expiry time
@@ -79,3 +97,22 @@ def create_access_token(user_email: str, secret_key: str) -> str:
     }
     # Encode the token encoded with the secret key and algorithm
     return jwt.encode(to_encode, secret_key, algorithm=ALGORITHM)
+
+
+def get_email_from_access_token(token: str, secret_key: str) -> Optional[str]:
+    """
+    Get the user email from an access token.
+
+    :param str token: The access token.
+    :param str secret_key: The secret key the token was signed with.
+    :return: The email of the user the token is for, or None if the token is not valid or has expired.
+    :rtype: Optional[str]
+    """
+    from jose import jwt, JWTError  # pylint: disable=import-outside-toplevel
+
+    try:
+        # Decode the token, and get the user email from it
+        payload = jwt.decode(token, secret_key, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
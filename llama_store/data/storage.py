@@ -0,0 +1,282 @@
+"""
+Storage backends for llama pictures.
+
+Pictures are stored by a storage backend, and the database records the location the backend gives each picture.
+By default pictures are stored on the local file system. To run more than one API node, pictures can be stored in
+an S3 compatible object store instead, such as AWS S3 or MinIO.
+
+The backend is chosen with the PICTURE_STORAGE environment variable - either filesystem (the default) or s3.
+"""
+
+from abc import ABC, abstractmethod
+import bisect
+import functools
+import os
+import threading
+from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+
+
+class PictureStat(NamedTuple):
+    """
+    The size and last modified time of a stored picture.
+    """
+
+    size: int
+    mtime: float
+
+
+class PictureStorage(ABC):
+    """
+    A place to store llama pictures. Pictures are stored with a name, and the backend returns a location for each
+    picture that is recorded in the database and used to read and delete it.
+    """
+
+    @abstractmethod
+    def put(self, name: str, body: bytes) -> str:
+        """
+        Stores a picture, overwriting any existing picture with the same name.
+
+        :param str name: The name of the picture, such as 1.png.
+        :param bytes body: The picture.
+        :return: The location of the stored picture.
+        :rtype: str
+        """
+
+    @abstractmethod
+    def open(self, location: str) -> BinaryIO:
+        """
+        Opens a stored picture to stream it.
+
+        :param str location: The location of the picture.
+        :return: A binary stream of the picture. The caller must close this.
+        :rtype: BinaryIO
+        :raises FileNotFoundError: If there is no picture at this location.
+        """
+
+    @abstractmethod
+    def delete(self, location: str) -> None:
+        """
+        Deletes a stored picture. Deleting a picture that doesn't exist does nothing.
+
+        :param str location: The location of the picture.
+        """
+
+    @abstractmethod
+    def stat(self, location: str) -> Optional[PictureStat]:
+        """
+        Gets the size and last modified time of a stored picture.
+
+        :param str location: The location of the picture.
+        :return: The size and last modified time, or None if there is no picture at this location.
+        :rtype: PictureStat
+        """
+
+    @abstractmethod
+    def list_pictures(self, start_after: Optional[str] = None, limit: int = 1000) -> List[Tuple[str, PictureStat]]:
+        """
+        Lists the stored pictures in order of location, a page at a time. Temporary files for pictures that are
+        being written are not listed.
+
+        :param str start_after: Only list pictures with a location after this, or None to start at the beginning.
+        :param int limit: The maximum number of pictures to list.
+        :return: The location, size and last modified time of each picture.
+        :rtype: List[Tuple[str, PictureStat]]
+        """
+
+    def presigned_url(self, location: str, expires_in: int) -> Optional[str]:  # pylint: disable=unused-argument
+        """
+        Gets a time limited URL that clients can use to download the picture directly from the storage.
+
+        :param str location: The location of the picture.
+        :param int expires_in: The number of seconds the URL is valid for.
+        :return: The URL, or None if this backend doesn't support presigned URLs.
+        :rtype: str
+        """
+        return None
+
+    def local_path(self, location: str) -> Optional[str]:  # pylint: disable=unused-argument
+        """
+        Gets the path of the picture on the local file system, so it can be sent without streaming it through
+        Python.
+
+        :param str location: The location of the picture.
+        :return: The path, or None if this backend doesn't store pictures on the local file system.
+        :rtype: str
+        """
+        return None
+
+
+class FileSystemStorage(PictureStorage):
+    """
+    Stores pictures in a folder on the local file system. The location of each picture is its path.
+
+    Listing the folder means reading and sorting every entry in it, so each walk through the pictures lists the
+    folder once, when it starts at the beginning, and later pages are read from that sorted listing. Pictures added
+    after a walk starts are listed by the next walk.
+    """
+
+    def __init__(self, root_path: str) -> None:
+        self.root_path = root_path
+        self._listing: Optional[List[str]] = None
+        self._listing_lock = threading.Lock()
+
+    def put(self, name: str, body: bytes) -> str:
+        if not os.path.exists(self.root_path):
+            os.makedirs(self.root_path)
+
+        # Write to a temporary file first so readers never see a partially written picture. The temporary file is
+        # named after the process and thread, so concurrent writes of the same picture don't write to the same file
+        location = f"{self.root_path}/{name}"
+        temp_location = f"{location}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_location, "wb") as file:
+                file.write(body)
+            os.replace(temp_location, location)
+        except BaseException:
+            # Don't leave the temporary file behind if the picture couldn't be written
+            if os.path.exists(temp_location):
+                os.remove(temp_location)
+            raise
+        return location
+
+    def open(self, location: str) -> BinaryIO:
+        return open(location, "rb")  # pylint: disable=consider-using-with
+
+    def delete(self, location: str) -> None:
+        if os.path.exists(location):
+            os.remove(location)
+
+    def stat(self, location: str) -> Optional[PictureStat]:
+        try:
+            stat_result = os.stat(location)
+        except FileNotFoundError:
+            return None
+        return PictureStat(size=stat_result.st_size, mtime=stat_result.st_mtime)
+
+    def list_pictures(self, start_after: Optional[str] = None, limit: int = 1000) -> List[Tuple[str, PictureStat]]:
+        with self._listing_lock:
+            if start_after is None or self._listing is None:
+                self._listing = self._list_locations()
+            listing = self._listing
+
+        # Find where the page starts in the sorted listing
+        start = 0 if start_after is None else bisect.bisect_right(listing, start_after)
+
+        # Pictures deleted since the folder was listed are left out
+        pictures = []
+        for location in listing[start : start + limit]:
+            picture_stat = self.stat(location)
+            if picture_stat is not None:
+                pictures.append((location, picture_stat))
+        return pictures
+
+    def local_path(self, location: str) -> Optional[str]:
+        return location
+
+    def _list_locations(self) -> List[str]:
+        """
+        Lists the locations of all the pictures in the folder, in order, leaving out temporary files.
+        """
+        if not os.path.exists(self.root_path):
+            return []
+
+        with os.scandir(self.root_path) as entries:
+            return sorted(
+                f"{self.root_path}/{entry.name}"
+                for entry in entries
+                if entry.is_file() and not entry.name.endswith(".tmp")
+            )
+
+
+class S3Storage(PictureStorage):
+    """
+    Stores pictures in a bucket in an S3 compatible object store. The location of each picture is its object key.
+
+    This needs the boto3 package, which is not installed by default. Credentials are read by boto3 in the usual
+    way, such as from the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY environment variables. Set an endpoint URL
+    to use an S3 compatible store other than AWS, such as a local MinIO server.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, client=None) -> None:
+        if client is None:
+            try:
+                import boto3  # pylint: disable=import-outside-toplevel
+            except ImportError as ex:
+                raise RuntimeError("The s3 picture storage needs boto3. Install it with pip install boto3") from ex
+
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = client
+
+    def put(self, name: str, body: bytes) -> str:
+        location = f"{self.prefix}{name}"
+        self._client.put_object(Bucket=self.bucket, Key=location, Body=body, ContentType="image/png")
+        return location
+
+    def open(self, location: str) -> BinaryIO:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=location)["Body"]
+        except self._client.exceptions.NoSuchKey as ex:
+            raise FileNotFoundError(location) from ex
+
+    def delete(self, location: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=location)
+
+    def stat(self, location: str) -> Optional[PictureStat]:
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=location)
+        except self._client.exceptions.ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return PictureStat(size=head["ContentLength"], mtime=head["LastModified"].timestamp())
+
+    def list_pictures(self, start_after: Optional[str] = None, limit: int = 1000) -> List[Tuple[str, PictureStat]]:
+        response = self._client.list_objects_v2(
+            Bucket=self.bucket, Prefix=self.prefix, StartAfter=start_after or "", MaxKeys=limit
+        )
+        return [
+            (item["Key"], PictureStat(size=item["Size"], mtime=item["LastModified"].timestamp()))
+            for item in response.get("Contents", [])
+        ]
+
+    def presigned_url(self, location: str, expires_in: int) -> Optional[str]:
+        return self._client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": location}, ExpiresIn=expires_in
+        )
+
+
+# The root path for all the llama pictures when they are stored on the file system
+ROOT_PATH = ".appdata/llama_store_data/pictures"
+
+# If this is set, and the storage supports it, requests for a full size picture are redirected to a presigned URL
+# so clients download the picture from the storage rather than through the API
+REDIRECT_TO_STORAGE = os.environ.get("PICTURE_REDIRECT_TO_STORAGE", "false").lower() == "true"
+
+# How long presigned URLs are valid for, in seconds
+PRESIGNED_URL_EXPIRY = int(os.environ.get("PICTURE_PRESIGNED_URL_EXPIRY", "300"))
+
+
+@functools.lru_cache()
+def get_picture_storage() -> PictureStorage:
+    """
+    Gets the picture storage backend set by the PICTURE_STORAGE environment variable.
+
+    :return: The picture storage backend.
+    :rtype: PictureStorage
+    """
+    backend = os.environ.get("PICTURE_STORAGE", "filesystem").lower()
+
+    if backend == "filesystem":
+        return FileSystemStorage(ROOT_PATH)
+
+    if backend == "s3":
+        return S3Storage(
+            bucket=os.environ["PICTURE_S3_BUCKET"],
+            prefix=os.environ.get("PICTURE_S3_PREFIX", "pictures/"),
+            endpoint_url=os.environ.get("PICTURE_S3_ENDPOINT_URL"),
+        )
+
+    raise ValueError(f"Unknown picture storage backend {backend}. Use filesystem or s3.")
@@ -6,13 +6,13 @@ This file contains the functions that will be used to interact with users in the
 
 from typing import Annotated, List
 from fastapi import Depends, HTTPException, status
-from jose import jwt, JWTError
 
 from sqlalchemy.orm import Session
 
 from data.schema import DBSecretKey, DBUser
 from data.database import SessionLocal, get_db
-from data.security import ALGORITHM, bearer_scheme, get_password_hash
+from data.replica import get_replica_snapshot
+from data.security import bearer_scheme, get_email_from_access_token, get_password_hash
 from models.user import User
 
 
@@ -51,6 +51,12 @@ def get_user_by_email(db: Session, email: str) -> User | None:
     :return: The user with the given email.
     :rtype: User
     """
+    # Read replicas have all the users in memory
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        user_and_password = snapshot.users_by_email.get(email.lower())
+        return None if user_and_password is None else user_and_password[0]
+
     # Get the first user that matches the email. This field is unique, so there should only be one.
     db_user = db.query(DBUser).filter(DBUser.email == email.lower()).first()
     return None if db_user is None else User.model_validate(db_user)
@@ -65,6 +71,11 @@ def get_user_password_by_email(db: Session, email: str) -> str | None:
     :return: The users password
     :rtype: str
     """
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        user_and_password = snapshot.users_by_email.get(email.lower())
+        return None if user_and_password is None else user_and_password[1]
+
     # Get the first user that matches the email. This field is unique, so there should only be one.
     db_user = db.query(DBUser).filter(DBUser.email == email.lower()).first()
     return None if db_user is None else db_user.hashed_password
@@ -123,6 +134,11 @@ def get_secret_key(db: Session) -> str:
     :return: The secret key.
     :rtype: str
     """
+    # Read replicas have the secret key in memory
+    snapshot = get_replica_snapshot()
+    if snapshot is not None:
+        return snapshot.secret_key
+
     # Get the first secret key. This field is unique, so there should only be one.
     db_secret_key = db.query(DBSecretKey).first()
     # Return the secret key
@@ -146,15 +162,10 @@ def get_current_user_from_api_token(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        # Decode the token
-        payload = jwt.decode(token.credentials, get_secret_key(db), algorithms=[ALGORITHM])
-        # Get the user email from the token
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception  # pylint: disable=raise-missing-from
+    # Decode the token, and get the user email from it
+    email = get_email_from_access_token(token.credentials, get_secret_key(db))
+    if email is None:
+        raise credentials_exception
 
     # Load the user from the database
     user = get_user_by_email(db, email=email)
@@ -0,0 +1,74 @@
+"""Add a change version that is bumped on every write
+
+Revision ID: 9a6d2c4f1b73
+Revises: c41d9e7b2a58
+Create Date: 2026-10-19 15:32:08.114027
+
+"""
+
+# pylint: disable=invalid-name,no-member
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "9a6d2c4f1b73"
+down_revision: Union[str, None] = "c41d9e7b2a58"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The triggers that bump the version in the same transaction as every write, so it can never miss a change. This
+# is a copy of the SQL as it was when this migration was written, so later changes to the schema don't change it.
+TRIGGERS = [
+    "CREATE TRIGGER bump_change_version_after_insert_secrets AFTER INSERT ON secrets "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_update_secrets AFTER UPDATE ON secrets "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_delete_secrets AFTER DELETE ON secrets "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_insert_users AFTER INSERT ON users "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_update_users AFTER UPDATE ON users "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_delete_users AFTER DELETE ON users "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_insert_llamas AFTER INSERT ON llamas "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_update_llamas AFTER UPDATE ON llamas "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_delete_llamas AFTER DELETE ON llamas "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_insert_llama_picture_locations AFTER INSERT ON llama_picture_locations "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_update_llama_picture_locations AFTER UPDATE ON llama_picture_locations "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+    "CREATE TRIGGER bump_change_version_after_delete_llama_picture_locations AFTER DELETE ON llama_picture_locations "
+    "BEGIN UPDATE change_version SET version = version + 1 WHERE id = 1; END",
+]
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    op.create_table(
+        "change_version",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("version", sa.Integer, nullable=False),
+    )
+    op.execute(sa.text("INSERT INTO change_version (id, version) VALUES (1, 0)"))
+
+    for trigger in TRIGGERS:
+        op.execute(sa.text(trigger))
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    for table in ["secrets", "users", "llamas", "llama_picture_locations"]:
+        for operation in ["insert", "update", "delete"]:
+            op.execute(sa.text(f"DROP TRIGGER IF EXISTS bump_change_version_after_{operation}_{table}"))
+    op.drop_table("change_version")
@@ -0,0 +1,45 @@
+"""Add a table of idempotency keys
+
+Revision ID: 2b5e9d7c3a41
+Revises: d7f3a1c5e820
+Create Date: 2026-10-19 19:41:36.287143
+
+"""
+
+# pylint: disable=invalid-name,no-member
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "2b5e9d7c3a41"
+down_revision: Union[str, None] = "d7f3a1c5e820"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    # The key hash is the primary key, and there is no rowid, so each key is stored once
+    op.create_table(
+        "idempotency_keys",
+        sa.Column("key_hash", sa.LargeBinary, primary_key=True),
+        sa.Column("request_hash", sa.LargeBinary, nullable=False),
+        sa.Column("status_code", sa.Integer, nullable=True),
+        sa.Column("response_body", sa.LargeBinary, nullable=True),
+        sa.Column("expires_at", sa.Integer, nullable=False),
+        sqlite_with_rowid=False,
+    )
+    op.create_index("ix_idempotency_keys_expires_at", "idempotency_keys", ["expires_at"])
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    op.drop_index("ix_idempotency_keys_expires_at", table_name="idempotency_keys")
+    op.drop_table("idempotency_keys")
@@ -0,0 +1,113 @@
+"""Add a change log for llamas and pictures written by triggers
+
+Revision ID: d7f3a1c5e820
+Revises: 6e2b8f0a4d19
+Create Date: 2026-10-19 18:22:17.604385
+
+"""
+
+# pylint: disable=invalid-name,no-member
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d7f3a1c5e820"
+down_revision: Union[str, None] = "6e2b8f0a4d19"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The time a change was made, as an ISO 8601 UTC timestamp written by SQLite
+CHANGED_AT = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+# The triggers that log every write in the same transaction as the write. Llama changes record the llama's new
+# values, and deletes and picture changes only record the ID. This is a copy of the SQL as it was when this
+# migration was written, so later changes to the schema don't change it.
+TRIGGERS = [
+    (
+        "CREATE TRIGGER log_llama_change_after_insert AFTER INSERT ON llamas "
+        "BEGIN INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+        "VALUES ('llama', 'created', NEW.llama_id, NEW.name, NEW.age, NEW.color, NEW.rating, "
+        "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')); END"
+    ),
+    (
+        "CREATE TRIGGER log_llama_change_after_update AFTER UPDATE ON llamas "
+        "BEGIN INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+        "VALUES ('llama', 'updated', NEW.llama_id, NEW.name, NEW.age, NEW.color, NEW.rating, "
+        "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')); END"
+    ),
+    (
+        "CREATE TRIGGER log_llama_change_after_delete AFTER DELETE ON llamas "
+        "BEGIN INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+        "VALUES ('llama', 'deleted', OLD.llama_id, NULL, NULL, NULL, NULL, "
+        "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')); END"
+    ),
+    (
+        "CREATE TRIGGER log_picture_change_after_insert AFTER INSERT ON llama_picture_locations "
+        "BEGIN INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+        "VALUES ('picture', 'created', NEW.llama_id, NULL, NULL, NULL, NULL, "
+        "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')); END"
+    ),
+    (
+        "CREATE TRIGGER log_picture_change_after_update AFTER UPDATE ON llama_picture_locations "
+        "BEGIN INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+        "VALUES ('picture', 'updated', NEW.llama_id, NULL, NULL, NULL, NULL, "
+        "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')); END"
+    ),
+    (
+        "CREATE TRIGGER log_picture_change_after_delete AFTER DELETE ON llama_picture_locations "
+        "BEGIN INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+        "VALUES ('picture', 'deleted', OLD.llama_id, NULL, NULL, NULL, NULL, "
+        "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')); END"
+    ),
+]
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    # Autoincrement stops sequence numbers from being reused, so clients never miss a change
+    op.create_table(
+        "llama_changes",
+        sa.Column("seq", sa.Integer, primary_key=True),
+        sa.Column("entity", sa.String, nullable=False),
+        sa.Column("operation", sa.String, nullable=False),
+        sa.Column("llama_id", sa.Integer, nullable=False),
+        sa.Column("name", sa.String, nullable=True),
+        sa.Column("age", sa.Integer, nullable=True),
+        sa.Column("color", sa.String, nullable=True),
+        sa.Column("rating", sa.Integer, nullable=True),
+        sa.Column("changed_at", sa.String, nullable=False),
+        sqlite_autoincrement=True,
+    )
+
+    # Log the existing llamas and pictures as created, so replaying the log from the start gives the full catalogue
+    op.execute(
+        sa.text(
+            "INSERT INTO llama_changes (entity, operation, llama_id, name, age, color, rating, changed_at) "
+            f"SELECT 'llama', 'created', llama_id, name, age, color, rating, {CHANGED_AT} FROM llamas "
+            "ORDER BY llama_id"
+        )
+    )
+    op.execute(
+        sa.text(
+            "INSERT INTO llama_changes (entity, operation, llama_id, changed_at) "
+            f"SELECT 'picture', 'created', llama_id, {CHANGED_AT} FROM llama_picture_locations ORDER BY llama_id"
+        )
+    )
+
+    for trigger in TRIGGERS:
+        op.execute(sa.text(trigger))
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    for operation in ["insert", "update", "delete"]:
+        op.execute(sa.text(f"DROP TRIGGER IF EXISTS log_llama_change_after_{operation}"))
+        op.execute(sa.text(f"DROP TRIGGER IF EXISTS log_picture_change_after_{operation}"))
+    op.drop_table("llama_changes")
@@ -0,0 +1,97 @@
+"""Add llama count tables kept up to date by triggers
+
+Revision ID: 6e2b8f0a4d19
+Revises: 9a6d2c4f1b73
+Create Date: 2026-10-19 17:05:41.530912
+
+"""
+
+# pylint: disable=invalid-name,no-member
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6e2b8f0a4d19"
+down_revision: Union[str, None] = "9a6d2c4f1b73"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The count tables, and the llama column each one counts
+TABLES = {"llama_color_counts": "color", "llama_rating_counts": "rating", "llama_age_counts": "age"}
+
+# The triggers that add one to the counts for a llama's new values, and take one from the counts for its old values,
+# in the same transaction as every write. This is a copy of the SQL as it was when this migration was written, so
+# later changes to the schema don't change it.
+TRIGGERS = [
+    (
+        "CREATE TRIGGER count_llamas_after_insert AFTER INSERT ON llamas BEGIN "
+        "INSERT OR IGNORE INTO llama_color_counts (color, llama_count) VALUES (NEW.color, 0); "
+        "UPDATE llama_color_counts SET llama_count = llama_count + 1 WHERE color = NEW.color; "
+        "INSERT OR IGNORE INTO llama_rating_counts (rating, llama_count) VALUES (NEW.rating, 0); "
+        "UPDATE llama_rating_counts SET llama_count = llama_count + 1 WHERE rating = NEW.rating; "
+        "INSERT OR IGNORE INTO llama_age_counts (age, llama_count) VALUES (NEW.age, 0); "
+        "UPDATE llama_age_counts SET llama_count = llama_count + 1 WHERE age = NEW.age; "
+        "END"
+    ),
+    (
+        "CREATE TRIGGER count_llamas_after_update AFTER UPDATE OF color, rating, age ON llamas BEGIN "
+        "UPDATE llama_color_counts SET llama_count = llama_count - 1 WHERE color = OLD.color; "
+        "DELETE FROM llama_color_counts WHERE color = OLD.color AND llama_count = 0; "
+        "UPDATE llama_rating_counts SET llama_count = llama_count - 1 WHERE rating = OLD.rating; "
+        "DELETE FROM llama_rating_counts WHERE rating = OLD.rating AND llama_count = 0; "
+        "UPDATE llama_age_counts SET llama_count = llama_count - 1 WHERE age = OLD.age; "
+        "DELETE FROM llama_age_counts WHERE age = OLD.age AND llama_count = 0; "
+        "INSERT OR IGNORE INTO llama_color_counts (color, llama_count) VALUES (NEW.color, 0); "
+        "UPDATE llama_color_counts SET llama_count = llama_count + 1 WHERE color = NEW.color; "
+        "INSERT OR IGNORE INTO llama_rating_counts (rating, llama_count) VALUES (NEW.rating, 0); "
+        "UPDATE llama_rating_counts SET llama_count = llama_count + 1 WHERE rating = NEW.rating; "
+        "INSERT OR IGNORE INTO llama_age_counts (age, llama_count) VALUES (NEW.age, 0); "
+        "UPDATE llama_age_counts SET llama_count = llama_count + 1 WHERE age = NEW.age; "
+        "END"
+    ),
+    (
+        "CREATE TRIGGER count_llamas_after_delete AFTER DELETE ON llamas BEGIN "
+        "UPDATE llama_color_counts SET llama_count = llama_count - 1 WHERE color = OLD.color; "
+        "DELETE FROM llama_color_counts WHERE color = OLD.color AND llama_count = 0; "
+        "UPDATE llama_rating_counts SET llama_count = llama_count - 1 WHERE rating = OLD.rating; "
+        "DELETE FROM llama_rating_counts WHERE rating = OLD.rating AND llama_count = 0; "
+        "UPDATE llama_age_counts SET llama_count = llama_count - 1 WHERE age = OLD.age; "
+        "DELETE FROM llama_age_counts WHERE age = OLD.age AND llama_count = 0; "
+        "END"
+    ),
+]
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    for table, column in TABLES.items():
+        op.create_table(
+            table,
+            sa.Column(column, sa.String if column == "color" else sa.Integer, primary_key=True),
+            sa.Column("llama_count", sa.Integer, nullable=False),
+        )
+
+        # Count the existing llamas. This is the only time the llamas table is scanned.
+        op.execute(
+            sa.text(
+                f"INSERT INTO {table} ({column}, llama_count) SELECT {column}, COUNT(*) FROM llamas GROUP BY {column}"
+            )
+        )
+
+    for trigger in TRIGGERS:
+        op.execute(sa.text(trigger))
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    for operation in ["insert", "update", "delete"]:
+        op.execute(sa.text(f"DROP TRIGGER IF EXISTS count_llamas_after_{operation}"))
+    for table in TABLES:
+        op.drop_table(table)
@@ -0,0 +1,37 @@
+"""Add a version to llamas for conditional updates
+
+Revision ID: 8c4a2e6f1d95
+Revises: 2b5e9d7c3a41
+Create Date: 2026-10-19 20:36:52.418730
+
+"""
+
+# pylint: disable=invalid-name,no-member
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8c4a2e6f1d95"
+down_revision: Union[str, None] = "2b5e9d7c3a41"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    # Add the column in place rather than with a batch operation, as recreating the llamas table would drop its
+    # triggers. Existing llamas start at version 1.
+    op.add_column("llamas", sa.Column("version", sa.Integer, nullable=False, server_default="1"))
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    # None of the triggers use the version, so it can be dropped in place
+    op.drop_column("llamas", "version")
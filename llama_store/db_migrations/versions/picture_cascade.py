@@ -0,0 +1,44 @@
+"""Delete llama pictures along with their llama
+
+Revision ID: 3f8e6b1d0c27
+Revises: 5d1c7e2a9f34
+Create Date: 2026-10-19 10:04:17.530911
+
+"""
+
+# pylint: disable=invalid-name,no-member
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f8e6b1d0c27"
+down_revision: Union[str, None] = "5d1c7e2a9f34"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# SQLite needs constraints to be named to be able to drop them
+FOREIGN_KEY_NAME = "fk_llama_picture_locations_llama_id_llamas"
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    # Remove any pictures for llamas that have already been deleted, otherwise they would break the foreign key.
+    # The picture files are left for the picture garbage collector to clean up.
+    op.execute(sa.text("DELETE FROM llama_picture_locations WHERE llama_id NOT IN (SELECT llama_id FROM llamas)"))
+
+    # SQLite can't add a foreign key to an existing table, so batch mode recreates the table with it
+    with op.batch_alter_table("llama_picture_locations") as batch_op:
+        batch_op.create_foreign_key(FOREIGN_KEY_NAME, "llamas", ["llama_id"], ["llama_id"], ondelete="CASCADE")
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    with op.batch_alter_table("llama_picture_locations") as batch_op:
+        batch_op.drop_constraint(FOREIGN_KEY_NAME, type_="foreignkey")
@@ -0,0 +1,102 @@
+"""Add the details of each llama picture
+
+Revision ID: 5d1c7e2a9f34
+Revises: 8b0af4942743
+Create Date: 2026-10-19 09:12:41.118204
+
+"""
+
+# pylint: disable=invalid-name,no-member
+import base64
+import hashlib
+import io
+from typing import Any, Dict, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5d1c7e2a9f34"
+down_revision: Union[str, None] = "8b0af4942743"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The maximum width and height of the placeholder image created for each picture
+PLACEHOLDER_SIZE = 8
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    # Add the columns for the picture details. These are nullable, as pictures with a missing file can't be filled in
+    with op.batch_alter_table("llama_picture_locations") as batch_op:
+        batch_op.add_column(sa.Column("width", sa.Integer, nullable=True))
+        batch_op.add_column(sa.Column("height", sa.Integer, nullable=True))
+        batch_op.add_column(sa.Column("byte_size", sa.Integer, nullable=True))
+        batch_op.add_column(sa.Column("content_hash", sa.String, nullable=True))
+        batch_op.add_column(sa.Column("placeholder", sa.String, nullable=True))
+
+    # Fill in the details for the existing pictures. A picture that can't be read or decoded is left without details,
+    # as the server runs the migrations when it starts, and one bad picture shouldn't stop it starting
+    connection = op.get_bind()
+    pictures = connection.execute(sa.text("SELECT llama_id, image_file_location FROM llama_picture_locations"))
+    for llama_id, image_file_location in pictures.fetchall():
+        try:
+            details = _get_picture_details(image_file_location)
+        except Exception:  # pylint: disable=broad-except
+            continue
+
+        connection.execute(
+            sa.text(
+                "UPDATE llama_picture_locations SET width = :width, height = :height, byte_size = :byte_size, "
+                "content_hash = :content_hash, placeholder = :placeholder WHERE llama_id = :llama_id"
+            ),
+            {"llama_id": llama_id, **details},
+        )
+
+
+def _get_picture_details(image_file_location: str) -> Dict[str, Any]:
+    """
+    Gets the details of a stored picture. This is a copy of how the details were calculated when this migration was
+    written, so the migration doesn't change if the API's picture handling does.
+
+    :param str image_file_location: The path of the picture file.
+    :return: The width, height, byte size, content hash and placeholder of the picture.
+    :rtype: Dict[str, Any]
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    # When this migration was written, pictures were always stored on the local file system, and the location of
+    # each picture was its path
+    with open(image_file_location, "rb") as file:
+        body = file.read()
+
+    with Image.open(io.BytesIO(body)) as image:
+        width, height = image.size
+
+        # Create the placeholder by shrinking the picture down to a few pixels
+        image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+        placeholder = io.BytesIO()
+        image.save(placeholder, format="PNG", optimize=True)
+
+    return {
+        "width": width,
+        "height": height,
+        "byte_size": len(body),
+        "content_hash": hashlib.sha256(body).hexdigest(),
+        "placeholder": "data:image/png;base64," + base64.b64encode(placeholder.getvalue()).decode(),
+    }
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    with op.batch_alter_table("llama_picture_locations") as batch_op:
+        batch_op.drop_column("placeholder")
+        batch_op.drop_column("content_hash")
+        batch_op.drop_column("byte_size")
+        batch_op.drop_column("height")
+        batch_op.drop_column("width")
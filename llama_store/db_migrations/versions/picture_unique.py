@@ -0,0 +1,47 @@
+"""Only allow one picture for each llama
+
+Revision ID: c41d9e7b2a58
+Revises: 3f8e6b1d0c27
+Create Date: 2026-10-19 10:47:52.208364
+
+"""
+
+# pylint: disable=invalid-name,no-member
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c41d9e7b2a58"
+down_revision: Union[str, None] = "3f8e6b1d0c27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX_NAME = "ix_llama_picture_locations_llama_id"
+
+
+def upgrade() -> None:
+    """
+    Upgrade the database to the latest revision.
+    """
+    # Remove any duplicate pictures, keeping the most recent picture for each llama
+    op.execute(
+        sa.text(
+            "DELETE FROM llama_picture_locations WHERE llama_picture_id NOT IN "
+            "(SELECT MAX(llama_picture_id) FROM llama_picture_locations GROUP BY llama_id)"
+        )
+    )
+
+    # Databases created by the app rather than by migrations have a non-unique index, so replace it
+    op.drop_index(INDEX_NAME, table_name="llama_picture_locations", if_exists=True)
+    op.create_index(INDEX_NAME, "llama_picture_locations", ["llama_id"], unique=True)
+
+
+def downgrade() -> None:
+    """
+    Downgrade the database to the previous revision.
+    """
+    op.drop_index(INDEX_NAME, table_name="llama_picture_locations")
+    op.create_index(INDEX_NAME, "llama_picture_locations", ["llama_id"], unique=False)
@@ -1,17 +1,20 @@
 """
 Helper script to extract the OpenAPI spec from a FastAPI app.
+
+The spec is rendered with the same code the API uses to serve it, so the files match what the API sends. Pass
+--out more than once to write the JSON and YAML specs from a single import of the app.
 """
 
 import argparse
-import json
 import sys
-import yaml
 from uvicorn.importer import import_from_string
 
 parser = argparse.ArgumentParser(prog="extract-openapi.py")
 parser.add_argument("app", help='App import string. Eg. "main:app"', default="main:app")
 parser.add_argument("--app-dir", help="Directory containing the app", default=None)
-parser.add_argument("--out", help="Output file ending in .json or .yaml", default="openapi.yaml")
+parser.add_argument(
+    "--out", help="Output file ending in .json or .yaml. This can be passed more than once", action="append"
+)
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -22,14 +25,16 @@ if __name__ == "__main__":
 
     print(f"importing app from {args.app}")
     app = import_from_string(args.app)
+
+    # The renderer is imported after the app, as the app directory may have only just been added to the path
+    from openapi import render_openapi_json, render_openapi_yaml  # pylint: disable=import-outside-toplevel
+
     openapi = app.openapi()
     version = openapi.get("openapi", "unknown version")
 
-    print(f"writing openapi spec v{version}")
-    with open(args.out, "w") as f:  # pylint: disable=unspecified-encoding
-        if args.out.endswith(".json"):
-            json.dump(openapi, f, indent=2)
-        else:
-            yaml.dump(openapi, f, sort_keys=False)
+    for out in args.out or ["openapi.yaml"]:
+        print(f"writing openapi spec v{version}")
+        with open(out, "wb") as f:
+            f.write(render_openapi_json(openapi) if out.endswith(".json") else render_openapi_yaml(openapi))
 
-    print(f"spec written to {args.out}")
+        print(f"spec written to {out}")
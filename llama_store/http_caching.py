@@ -0,0 +1,460 @@
+"""
+Helpers for HTTP caching. This covers ETag and Last-Modified validation so clients can make conditional requests,
+and byte range requests so downloads can be resumed.
+
+Files can also be sent without copying them through Python. Behind nginx, Apache or lighttpd, set
+PICTURE_SENDFILE_MODE so the proxy sends the file. When serving directly, files are sent with the ASGI zero copy
+send extension if the server supports it.
+"""
+
+from email.utils import formatdate, parsedate_to_datetime
+import hashlib
+import os
+import stat
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, Request, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from data.storage import PictureStorage
+
+# The Cache-Control header sent with llama pictures. Pictures need an API token, so by default only the client
+# can cache them, and it revalidates them using the ETag after a minute.
+PICTURE_CACHE_CONTROL = os.environ.get("PICTURE_CACHE_CONTROL", "private, max-age=60")
+
+# How files are handed to a front proxy to send - off, x-accel-redirect for nginx, or x-sendfile for Apache and
+# lighttpd. With a proxy mode set, the API only checks the request and the proxy sends the file.
+SENDFILE_MODE = os.environ.get("PICTURE_SENDFILE_MODE", "off").lower()
+
+# The folder that X-Accel-Redirect paths are relative to, and the internal nginx location that maps to it
+SENDFILE_ROOT = os.environ.get("PICTURE_SENDFILE_ROOT", ".appdata/llama_store_data")
+ACCEL_REDIRECT_PREFIX = os.environ.get("PICTURE_ACCEL_REDIRECT_PREFIX", "/protected/")
+
+# The ASGI extension servers offer when they can send a file straight from a file descriptor to the socket
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+def make_etag(*parts: object) -> str:
+    """
+    Makes a strong ETag from the given parts, such as a file's modified time and size.
+
+    :return: The quoted ETag.
+    :rtype: str
+    """
+    etag_base = "-".join(str(part) for part in parts)
+    return '"' + hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest() + '"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """
+    Checks if an ETag matches any of the ETags in an If-None-Match or If-Match header. Weak ETags are compared
+    ignoring the W/ prefix.
+
+    :param str header: The value of the header.
+    :param str etag: The current ETag of the resource.
+    :return: True if the ETag matches.
+    :rtype: bool
+    """
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == current for candidate in header.split(","))
+
+
+def make_version_etag(version: int) -> str:
+    """
+    Makes a strong ETag from a version number, such as a llama's version.
+
+    :param int version: The version.
+    :return: The quoted ETag.
+    :rtype: str
+    """
+    return f'"{version}"'
+
+
+def parse_version_etags(header: str) -> Optional[List[int]]:
+    """
+    Parses an If-Match header into the versions of the ETags made by make_version_etag. Weak ETags are compared
+    ignoring the W/ prefix, as compressed responses have their ETag made weak. ETags that aren't versions can't
+    match, so they are left out.
+
+    :param str header: The value of the header.
+    :return: The versions, or None if the header is *, which matches any version.
+    :rtype: Optional[List[int]]
+    """
+    if header.strip() == "*":
+        return None
+
+    versions = []
+    for candidate in header.split(","):
+        candidate = candidate.strip().removeprefix("W/")
+        if len(candidate) > 2 and candidate[0] == candidate[-1] == '"' and candidate[1:-1].isdecimal():
+            versions.append(int(candidate[1:-1]))
+    return versions
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """
+    Checks the If-None-Match and If-Modified-Since headers of a request, to see if the client already has the
+    current version of a resource. If-None-Match takes priority, as described in RFC 9110.
+
+    :param Request request: The request.
+    :param str etag: The current ETag of the resource.
+    :param float last_modified: The time the resource was last modified as a timestamp, if known.
+    :return: True if the client can use its cached copy.
+    :rtype: bool
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def parse_quality_values(header: str) -> Dict[str, float]:
+    """
+    Parses a header with quality values, such as Accept or Accept-Encoding, into a dictionary of values and their
+    quality values. Values are lower cased.
+
+    :param str header: The value of the header.
+    :return: The quality value for each value in the header, including wildcards.
+    :rtype: Dict[str, float]
+    """
+    qualities: Dict[str, float] = {}
+    for item in header.split(","):
+        value, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, param_value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        if value:
+            qualities[value.lower()] = max(quality, qualities.get(value.lower(), 0.0))
+    return qualities
+
+
+def choose_content_encoding(header: Optional[str], available: Iterable[str]) -> str:
+    """
+    Chooses the content coding to send a response with, from an Accept-Encoding header.
+
+    :param str header: The value of the Accept-Encoding header, or None if it wasn't sent.
+    :param available: The codings the response is available in, other than identity, in order of preference.
+    :return: The coding with the highest quality value, or identity if the client doesn't accept any of them.
+    :rtype: str
+    """
+    if not header:
+        return "identity"
+
+    qualities = parse_quality_values(header)
+    best, best_quality = "identity", 0.0
+    for coding in available:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def parse_range_header(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a Range header for a single byte range.
+
+    :param str header: The value of the Range header.
+    :param int size: The size of the resource in bytes.
+    :return: The first and last byte positions, inclusive, or None if the header should be ignored.
+    :rtype: Tuple[int, int]
+    :raises HTTPException: A 416 if the range can't be satisfied.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        # Other units and multiple ranges are not supported, so send the whole resource
+        return None
+
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first == "":
+            # A suffix range, such as -500 for the last 500 bytes
+            suffix_length = int(last)
+            start, end = max(size - suffix_length, 0), size - 1
+            if suffix_length <= 0:
+                raise ValueError()
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if end < start < size:
+                return None
+    except ValueError:
+        return None
+
+    if start >= size or size == 0:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    return start, end
+
+
+class PartialFileResponse(Response):
+    """
+    A response that sends a single byte range of a file, with a 206 status code.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, path: str, start: int, end: int, size: int, media_type: str, headers: Mapping[str, str]
+    ) -> None:
+        super().__init__(status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+            await _send_zerocopy(send, self.path, self.start, self.end - self.start + 1)
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.end - self.start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                more_body = remaining > 0 and len(chunk) > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                if not chunk:
+                    break
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """
+    A file response that uses the ASGI zero copy send extension if the server supports it, so the server can use
+    os.sendfile rather than reading the file in Python. Otherwise the file is sent as a normal file response.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if ZEROCOPY_EXTENSION not in scope.get("extensions", {}) or scope.get("method") == "HEAD":
+            await super().__call__(scope, receive, send)
+            return
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await _send_zerocopy(send, self.path, 0, self.stat_result.st_size)
+        if self.background is not None:
+            await self.background()
+
+
+async def _send_zerocopy(send: Send, path: str, offset: int, count: int) -> None:
+    """
+    Sends part of a file using the ASGI zero copy send extension.
+    """
+    with open(path, "rb") as file:
+        await send({"type": ZEROCOPY_EXTENSION, "file": file, "offset": offset, "count": count, "more_body": False})
+
+
+def _proxy_sendfile_headers(path: str) -> Mapping[str, str]:
+    """
+    Gets the header that tells the front proxy which file to send, for the configured sendfile mode.
+    """
+    if SENDFILE_MODE == "x-accel-redirect":
+        relative_path = os.path.relpath(path, SENDFILE_ROOT).replace(os.sep, "/")
+        return {"X-Accel-Redirect": ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative_path}
+    if SENDFILE_MODE == "x-sendfile":
+        return {"X-Sendfile": os.path.abspath(path)}
+    return {}
+
+
+def _requested_range(request: Request, etag: str, last_modified: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Gets the byte range requested by the Range header, if there is one, and if any If-Range header matches.
+    """
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header is None or (if_range is not None and if_range.strip() not in (etag, last_modified)):
+        return None
+    return parse_range_header(range_header, size)
+
+
+def file_response(request: Request, path: str, media_type: str, headers: Mapping[str, str]) -> Response:
+    """
+    Creates a response for a file that supports conditional and range requests.
+
+    The file is only checked with stat before deciding what to send, so if the client already has the file, a 304
+    is returned without opening it. If a sendfile mode is set, the response tells the front proxy to send the file.
+
+    :param Request request: The request.
+    :param str path: The path to the file.
+    :param str media_type: The media type of the file.
+    :param headers: Any extra headers to send, such as Cache-Control or Vary.
+    :return: A 200, 206 or 304 response.
+    :rtype: Response
+    """
+    stat_result = os.stat(path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise RuntimeError(f"File at path {path} is not a file.")
+
+    etag = make_etag(stat_result.st_mtime, stat_result.st_size)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {**headers, "ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes"}
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # Let the front proxy send the file, including any byte range
+    proxy_headers = _proxy_sendfile_headers(path)
+    if proxy_headers:
+        return Response(media_type=media_type, headers={**headers, **proxy_headers})
+
+    byte_range = _requested_range(request, etag, last_modified, stat_result.st_size)
+    if byte_range is not None:
+        start, end = byte_range
+        return PartialFileResponse(path, start, end, stat_result.st_size, media_type, headers)
+
+    return ZeroCopyFileResponse(path=path, media_type=media_type, headers=headers, stat_result=stat_result)
+
+
+# The size of the chunks read from a picture storage when streaming a picture
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _stream_stored_file(storage: PictureStorage, location: str, start: int, end: int) -> Iterator[bytes]:
+    """
+    Streams the bytes from start to end, inclusive, of a file in a picture storage.
+    """
+    with storage.open(location) as file:
+        position = 0
+        while position <= end:
+            chunk = file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunk_start = position
+            position += len(chunk)
+            if position > start:
+                yield chunk[max(start - chunk_start, 0) : end - chunk_start + 1]
+
+
+def stored_file_response(
+    request: Request, storage: PictureStorage, location: str, media_type: str, headers: Mapping[str, str]
+) -> Response:
+    """
+    Creates a response for a file in a picture storage that supports conditional and range requests.
+
+    Files on the local file system are sent with file_response. Other files are streamed from the storage.
+
+    :param Request request: The request.
+    :param PictureStorage storage: The storage the file is in.
+    :param str location: The location of the file in the storage.
+    :param str media_type: The media type of the file.
+    :param headers: Any extra headers to send, such as Cache-Control or Vary.
+    :return: A 200, 206 or 304 response.
+    :rtype: Response
+    """
+    local_path = storage.local_path(location)
+    if local_path is not None:
+        return file_response(request, local_path, media_type, headers)
+
+    picture_stat = storage.stat(location)
+    if picture_stat is None:
+        raise FileNotFoundError(location)
+
+    etag = make_etag(picture_stat.mtime, picture_stat.size)
+    last_modified = formatdate(picture_stat.mtime, usegmt=True)
+    headers = {**headers, "ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes"}
+
+    if is_not_modified(request, etag, picture_stat.mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = _requested_range(request, etag, last_modified, picture_stat.size)
+    if byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{picture_stat.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _stream_stored_file(storage, location, start, end),
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    headers["Content-Length"] = str(picture_stat.size)
+    return StreamingResponse(
+        _stream_stored_file(storage, location, 0, picture_stat.size - 1), media_type=media_type, headers=headers
+    )
+
+
+def bytes_response(  # pylint: disable=too-many-arguments
+    request: Request,
+    body: bytes,
+    media_type: str,
+    headers: Mapping[str, str],
+    etag: str,
+    last_modified: float,
+) -> Response:
+    """
+    Creates a response for content held in memory that supports conditional and range requests.
+
+    :param Request request: The request.
+    :param bytes body: The content to send.
+    :param str media_type: The media type of the content.
+    :param headers: Any extra headers to send, such as Cache-Control or Vary.
+    :param str etag: The ETag of the content.
+    :param float last_modified: The time the content was last modified, as a timestamp.
+    :return: A 200, 206 or 304 response.
+    :rtype: Response
+    """
+    last_modified_header = formatdate(last_modified, usegmt=True)
+    headers = {**headers, "ETag": etag, "Last-Modified": last_modified_header, "Accept-Ranges": "bytes"}
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    byte_range = _requested_range(request, etag, last_modified_header, len(body))
+    if byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+        return Response(
+            body[start : end + 1], status_code=status.HTTP_206_PARTIAL_CONTENT, media_type=media_type, headers=headers
+        )
+
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def encoded_bytes_response(
+    request: Request, encodings: Mapping[str, Tuple[bytes, str]], media_type: str, headers: Mapping[str, str]
+) -> Response:
+    """
+    Creates a response for content held in memory that has already been compressed. The coding is chosen from the
+    Accept-Encoding header, and each coding has its own ETag so caches never mix them up.
+
+    :param Request request: The request.
+    :param encodings: The body and ETag for each coding, including identity, in order of preference.
+    :param str media_type: The media type of the content.
+    :param headers: Any extra headers to send, such as Cache-Control.
+    :return: A 200 or 304 response.
+    :rtype: Response
+    """
+    coding = choose_content_encoding(request.headers.get("accept-encoding"), [c for c in encodings if c != "identity"])
+    body, etag = encodings[coding]
+    headers = {**headers, "ETag": etag, "Vary": "Accept-Encoding"}
+    if coding != "identity":
+        headers["Content-Encoding"] = coding
+
+    if is_not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return Response(body, media_type=media_type, headers=headers)
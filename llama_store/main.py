@@ -22,35 +22,43 @@ Generate an SDK:
 This will create an SDK in the output folder. You can then use the SDK in your project, or see one of the examples.
 """
 
-import functools
-import io
+import asyncio
+import contextlib
 import os
 
+import anyio
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Response
-import uvicorn
-import yaml
+from fastapi import FastAPI, Request, Response
 
+from change_stream import change_broadcaster
+from compression import COMPRESSION_ENABLED, CompressionMiddleware
 from data import schema
-from data.database import engine
-from openapi import fix_openapi_spec, OPENAPI_DESCRIPTION
+from data.database import READ_REPLICA, engine
+from data.idempotency import IdempotentReplay, replay_idempotent_response
+from data.picture_gc import is_picture_gc_enabled, run_picture_garbage_collection
+from data.replica import is_replica_refresh_needed, read_replica
+from openapi import fix_openapi_spec, OpenAPIDocuments, OPENAPI_DESCRIPTION
 from routers import (
+    change_read,
+    llama_picture_archive,
     llama_picture_read,
-    llama_picture_write,
     llama_read,
-    llama_write,
     token,
-    user_debug,
     user_read,
-    user_write,
 )
 
 # Load the environment variables
 load_dotenv()
 
-# Create the database tables
-schema.Base.metadata.create_all(bind=engine)
+if READ_REPLICA:
+    # Read replicas can't write to the database, so load the data they serve into memory instead. This is done
+    # now rather than on startup so workers forked from this process share it.
+    print("RUNNING AS A READ REPLICA")
+    read_replica.refresh()
+else:
+    # Create the database tables
+    schema.Base.metadata.create_all(bind=engine)
 
 tags_metadata = [
     {
@@ -61,6 +69,10 @@ tags_metadata = [
         "name": "LlamaPicture",
         "description": "Get the llama pictures",
     },
+    {
+        "name": "Change",
+        "description": "Get the changes to llamas and their pictures",
+    },
     {
         "name": "User",
         "description": "Register users",
@@ -71,7 +83,33 @@ tags_metadata = [
     },
 ]
 
+
+@contextlib.asynccontextmanager
+async def lifespan(_: FastAPI):
+    """
+    Start and stop the background tasks. Changes are pushed to change stream clients, orphaned pictures are only
+    cleaned up in write mode, and read replicas check for changes to reload their copy of the data.
+
+    The OpenAPI documents are rendered before the app accepts requests, on a worker thread. When the app is run with
+    serve.py they have already been rendered in the main process, before the workers were forked.
+    """
+    await anyio.to_thread.run_sync(openapi_documents.render)
+
+    # Follow the change log, to push changes to clients of the change stream
+    tasks = [asyncio.create_task(change_broadcaster.run())]
+    if allow_write and is_picture_gc_enabled():
+        tasks.append(asyncio.create_task(run_picture_garbage_collection()))
+    if is_replica_refresh_needed():
+        tasks.append(asyncio.create_task(read_replica.run_refresh()))
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     servers=[{"url": "http://localhost:8080", "description": "Prod"}],
     contact={"name": "liblab", "url": "https://liblab.com"},
     description=OPENAPI_DESCRIPTION,
@@ -81,56 +119,91 @@ app = FastAPI(
     title="Llama Store API",
 )
 
-# Get the environment variables to see if we are in debug/write mode
-allow_write: bool = os.environ.get("ALLOW_WRITE", "true").lower() == "true"
+# Compress responses for clients that accept it
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# Get the environment variables to see if we are in debug/write mode. Read replicas never allow writes.
+allow_write: bool = os.environ.get("ALLOW_WRITE", "true").lower() == "true" and not READ_REPLICA
 debug: bool = os.environ.get("DEBUG", "false").lower() == "true"
 
 # Add the routers - do it in this order so that they appear in the OpenAPI spec in this order
 
 # Add the llama routers
 # Include the read only production routers
+# The picture archive router has to come before the llama read router, otherwise /llama/pictures would be
+# treated as a request for a llama with the ID 'pictures'
 app.include_router(llama_picture_read.router)
+app.include_router(llama_picture_archive.router)
 app.include_router(llama_read.router)
 
 # Include the write routers if we are in allow write mode
 # This is so we can run this in production and not worry about folks
-# writing to our database maliciously
+# writing to our database maliciously. The write routers are only imported in write mode, so read only
+# copies of the API start faster.
 if allow_write:
     print("RUNNING IN WRITE MODE")
+    from routers import llama_picture_write, llama_write
+
     app.include_router(llama_picture_write.router)
     app.include_router(llama_write.router)
 
+    # Retried requests with an idempotency key are answered with the stored response
+    app.add_exception_handler(IdempotentReplay, replay_idempotent_response)
+
+# Add the change feed router
+app.include_router(change_read.router)
+
 # Add the token router
 app.include_router(token.router)
 
-# Add the user routers
+# Add the user routers. Users can't register with a read replica, as that writes to the database.
 app.include_router(user_read.router)
-app.include_router(user_write.router)
+if not READ_REPLICA:
+    from routers import user_write
+
+    app.include_router(user_write.router)
 
 # Include the debug routers if we are in debug mode
 if debug:
     print("RUNNING IN DEBUG MODE")
+    from routers import user_debug
+
     app.include_router(user_debug.router)
 
 # Tweak the OpenAPI spec
 fix_openapi_spec(app)
 
+# The OpenAPI spec is served from documents that are rendered and compressed once, so replace the route FastAPI
+# adds for the JSON spec. The docs UIs still load the spec from the same URL.
+openapi_documents = OpenAPIDocuments(app)
+app.router.routes = [route for route in app.router.routes if getattr(route, "path", None) != app.openapi_url]
+
+
+@app.get("/openapi.json", include_in_schema=False)
+def read_openapi_json(request: Request) -> Response:
+    """
+    Get the OpenAPI spec as JSON.
+
+    :return: The OpenAPI spec as JSON.
+    :rtype: Response
+    """
+    return openapi_documents.response(request, "json")
+
 
 @app.get("/openapi.yaml", include_in_schema=False)
-@functools.lru_cache()
-def read_openapi_yaml() -> Response:
+def read_openapi_yaml(request: Request) -> Response:
     """
     Add support for a YAML OpenAPI spec. This will return the OpenAPI spec converted to YAML.
 
     :return: The OpenAPI spec converted to YAML.
     :rtype: Response
     """
-    openapi_json = app.openapi()
-    yaml_s = io.StringIO()
-    yaml.dump(openapi_json, yaml_s, sort_keys=False)
-    return Response(yaml_s.getvalue(), media_type="text/yaml")
+    return openapi_documents.response(request, "yaml")
 
 
 # Run the app
 if __name__ == "__main__":
+    import uvicorn  # pylint: disable=import-outside-toplevel
+
     uvicorn.run("main:app", host="0.0.0.0", port=8080, reload=True)
@@ -0,0 +1,78 @@
+"""
+Change models. These are used by the change feed endpoint.
+"""
+
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from models.llama import LlamaBase
+
+
+class ChangeEntity(str, Enum):
+    """
+    What was changed.
+    """
+
+    LLAMA = "llama"
+    PICTURE = "picture"
+
+
+class ChangeOperation(str, Enum):
+    """
+    How it was changed.
+    """
+
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+
+
+class Change(BaseModel):
+    """
+    A change to a llama or its picture.
+    """
+
+    seq: int = Field(
+        description="The sequence number of the change. Changes are numbered in the order they were made.",
+        examples=[42],
+    )
+    entity: ChangeEntity = Field(description="Whether the llama or its picture was changed.", examples=["llama"])
+    operation: ChangeOperation = Field(description="How it was changed.", examples=["updated"])
+    llama_id: int = Field(description="The ID of the llama.", examples=[1], alias="llamaId", title="Llama Id")
+    llama: Optional[LlamaBase] = Field(
+        default=None,
+        description="The llama's details after the change. This is only set for llamas that were created or updated.",
+    )
+    changed_at: str = Field(
+        description="When the change was made, as an ISO 8601 UTC timestamp.",
+        examples=["2026-10-19T18:22:17.604Z"],
+        alias="changedAt",
+        title="Changed At",
+    )
+
+    model_config = ConfigDict(populate_by_name=True)
+
+
+class ChangeFeed(BaseModel):
+    """
+    A page of changes, with the token to get the next page.
+    """
+
+    changes: List[Change] = Field(description="The changes, in the order they were made.")
+    next_since: int = Field(
+        description="Pass this as the since query parameter to get the changes after these. If there are no new "
+        "changes, this is the since value that was passed in.",
+        examples=[42],
+        alias="nextSince",
+        title="Next Since",
+    )
+    has_more: bool = Field(
+        description="True if there are more changes after these, so the next page can be requested straight away.",
+        examples=[False],
+        alias="hasMore",
+        title="Has More",
+    )
+
+    model_config = ConfigDict(populate_by_name=True)
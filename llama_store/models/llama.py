@@ -3,8 +3,9 @@ Llama models. These are used by the llama endpoints.
 """
 
 from enum import Enum
+from typing import Dict, Optional
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 
 class LlamaColor(str, Enum):
@@ -87,12 +88,85 @@ class LlamaCreate(LlamaBase):
     """
 
 
+def update_llama_patch_json_schema(schema: Dict) -> None:
+    """
+    Adds the example and description to the JSON schema for a llama patch, and removes null from the types of the
+    fields. The fields are optional so they can be left out of a patch, but they can't be set to null.
+
+    :param Dict schema: The JSON schema for the patch.
+    """
+    schema.update(examples=[{"rating": 5}], description="Changes to a llama. Only the fields that are set are changed.")
+    for field_schema in schema["properties"].values():
+        types = [field_type for field_type in field_schema.pop("anyOf") if field_type != {"type": "null"}]
+        if "$ref" in types[0]:
+            # References can't have other keywords next to them, so they are wrapped like other models' fields
+            field_schema["allOf"] = types
+        else:
+            field_schema.update(types[0])
+
+
+class LlamaPatch(BaseModel):
+    """
+    A JSON merge patch for a llama. Only the fields that are set are changed. Every llama field is required, so
+    fields can't be removed by setting them to null.
+    """
+
+    name: Optional[str] = Field(
+        default=None,
+        description="The new name of the llama. This must be unique across all llamas.",
+        examples=["libby the llama", "labby the llama"],
+        max_length=100,
+    )
+    age: Optional[int] = Field(
+        default=None,
+        description="The new age of the llama in years.",
+        examples=[5, 6, 7],
+    )
+    color: Optional[LlamaColor] = Field(
+        default=None,
+        description="The new color of the llama.",
+        examples=["brown", "white", "black", "gray"],
+    )
+    rating: Optional[int] = Field(
+        default=None,
+        description="The new rating of the llama from 1 to 5.",
+        examples=[1, 2, 3, 4, 5],
+        ge=1,
+        le=5,
+    )
+
+    @field_validator("name", "age", "color", "rating", mode="before")
+    @classmethod
+    def check_not_null(cls, value):
+        """
+        Rejects fields that are set to null. The fields are only None when they are left out of the patch.
+        """
+        if value is None:
+            raise ValueError("Llama fields can't be removed, so they can't be set to null")
+        return value
+
+    model_config = ConfigDict(
+        json_schema_extra=update_llama_patch_json_schema,
+        populate_by_name=True,
+    )
+
+
 class Llama(LlamaBase):
     """
     A llama, with details of it's name, age, color, and rating from 1 to 5.
     """
 
     llama_id: int = Field(description="The ID of the llama.", examples=[1], alias="llamaId", title="Llama Id")
+    picture_url: Optional[str] = Field(
+        default=None,
+        description="A signed, time limited URL for the llama's picture that can be used without an API token. "
+        "This is only set if picture URLs are requested, and the llama has a picture.",
+        examples=["http://localhost:8080/llama/1/picture?expires=1700000000&signature=abc"],
+        alias="pictureUrl",
+        title="Picture Url",
+    )
+    # The version of the llama. This is sent in the ETag header rather than the body.
+    version: Optional[int] = Field(default=None, exclude=True)
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -110,3 +184,96 @@ class Llama(LlamaBase):
         from_attributes=True,
         populate_by_name=True,
     )
+
+
+class LlamaSort(str, Enum):
+    """
+    The order to list llamas in. A leading - sorts in descending order. Llamas that sort the same are listed in ID
+    order.
+    """
+
+    LLAMA_ID = "llamaId"
+    LLAMA_ID_DESCENDING = "-llamaId"
+    NAME = "name"
+    NAME_DESCENDING = "-name"
+    AGE = "age"
+    AGE_DESCENDING = "-age"
+    RATING = "rating"
+    RATING_DESCENDING = "-rating"
+
+    @property
+    def field(self) -> str:
+        """
+        The llama field to sort by, as the snake case field name.
+
+        :return: The field name.
+        :rtype: str
+        """
+        return {"llamaId": "llama_id"}.get(self.value.lstrip("-"), self.value.lstrip("-"))
+
+    @property
+    def descending(self) -> bool:
+        """
+        Whether to sort in descending order.
+
+        :return: True if the sort is descending.
+        :rtype: bool
+        """
+        return self.value.startswith("-")
+
+
+class LlamaQuery(BaseModel):
+    """
+    A filter, sort order and page of llamas to list. Filters that are not set match every llama.
+    """
+
+    color: Optional[LlamaColor] = None
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    min_rating: Optional[int] = None
+    max_rating: Optional[int] = None
+    sort: LlamaSort = LlamaSort.LLAMA_ID
+    offset: int = 0
+    limit: Optional[int] = None
+
+
+class LlamaAgeStats(BaseModel):
+    """
+    Statistics about the ages of the llamas. Percentiles are the youngest age that at least that percent of the
+    llamas are no older than.
+    """
+
+    minimum: int = Field(description="The age of the youngest llama.", examples=[1])
+    p25: int = Field(description="The 25th percentile age.", examples=[3])
+    median: int = Field(description="The median age.", examples=[5])
+    p75: int = Field(description="The 75th percentile age.", examples=[7])
+    p90: int = Field(description="The 90th percentile age.", examples=[9])
+    p99: int = Field(description="The 99th percentile age.", examples=[12])
+    maximum: int = Field(description="The age of the oldest llama.", examples=[14])
+    mean: float = Field(description="The mean age.", examples=[5.2])
+
+
+class LlamaStats(BaseModel):
+    """
+    Statistics about all the llamas in the store.
+    """
+
+    llama_count: int = Field(description="The number of llamas.", examples=[12], alias="llamaCount")
+    color_counts: Dict[LlamaColor, int] = Field(
+        description="The number of llamas of each color.",
+        examples=[{"brown": 5, "white": 3, "black": 2, "gray": 2}],
+        alias="colorCounts",
+    )
+    rating_counts: Dict[int, int] = Field(
+        description="The number of llamas with each rating from 1 to 5.",
+        examples=[{"1": 0, "2": 1, "3": 4, "4": 5, "5": 2}],
+        alias="ratingCounts",
+    )
+    average_rating: Optional[float] = Field(
+        description="The average rating. This is not set if there are no llamas.", examples=[3.7], alias="averageRating"
+    )
+    age: Optional[LlamaAgeStats] = Field(
+        description="Statistics about the ages of the llamas. This is not set if there are no llamas."
+    )
+
+    model_config = ConfigDict(populate_by_name=True)
@@ -2,18 +2,86 @@
 Llama models. These are used by the llama endpoints.
 """
 
-from pydantic import BaseModel
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class LlamaPicture(BaseModel):
     """
-    A link to a file containing a picture of a llama.
+    A link to a file containing a picture of a llama, along with the details of the picture.
+    The details are None for pictures created before these were recorded.
     """
 
     llama_picture_id: int
     llama_id: int
     image_file_location: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    byte_size: Optional[int] = None
+    content_hash: Optional[str] = None
+    placeholder: Optional[str] = None
 
     model_config = {
         "from_attributes": True,
     }
+
+
+class LlamaPictureSize(str, Enum):
+    """
+    A named size for a llama picture. The picture is scaled to fit inside a square of this size.
+    """
+
+    THUMBNAIL = "thumbnail"
+    SMALL = "small"
+    MEDIUM = "medium"
+
+
+# The maximum width and height in pixels for each of the named picture sizes
+LLAMA_PICTURE_SIZE_DIMENSIONS = {
+    LlamaPictureSize.THUMBNAIL: 64,
+    LlamaPictureSize.SMALL: 256,
+    LlamaPictureSize.MEDIUM: 512,
+}
+
+
+class LlamaPictureMetadata(BaseModel):
+    """
+    The details of a llama picture. This can be used to lay out pages before the picture is downloaded.
+    """
+
+    llama_id: int = Field(description="The ID of the llama.", examples=[1], alias="llamaId", title="Llama Id")
+    width: int = Field(description="The width of the picture in pixels.", examples=[1024])
+    height: int = Field(description="The height of the picture in pixels.", examples=[1024])
+    byte_size: int = Field(
+        description="The size of the PNG picture in bytes.", examples=[1119082], alias="byteSize", title="Byte Size"
+    )
+    content_hash: str = Field(
+        description="The SHA-256 hash of the PNG picture, as a hex string.",
+        examples=["9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"],
+        alias="contentHash",
+        title="Content Hash",
+    )
+    placeholder: str = Field(
+        description="A tiny version of the picture as a data URI, to show while the full picture loads.",
+        examples=["data:image/png;base64,iVBORw0KGgo="],
+    )
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "examples": [
+                {
+                    "llamaId": 1,
+                    "width": 1024,
+                    "height": 1024,
+                    "byteSize": 1119082,
+                    "contentHash": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+                    "placeholder": "data:image/png;base64,iVBORw0KGgo=",
+                }
+            ],
+            "description": "The details of a llama picture.",
+        },
+        from_attributes=True,
+        populate_by_name=True,
+    )
@@ -1,10 +1,24 @@
 """
 Helpers for the OpenAPI spec generated by FastAPI.
+
+The spec is served as JSON and YAML. Both documents are rendered once, along with compressed copies and ETags, so
+requests for the spec only have to pick the right bytes to send. The same renderer is used to write the spec files.
 """
 
 # pylint: disable=line-too-long
-from fastapi import FastAPI
+import hashlib
+import json
+import threading
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import FastAPI, Request, Response
+
+from compression import compress, get_available_codings
 from data.user_crud import MAXIMUM_USERS
+from http_caching import encoded_bytes_response, make_etag
+
+# The Cache-Control header sent with the spec. Clients can cache it, but need to revalidate it using the ETag.
+OPENAPI_CACHE_CONTROL = "no-cache"
 
 OPENAPI_INTRO_DESCRIPTION = """The llama store API! Get details on all your favorite llamas.
 
@@ -73,23 +87,117 @@ def fix_openapi_spec(app: FastAPI) -> None:
     See this discussion from the FastAPI GitHub repo: https://github.com/tiangolo/fastapi/discussions/10309
 
     This also adds bearer auth to the security schemes and the top level security section
-    """
-    # Get the existing schema
-    existing_schema = app.openapi()
-
-    # Remove the trailing slash from the server URL
-    for server in existing_schema["servers"]:
-        server["url"] = server["url"].rstrip("/")
 
-    # Set the new schema
-    app.openapi_schema = existing_schema
+    Generating the schema is slow, so it isn't generated here. It is generated the first time it is needed, which is
+    when the OpenAPI documents are rendered as the app starts.
+    """
+    # Keep FastAPI's function, which generates the schema the first time it is called and then reuses it
+    generate_openapi_schema = app.openapi
 
     # Define a function to return the new schema - the function on the app is replaced with this one
     def get_openapi_schema():
         """
-        Return the new schema.
+        Return the new schema, with the trailing slashes removed from the server URLs.
         """
-        return existing_schema
+        schema = generate_openapi_schema()
+        for server in schema["servers"]:
+            server["url"] = server["url"].rstrip("/")
+        return schema
 
     # Replace the function on the app to return the new schema
     app.openapi = get_openapi_schema
+
+
+def render_openapi_json(spec: Dict[str, Any]) -> bytes:
+    """
+    Renders the OpenAPI spec as JSON.
+
+    :param spec: The OpenAPI spec.
+    :return: The spec as indented JSON.
+    :rtype: bytes
+    """
+    return json.dumps(spec, indent=2).encode()
+
+
+def render_openapi_yaml(spec: Dict[str, Any]) -> bytes:
+    """
+    Renders the OpenAPI spec as YAML, keeping the order of the keys.
+
+    :param spec: The OpenAPI spec.
+    :return: The spec as YAML.
+    :rtype: bytes
+    """
+    # PyYAML is slow to import, and only needed here
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    return yaml.dump(spec, sort_keys=False).encode()
+
+
+class OpenAPIDocument(NamedTuple):
+    """
+    A rendered OpenAPI document, with the body and ETag for each content coding it can be sent with.
+    """
+
+    media_type: str
+    encodings: Dict[str, Tuple[bytes, str]]
+
+
+def create_openapi_document(body: bytes, media_type: str) -> OpenAPIDocument:
+    """
+    Creates an OpenAPI document, compressing it as small as possible with each coding the API supports.
+
+    :param bytes body: The rendered document.
+    :param str media_type: The media type of the document.
+    :return: The document.
+    :rtype: OpenAPIDocument
+    """
+    bodies = {coding: compress(body, coding, best=True) for coding in get_available_codings()}
+    bodies["identity"] = body
+
+    digest = hashlib.sha256(body).hexdigest()
+    return OpenAPIDocument(
+        media_type=media_type,
+        encodings={coding: (coded, make_etag(digest, coding)) for coding, coded in bodies.items()},
+    )
+
+
+class OpenAPIDocuments:
+    """
+    The OpenAPI spec for an app, rendered as JSON and YAML. The documents are rendered once when the app starts,
+    before it accepts requests.
+    """
+
+    def __init__(self, app: FastAPI) -> None:
+        self._app = app
+        self._lock = threading.Lock()
+        self._documents: Optional[Dict[str, OpenAPIDocument]] = None
+
+    def render(self) -> Dict[str, OpenAPIDocument]:
+        """
+        Renders the documents if they haven't been rendered yet.
+
+        :return: The documents, keyed by format.
+        :rtype: Dict[str, OpenAPIDocument]
+        """
+        with self._lock:
+            if self._documents is None:
+                spec = self._app.openapi()
+                self._documents = {
+                    "json": create_openapi_document(render_openapi_json(spec), "application/json"),
+                    "yaml": create_openapi_document(render_openapi_yaml(spec), "text/yaml"),
+                }
+            return self._documents
+
+    def response(self, request: Request, document_format: str) -> Response:
+        """
+        Creates a response with one of the documents, compressed if the client accepts it.
+
+        :param Request request: The request.
+        :param str document_format: The format of the document, json or yaml.
+        :return: A 200 or 304 response.
+        :rtype: Response
+        """
+        document = self.render()[document_format]
+        return encoded_bytes_response(
+            request, document.encodings, document.media_type, {"Cache-Control": OPENAPI_CACHE_CONTROL}
+        )
@@ -0,0 +1,102 @@
+"""
+The endpoints for reading the changes to llamas and their pictures.
+"""
+
+# pylint: disable=invalid-name
+
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, Header, Query, status
+from sqlalchemy.orm import Session
+
+from change_stream import ChangeStreamResponse, change_broadcaster, stream_changes
+from data import change_crud
+from data.database import get_db
+from data.user_crud import get_current_user_from_api_token
+
+from models.change import ChangeFeed
+from models.user import User
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["Change"],
+)
+
+
+@router.get(
+    path="",
+    operation_id="GetChanges",
+    response_model=ChangeFeed,
+    response_model_exclude_none=True,
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"model": ChangeFeed, "description": "Changes"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
+        status.HTTP_403_FORBIDDEN: {
+            "description": "Not authenticated. Send a valid API token in the Authorization header."
+        },
+    },
+)
+def get_changes(
+    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    since: Annotated[
+        int,
+        Query(
+            description="Get the changes after this sequence number. Use 0 to get every change from the start, "
+            "then pass the nextSince value from each response to get the changes after it.",
+            ge=0,
+        ),
+    ] = 0,
+    limit: Annotated[int, Query(description="The most changes to return.", ge=1, le=1000)] = 100,
+    db: Session = Depends(get_db),
+) -> ChangeFeed:
+    """
+    Get the changes made to llamas and their pictures, in order. Replaying the changes from the start gives every
+    llama and picture, so clients can sync a copy of the llamas by only reading what changed since they last
+    checked.
+    """
+    # Get the changes from the database
+    return change_crud.get_change_feed(db, since, limit)
+
+
+@router.get(
+    path="/stream",
+    operation_id="StreamChanges",
+    response_class=ChangeStreamResponse,
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {"text/event-stream": {"schema": {"type": "string"}}},
+            "description": "A stream of server-sent events. Each change is sent as a change event, with the "
+            "change as JSON in the data, and the sequence number as the event ID.",
+        },
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
+        status.HTTP_403_FORBIDDEN: {
+            "description": "Not authenticated. Send a valid API token in the Authorization header."
+        },
+    },
+)
+async def stream_llama_changes(
+    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    last_event_id: Annotated[
+        Optional[int],
+        Header(
+            description="The ID of the last event received. The changes made since are sent first, so a client "
+            "that reconnects doesn't miss any changes.",
+            ge=0,
+        ),
+    ] = None,
+    db: Session = Depends(get_db),
+) -> ChangeStreamResponse:
+    """
+    Stream the changes made to llamas and their pictures as server-sent events, as they happen. Clients that
+    fall too far behind are disconnected, and can reconnect with the Last-Event-ID header to carry on where they
+    left off.
+    """
+    # The stream stays open for a long time, so give back the database connection used to check the API token
+    # rather than holding it until the stream ends
+    db.close()
+
+    # Connect the client to the broadcaster, then stream the changes
+    subscriber = change_broadcaster.subscribe()
+    return ChangeStreamResponse(change_broadcaster, subscriber, stream_changes(subscriber, last_event_id))
@@ -0,0 +1,69 @@
+"""
+The endpoints for downloading many llama pictures at once.
+"""
+
+# pylint: disable=invalid-name
+
+from typing import Annotated, List, Optional
+
+from fastapi import APIRouter, Depends, Query, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from data import llama_picture_crud
+from data.database import get_db
+from data.files import stream_llama_pictures_as_zip
+from data.user_crud import get_current_user_from_api_token
+
+from models.llama import LlamaColor
+from models.user import User
+
+router = APIRouter(
+    prefix="/llama/pictures",
+    tags=["LlamaPicture"],
+)
+
+
+@router.get(
+    path="",
+    operation_id="GetLlamaPictures",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {
+            "content": {"application/zip": {}},
+            "description": "A zip archive of llama pictures",
+        },
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
+        status.HTTP_403_FORBIDDEN: {
+            "description": "Not authenticated. Send a valid API token in the Authorization header."
+        },
+    },
+)
+def get_llama_pictures(
+    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    db: Session = Depends(get_db),
+    llama_id: Annotated[
+        Optional[List[int]],
+        Query(description="The IDs of the llamas to get the pictures for. Leave this out to get all the pictures."),
+    ] = None,
+    color: Annotated[
+        Optional[LlamaColor],
+        Query(description="Only get the pictures of llamas with this color."),
+    ] = None,
+) -> StreamingResponse:
+    """
+    Get the pictures for many llamas at once, as a zip archive. Each picture is named <llama_id>.png.
+
+    The archive is streamed as it is created, so you can download every llama picture in a single request.
+    Llamas that don't exist, or that don't have a picture, are left out of the archive.
+    """
+    # Get the locations of the pictures from the database
+    pictures = llama_picture_crud.get_llama_pictures(db, llama_ids=llama_id, color=color)
+
+    # Stream the pictures as a zip archive
+    return StreamingResponse(
+        stream_llama_pictures_as_zip((f"{picture.llama_id}.png", picture.image_file_location) for picture in pictures),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="llama-pictures.zip"'},
+    )
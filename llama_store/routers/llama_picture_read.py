@@ -2,18 +2,32 @@
 The endpoints for reading llama picturess.
 """
 
-# pylint: disable=invalid-name
+# pylint: disable=invalid-name,too-many-arguments
 
-from typing import Annotated
+import time
+from typing import Annotated, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Path, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from fastapi.responses import FileResponse, RedirectResponse
 from sqlalchemy.orm import Session
 
 from data import llama_picture_crud
 from data.database import get_db
+from data.files import get_llama_picture_metadata
+from data.picture_signing import authorize_llama_picture_request
+from data.picture_memory_cache import get_cached_picture, is_picture_memory_cache_enabled, load_picture_into_cache
+from data.picture_variants import (
+    MAX_VARIANT_DIMENSION,
+    PICTURE_MEDIA_TYPES,
+    choose_picture_format,
+    get_llama_picture_variant,
+    variant_storage,
+)
+from data.storage import PRESIGNED_URL_EXPIRY, REDIRECT_TO_STORAGE, get_picture_storage
 from data.user_crud import get_current_user_from_api_token
+from http_caching import PICTURE_CACHE_CONTROL, bytes_response, stored_file_response
 
+from models.llama_picture import LLAMA_PICTURE_SIZE_DIMENSIONS, LlamaPictureMetadata, LlamaPictureSize
 from models.user import User
 
 router = APIRouter(
@@ -29,23 +43,142 @@ router = APIRouter(
     status_code=status.HTTP_200_OK,
     responses={
         status.HTTP_200_OK: {
-            "content": {"image/png": {}},
+            "content": {"image/png": {}, "image/webp": {}, "image/avif": {}},
             "description": "Llamas",
         },
-        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
+        status.HTTP_307_TEMPORARY_REDIRECT: {
+            "description": "The picture can be downloaded directly from the picture storage at the Location URL"
+        },
+        status.HTTP_400_BAD_REQUEST: {"description": "Both a named size and a width or height were requested"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token, or an invalid or expired picture URL"},
         status.HTTP_403_FORBIDDEN: {
-            "description": "Not authenticated. Send a valid API token in the Authorization header."
+            "description": "Not authenticated. Send a valid API token in the Authorization header, or use a signed URL."
         },
         status.HTTP_404_NOT_FOUND: {"description": "Llama or llama picture not found"},
+        status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE: {"description": "The requested byte range is not valid"},
     },
 )
+# pylint: disable-next=too-many-locals
 def get_llama_picture(
     llama_id: Annotated[int, Path(description="The ID of the llama to get the picture for", examples=["1", "2"])],
-    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    request: Request,
+    signed_url_expires: Annotated[Optional[int], Depends(authorize_llama_picture_request)],
     db: Session = Depends(get_db),
+    size: Annotated[
+        Optional[LlamaPictureSize],
+        Query(description="A named size to scale the picture to. This cannot be used with width or height."),
+    ] = None,
+    width: Annotated[
+        Optional[int],
+        Query(description="The maximum width of the picture in pixels.", ge=1, le=MAX_VARIANT_DIMENSION),
+    ] = None,
+    height: Annotated[
+        Optional[int],
+        Query(description="The maximum height of the picture in pixels.", ge=1, le=MAX_VARIANT_DIMENSION),
+    ] = None,
 ) -> FileResponse:
     """
-    Get a llama's picture by the llama ID. Pictures are in PNG format.
+    Get a llama's picture by the llama ID. Pictures are in PNG format, unless the Accept header asks for
+    image/webp or image/avif, in which case the picture is sent in that format if the server supports it.
+
+    To get a smaller version of the picture, pass a named size, or a maximum width and/or height.
+    The picture is scaled to fit inside these, keeping its aspect ratio. Pictures are never scaled up.
+
+    Responses include an ETag and Last-Modified header, so pictures can be revalidated with If-None-Match or
+    If-Modified-Since, getting a 304 if the picture hasn't changed. Single byte ranges are supported using the
+    Range header, so downloads can be resumed.
+
+    If the server is set up to do so, requests for the full size PNG are redirected to a short lived URL that
+    downloads the picture straight from where the pictures are stored.
+
+    Instead of an API token, a signed URL from the pictureUrl field of a llama can be used. These URLs expire after
+    a short time, and can be cached by the browser or a CDN until they do.
+    """
+    # Named sizes and explicit dimensions can't be mixed
+    if size is not None and (width is not None or height is not None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Use either a named size, or a width and height"
+        )
+
+    if size is not None:
+        width = height = LLAMA_PICTURE_SIZE_DIMENSIONS[size]
+
+    # The picture format depends on the Accept header, so caches need to know to vary on it
+    picture_format = choose_picture_format(request.headers.get("accept"))
+    media_type = PICTURE_MEDIA_TYPES[picture_format]
+    headers = {"Vary": "Accept", "Cache-Control": PICTURE_CACHE_CONTROL}
+
+    # Signed URLs don't need an API token, so they can be cached by anyone until they expire
+    if signed_url_expires is not None:
+        headers["Cache-Control"] = f"public, max-age={max(signed_url_expires - int(time.time()), 0)}"
+
+    # If this picture is in the memory cache, send it without going to the database or reading the file
+    cache_key = (llama_id, width or 0, height or 0, picture_format)
+    cached_picture = get_cached_picture(cache_key)
+    if cached_picture is not None:
+        return bytes_response(
+            request, cached_picture.body, media_type, headers, cached_picture.etag, cached_picture.mtime
+        )
+
+    # Check the llama is valid
+    db_picture = llama_picture_crud.get_llama_picture_by_id(db, llama_id)
+    if db_picture is None:
+        # If the llama does not exist, return a 404
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Llama picture not found")
+
+    # If a smaller picture or a different format was requested, use a variant, otherwise use the original picture
+    storage, picture_location = get_picture_storage(), db_picture.image_file_location
+    if width is not None or height is not None or picture_format != "png":
+        variant = get_llama_picture_variant(llama_id, picture_location, width, height, picture_format)
+        if variant.body is not None:
+            # The variant is too big for the variant cache, so it was made just for this request
+            return bytes_response(request, variant.body, media_type, headers, variant.etag, variant.mtime)
+        storage, picture_location = variant_storage, variant.file_name
+    elif REDIRECT_TO_STORAGE:
+        # Send the client to the storage for the original picture, so the bytes don't go through the API
+        # pylint: disable-next=assignment-from-none
+        presigned_url = storage.presigned_url(picture_location, PRESIGNED_URL_EXPIRY)
+        if presigned_url is not None:
+            return RedirectResponse(presigned_url, status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers=headers)
+
+    # Keep small pictures in memory for next time, if the memory cache is turned on
+    if is_picture_memory_cache_enabled():
+        cached_picture = load_picture_into_cache(cache_key, storage, picture_location, media_type)
+        if cached_picture is not None:
+            return bytes_response(
+                request, cached_picture.body, media_type, headers, cached_picture.etag, cached_picture.mtime
+            )
+
+    # Return the llama picture from the picture storage
+    return stored_file_response(request, storage, picture_location, media_type, headers)
+
+
+@router.get(
+    path="/metadata",
+    operation_id="GetLlamaPictureMetadataByLlamaID",
+    response_model=LlamaPictureMetadata,
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"model": LlamaPictureMetadata, "description": "Llama picture details"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
+        status.HTTP_403_FORBIDDEN: {
+            "description": "Not authenticated. Send a valid API token in the Authorization header."
+        },
+        status.HTTP_404_NOT_FOUND: {"description": "Llama or llama picture not found"},
+    },
+)
+def get_llama_picture_metadata_by_llama_id(
+    llama_id: Annotated[
+        int, Path(description="The ID of the llama to get the picture details for", examples=["1", "2"])
+    ],
+    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    db: Session = Depends(get_db),
+) -> LlamaPictureMetadata:
+    """
+    Get the details of a llama's picture by the llama ID, without downloading the picture.
+
+    This includes the width and height in pixels, the size in bytes, a SHA-256 hash of the picture, and a tiny
+    placeholder version of the picture as a data URI that can be shown while the full picture loads.
     """
     # Check the llama is valid
     db_picture = llama_picture_crud.get_llama_picture_by_id(db, llama_id)
@@ -53,5 +186,15 @@ def get_llama_picture(
         # If the llama does not exist, return a 404
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Llama picture not found")
 
-    # Return the llama picture from the file system
-    return FileResponse(path=db_picture.image_file_location, media_type="image/png")
+    # Pictures created before the details were recorded won't have them, so work them out from the file
+    if db_picture.content_hash is None:
+        return get_llama_picture_metadata(llama_id, db_picture.image_file_location)
+
+    return LlamaPictureMetadata(
+        llama_id=llama_id,
+        width=db_picture.width,
+        height=db_picture.height,
+        byte_size=db_picture.byte_size,
+        content_hash=db_picture.content_hash,
+        placeholder=db_picture.placeholder,
+    )
@@ -9,9 +9,13 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, Path, Request, status
 from sqlalchemy.orm import Session
 
-from data import llama_crud, llama_picture_crud
+from change_stream import notify_change_stream
+from data import llama_picture_crud
 from data.database import get_db
 from data.files import delete_llama_picture_file, write_llama_picture_to_file
+from data.idempotency import IdempotentRequest, get_idempotent_request
+from data.picture_memory_cache import delete_cached_llama_pictures
+from data.picture_variants import delete_llama_picture_variants
 from data.user_crud import get_current_user_from_api_token
 from models.llama import LlamaId
 from models.user import User
@@ -19,6 +23,8 @@ from models.user import User
 router = APIRouter(
     prefix="/llama/{llama_id}/picture",
     tags=["LlamaPicture"],
+    # Wake the change stream after each write, so clients get the change straight away
+    dependencies=[Depends(notify_change_stream)],
 )
 
 
@@ -35,7 +41,13 @@ router = APIRouter(
             "description": "Not authenticated. Send a valid API token in the Authorization header."
         },
         status.HTTP_404_NOT_FOUND: {"description": "Llama not found"},
-        status.HTTP_409_CONFLICT: {"description": "Llama picture already exists"},
+        status.HTTP_409_CONFLICT: {
+            "description": "Llama picture already exists, or a request with this idempotency key is still being "
+            "handled"
+        },
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "description": "Validation error, or this idempotency key was already used for a different request"
+        },
     },
     openapi_extra={
         "requestBody": {
@@ -49,10 +61,14 @@ async def create_llama_picture(
     llama_id: Annotated[int, Path(description="The ID of the llama that this picture is for", examples=["1", "2"])],
     request: Request,
     _: Annotated[User, Depends(get_current_user_from_api_token)],
+    idempotent_request: Annotated[IdempotentRequest, Depends(get_idempotent_request)],
     db: Session = Depends(get_db),
 ) -> LlamaId:
     """
     Create a picture for a llama. The picture is sent as a PNG as binary data in the body of the request.
+
+    Send an Idempotency-Key header to make this safe to retry. Retries with the same key get the response to the
+    first request, without the picture being processed again.
     """
     body = await request.body()
 
@@ -60,29 +76,33 @@ async def create_llama_picture(
     if not body or len(body) == 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No llama picture sent")
 
-    # Check the llama is valid
-    db_llama = llama_crud.get_llama_by_id(db, llama_id)
-    if db_llama is None:
+    # Check the llama is valid, and get the location of any existing picture
+    llama_exists, image_file_location = llama_picture_crud.get_llama_and_picture_location(db, llama_id)
+    if not llama_exists:
         # If the llama does not exist, return a 404
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="LLama not found")
 
     # Check if the llama already has a picture
-    db_picture = llama_picture_crud.get_llama_picture_by_id(db, llama_id)
-    if db_picture is not None:
+    if image_file_location is not None:
         # If the llama already has a picture, return a 409
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Llama already has a picture")
 
     # Write the bytes to a file
     try:
-        file_path = write_llama_picture_to_file(llama_id, body)
+        file_path, metadata = write_llama_picture_to_file(llama_id, body)
     except Exception:  # pylint: disable=broad-except
         # pylint: disable=raise-missing-from
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body is not a valid image")
 
-    # Write the file path to the database
-    llama_picture_crud.create_or_update_llama_picture(db, llama_id, file_path)
+    # Write the file path and the details of the picture to the database
+    llama_picture_crud.create_or_update_llama_picture(db, llama_id, file_path, metadata)
 
-    return LlamaId(llama_id=llama_id)
+    # Remove any resized or cached pictures left over from a previous picture for this llama ID
+    delete_llama_picture_variants(llama_id)
+    delete_cached_llama_pictures(llama_id)
+
+    # Save the response for retries
+    return idempotent_request.save(status.HTTP_201_CREATED, LlamaId(llama_id=llama_id))
 
 
 @router.put(
@@ -126,23 +146,26 @@ async def update_llama_picture(
     if not body or len(body) == 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No llama picture sent")
 
-    # Check the llama is valid
-    db_llama = llama_crud.get_llama_by_id(db, llama_id)
-    if db_llama is None:
+    # Check the llama is valid, and get the location of any existing picture
+    llama_exists, image_file_location = llama_picture_crud.get_llama_and_picture_location(db, llama_id)
+    if not llama_exists:
         # If the llama does not exist, return a 404
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Llama not found")
 
     # Check if the llama already has a picture. If it does, delete it
-    db_picture = llama_picture_crud.get_llama_picture_by_id(db, llama_id)
-    if db_picture is not None:
+    if image_file_location is not None:
         # If the llama already has a picture, delete it
-        delete_llama_picture_file(db_picture.image_file_location)
+        delete_llama_picture_file(image_file_location)
 
     # Write the bytes to a file
-    file_path = write_llama_picture_to_file(llama_id, body)
+    file_path, metadata = write_llama_picture_to_file(llama_id, body)
+
+    # Write the file path and the details of the picture to the database
+    llama_picture_crud.create_or_update_llama_picture(db, llama_id, file_path, metadata)
 
-    # Write the file path to the database
-    llama_picture_crud.create_or_update_llama_picture(db, llama_id, file_path)
+    # Remove the resized and cached versions of the old picture
+    delete_llama_picture_variants(llama_id)
+    delete_cached_llama_pictures(llama_id)
 
     return LlamaId(llama_id=llama_id)
 
@@ -168,20 +191,21 @@ def delete_llama_picture(
     """
     Delete a llama's picture by ID.
     """
-    # Check the llama is valid
-    db_llama = llama_crud.get_llama_by_id(db, llama_id)
-    if db_llama is None:
+    # Check the llama is valid, and get the location of its picture
+    llama_exists, image_file_location = llama_picture_crud.get_llama_and_picture_location(db, llama_id)
+    if not llama_exists:
         # If the llama does not exist, return a 404
         raise HTTPException(status_code=404, detail="Llama not found")
 
     # Check the picture is valid
-    db_picture = llama_picture_crud.get_llama_picture_by_id(db, llama_id)
-    if db_picture is None:
+    if image_file_location is None:
         # If the picture does not exist, return a 404
         raise HTTPException(status_code=404, detail="Picture not found")
 
-    # Delete the picture
-    delete_llama_picture_file(db_picture.image_file_location)
+    # Delete the picture and its resized and cached versions
+    delete_llama_picture_file(image_file_location)
+    delete_llama_picture_variants(llama_id)
+    delete_cached_llama_pictures(llama_id)
 
     # Remove the picture from the database
     llama_picture_crud.delete_llama_picture(db, llama_id)
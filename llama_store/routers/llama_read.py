@@ -4,16 +4,18 @@ The endpoints for reading llamas.
 
 # pylint: disable=invalid-name
 
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Path, status
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response, status
 from sqlalchemy.orm import Session
 
-from data import llama_crud
+from data import llama_crud, llama_picture_crud
 from data.database import get_db
+from data.picture_signing import create_signed_picture_url
 from data.user_crud import get_current_user_from_api_token
+from http_caching import make_version_etag
 
-from models.llama import Llama
+from models.llama import Llama, LlamaColor, LlamaQuery, LlamaSort, LlamaStats
 from models.user import User
 
 router = APIRouter(
@@ -21,37 +23,166 @@ router = APIRouter(
     tags=["Llama"],
 )
 
+# The query parameter to ask for signed picture URLs with the llamas
+IncludePictureUrls = Annotated[
+    bool,
+    Query(
+        description="Set this to true to include a signed, time limited URL for each llama's picture. "
+        "These URLs can be used to get the picture without an API token."
+    ),
+]
+
+# The headers sent with a single llama
+LLAMA_HEADERS = {
+    "ETag": {
+        "description": "The version of the llama. Send this in the If-Match header when updating the llama, so the "
+        "update fails if the llama has changed since.",
+        "schema": {"type": "string"},
+    }
+}
+
+
+# pylint: disable-next=too-many-arguments
+def get_llama_query(
+    color: Annotated[Optional[LlamaColor], Query(description="Only list llamas of this color.")] = None,
+    min_age: Annotated[Optional[int], Query(description="Only list llamas at least this old.")] = None,
+    max_age: Annotated[Optional[int], Query(description="Only list llamas at most this old.")] = None,
+    min_rating: Annotated[Optional[int], Query(description="Only list llamas rated at least this.", ge=1, le=5)] = None,
+    max_rating: Annotated[Optional[int], Query(description="Only list llamas rated at most this.", ge=1, le=5)] = None,
+    sort: Annotated[
+        LlamaSort,
+        Query(
+            description="The field to sort the llamas by. Start with a - to sort in descending order. "
+            "Llamas that sort the same are listed in ID order."
+        ),
+    ] = LlamaSort.LLAMA_ID,
+    offset: Annotated[int, Query(description="The number of matching llamas to skip.", ge=0)] = 0,
+    limit: Annotated[
+        Optional[int],
+        Query(description="The most llamas to return. By default, all matching llamas are returned.", ge=1),
+    ] = None,
+) -> LlamaQuery:
+    """
+    Gets the filter, sort order and page of llamas to list from the query parameters.
+
+    :return: The llama query.
+    :rtype: LlamaQuery
+    """
+    return LlamaQuery(
+        color=color,
+        min_age=min_age,
+        max_age=max_age,
+        min_rating=min_rating,
+        max_rating=max_rating,
+        sort=sort,
+        offset=offset,
+        limit=limit,
+    )
+
+
+def add_picture_urls(request: Request, db: Session, llamas: List[Llama]) -> List[Llama]:
+    """
+    Adds signed picture URLs to llamas that have a picture. The llamas may be shared with other requests, so
+    llamas with a picture are copied rather than changed.
+
+    :param Request request: The current request.
+    :param Session db: The database session.
+    :param List[Llama] llamas: The llamas.
+    :return: The llamas, with picture URLs set.
+    :rtype: List[Llama]
+    """
+    with_pictures = llama_picture_crud.get_llama_ids_with_pictures(db, [llama.llama_id for llama in llamas])
+    return [
+        (
+            llama.model_copy(update={"picture_url": create_signed_picture_url(request, llama.llama_id)})
+            if llama.llama_id in with_pictures
+            else llama
+        )
+        for llama in llamas
+    ]
+
 
 @router.get(
     path="",
     operation_id="GetLlamas",
     response_model=List[Llama],
+    response_model_exclude_none=True,
     status_code=status.HTTP_200_OK,
     responses={
-        status.HTTP_200_OK: {"model": List[Llama], "description": "Llamas"},
+        status.HTTP_200_OK: {
+            "model": List[Llama],
+            "description": "Llamas",
+            "headers": {
+                "X-Total-Count": {
+                    "description": "The number of llamas that match the filter, across all pages.",
+                    "schema": {"type": "integer"},
+                }
+            },
+        },
         status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
         status.HTTP_403_FORBIDDEN: {
             "description": "Not authenticated. Send a valid API token in the Authorization header."
         },
     },
 )
+# pylint: disable-next=too-many-arguments
 def get_llamas(
-    _: Annotated[User, Depends(get_current_user_from_api_token)], db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    query: Annotated[LlamaQuery, Depends(get_llama_query)],
+    db: Session = Depends(get_db),
+    include_picture_urls: IncludePictureUrls = False,
 ) -> List[Llama]:
     """
-    Get all the llamas.
+    Get all the llamas, optionally filtered by color, age and rating, sorted, and a page at a time.
+    """
+    # Get the page of llamas from the database
+    total, llamas = llama_crud.get_llamas(db, query)
+    response.headers["X-Total-Count"] = str(total)
+
+    # Add the picture URLs if they were asked for
+    if include_picture_urls:
+        llamas = add_picture_urls(request, db, llamas)
+
+    return llamas
+
+
+@router.get(
+    path="/stats",
+    operation_id="GetLlamaStats",
+    response_model=LlamaStats,
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"model": LlamaStats, "description": "Llama statistics"},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
+        status.HTTP_403_FORBIDDEN: {
+            "description": "Not authenticated. Send a valid API token in the Authorization header."
+        },
+    },
+)
+def get_llama_stats(
+    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    db: Session = Depends(get_db),
+) -> LlamaStats:
+    """
+    Get statistics about all the llamas, including the number of each color, the number with each rating, and
+    age percentiles. These are kept up to date as llamas are written, so this is quick however many llamas there
+    are.
     """
-    # Get all the llamas from the database
-    return llama_crud.get_all_llamas(db)
+    # Get the statistics from the database. This is declared before the get llama by ID endpoint, so the path
+    # isn't read as a llama ID.
+    return llama_crud.get_llama_stats(db)
 
 
 @router.get(
     path="/{llama_id}",
     operation_id="GetLlamaByID",
     response_model=Llama,
+    response_model_exclude_none=True,
     status_code=status.HTTP_200_OK,
     responses={
-        status.HTTP_200_OK: {"model": List[Llama], "description": "Llamas"},
+        status.HTTP_200_OK: {"model": List[Llama], "description": "Llamas", "headers": LLAMA_HEADERS},
         status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
         status.HTTP_403_FORBIDDEN: {
             "description": "Not authenticated. Send a valid API token in the Authorization header."
@@ -59,18 +190,28 @@ def get_llamas(
         status.HTTP_404_NOT_FOUND: {"description": "Llama not found"},
     },
 )
+# pylint: disable-next=too-many-arguments
 def get_llama(
     llama_id: Annotated[int, Path(description="The llama's ID", examples=["1", "2"])],
+    request: Request,
+    response: Response,
     _: Annotated[User, Depends(get_current_user_from_api_token)],
     db: Session = Depends(get_db),
+    include_picture_urls: IncludePictureUrls = False,
 ) -> Llama:
     """
-    Get a llama by ID.
+    Get a llama by ID. The llama's version is sent in the ETag header.
     """
     # Get the llama from the database by ID
     llama = llama_crud.get_llama_by_id(db, llama_id)
     if llama is None:
         # If the llama does not exist, return a 404
         raise HTTPException(status_code=404, detail="Llama not found")
+    response.headers["ETag"] = make_version_etag(llama.version)
+
+    # Add the picture URL if it was asked for
+    if include_picture_urls:
+        llama = add_picture_urls(request, db, [llama])[0]
+
     # Return the llama
     return llama
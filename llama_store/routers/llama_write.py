@@ -4,21 +4,40 @@ The endpoints for creating, updating and deleting llamas.
 
 # pylint: disable=invalid-name
 
-from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, Path, status
+from typing import Annotated, Optional, Union
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, Header, HTTPException, Path, Response, status
 from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from change_stream import notify_change_stream
 from data import llama_crud
 from data.database import get_db
+from data.files import delete_llama_picture_file
+from data.idempotency import IdempotentRequest, get_idempotent_request
+from data.picture_memory_cache import delete_cached_llama_pictures
+from data.picture_variants import delete_llama_picture_variants
 from data.user_crud import get_current_user_from_api_token
+from http_caching import make_version_etag, parse_version_etags
 
-from models.llama import Llama, LlamaCreate
+from models.llama import Llama, LlamaCreate, LlamaPatch
 from models.user import User
+from routers.llama_read import LLAMA_HEADERS
+
+# The header to make an update conditional on the llama's version
+IfMatch = Annotated[
+    Optional[str],
+    Header(
+        description="The ETag of the version of the llama being updated. If the llama has changed since, nothing is "
+        "updated and a 412 is returned. Use * to only update the llama if it exists."
+    ),
+]
 
 router = APIRouter(
     prefix="/llama",
     tags=["Llama"],
+    # Wake the change stream after each write, so clients get the change straight away
+    dependencies=[Depends(notify_change_stream)],
 )
 
 
@@ -26,6 +45,7 @@ router = APIRouter(
     path="",
     operation_id="CreateLlama",
     response_model=Llama,
+    response_model_exclude_none=True,
     status_code=status.HTTP_201_CREATED,
     responses={
         status.HTTP_201_CREATED: {"model": Llama, "description": "Llama created successfully"},
@@ -33,16 +53,25 @@ router = APIRouter(
         status.HTTP_403_FORBIDDEN: {
             "description": "Not authenticated. Send a valid API token in the Authorization header."
         },
-        status.HTTP_409_CONFLICT: {"description": "Llama already exists"},
+        status.HTTP_409_CONFLICT: {
+            "description": "Llama already exists, or a request with this idempotency key is still being handled"
+        },
+        status.HTTP_422_UNPROCESSABLE_ENTITY: {
+            "description": "Validation error, or this idempotency key was already used for a different request"
+        },
     },
 )
 def create_llama(
     llama: LlamaCreate,
     _: Annotated[User, Depends(get_current_user_from_api_token)],
+    idempotent_request: Annotated[IdempotentRequest, Depends(get_idempotent_request)],
     db: Session = Depends(get_db),
 ) -> Llama:
     """
     Create a new llama. Llama names must be unique.
+
+    Send an Idempotency-Key header to make this safe to retry. Retries with the same key get the llama created by
+    the first request, rather than a 409.
     """
     # Check if the llama already exists
     existing_llama = llama_crud.get_llama_by_name(db, llama_name=llama.name)
@@ -50,42 +79,66 @@ def create_llama(
         # If the llama already exists, return a 409
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Llama named {llama.name} already exists")
 
-    # Create the llama and return it
-    return llama_crud.create_llama(db, llama)
+    # Create the llama, and save it as the response for retries
+    return idempotent_request.save(status.HTTP_201_CREATED, llama_crud.create_llama(db, llama))
 
 
 @router.put(
     path="/{llama_id}",
     operation_id="UpdateLlama",
     response_model=Llama,
+    response_model_exclude_none=True,
     status_code=status.HTTP_200_OK,
     responses={
-        status.HTTP_201_CREATED: {"model": Llama, "description": "New llama created successfully"},
+        status.HTTP_200_OK: {"model": Llama, "description": "Llama updated successfully", "headers": LLAMA_HEADERS},
+        status.HTTP_201_CREATED: {
+            "model": Llama,
+            "description": "New llama created successfully",
+            "headers": LLAMA_HEADERS,
+        },
         status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
         status.HTTP_403_FORBIDDEN: {
             "description": "Not authenticated. Send a valid API token in the Authorization header."
         },
         status.HTTP_409_CONFLICT: {"description": "The llama name is already in use"},
+        status.HTTP_412_PRECONDITION_FAILED: {
+            "description": "The llama has changed since the version in the If-Match header, or doesn't exist"
+        },
     },
 )
+# pylint: disable-next=too-many-arguments
 def update_llama(
     llama_id: Annotated[int, Path(description="The llama's ID", examples=["1", "2"])],
     llama: LlamaCreate,
+    response: Response,
     _: Annotated[User, Depends(get_current_user_from_api_token)],
+    if_match: IfMatch = None,
     db: Session = Depends(get_db),
 ) -> Llama:
     """
     Update a llama. If the llama does not exist, create it.
 
     When updating a llama, the llama name must be unique. If the llama name is not unique, a 409 will be returned.
+
+    The llama's version is sent in the ETag header. Send it back in the If-Match header to only update the llama
+    if nobody else has updated it since.
     """
     # Get the existing llama by name and Id
     existing_llama_by_id = llama_crud.get_llama_by_id(db, llama_id)
     existing_llama_by_name = llama_crud.get_llama_by_name(db, llama.name)
 
+    # A conditional update needs the llama to exist, so it is never created
+    if if_match is not None and existing_llama_by_id is None:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="Llama not found")
+
     # If neither exist, create a new llama and return it with a 201
     if existing_llama_by_id is None and existing_llama_by_name is None:
-        return JSONResponse(status_code=201, content=llama_crud.create_llama(db, llama).model_dump())
+        created_llama = llama_crud.create_llama(db, llama)
+        return JSONResponse(
+            status_code=201,
+            content=created_llama.model_dump(exclude_none=True),
+            headers={"ETag": make_version_etag(created_llama.version)},
+        )
 
     # If the llama doesn't exist by Id, and a different llama has the same name, return a 409
     if existing_llama_by_id is None and existing_llama_by_name is not None:
@@ -99,7 +152,93 @@ def update_llama(
     ):
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Llama named {llama.name} already exists")
 
-    return llama_crud.update_llama(db, llama, llama_id)
+    # Update the llama, and return it
+    return write_llama_update(db, llama, llama_id, if_match, response)
+
+
+@router.patch(
+    path="/{llama_id}",
+    operation_id="PatchLlama",
+    response_model=Llama,
+    response_model_exclude_none=True,
+    status_code=status.HTTP_200_OK,
+    responses={
+        status.HTTP_200_OK: {"model": Llama, "description": "Llama updated successfully", "headers": LLAMA_HEADERS},
+        status.HTTP_401_UNAUTHORIZED: {"description": "Invalid API token"},
+        status.HTTP_403_FORBIDDEN: {
+            "description": "Not authenticated. Send a valid API token in the Authorization header."
+        },
+        status.HTTP_404_NOT_FOUND: {"description": "Llama not found"},
+        status.HTTP_409_CONFLICT: {"description": "The llama name is already in use"},
+        status.HTTP_412_PRECONDITION_FAILED: {
+            "description": "The llama has changed since the version in the If-Match header, or doesn't exist"
+        },
+    },
+)
+# pylint: disable-next=too-many-arguments
+def patch_llama(
+    llama_id: Annotated[int, Path(description="The llama's ID", examples=["1", "2"])],
+    llama: Annotated[LlamaPatch, Body(media_type="application/merge-patch+json")],
+    response: Response,
+    _: Annotated[User, Depends(get_current_user_from_api_token)],
+    if_match: IfMatch = None,
+    db: Session = Depends(get_db),
+) -> Llama:
+    """
+    Update some of a llama's details, using a JSON merge patch. Only the fields in the patch are changed, so to
+    change a llama's rating, send just the rating. If the llama does not exist, a 404 will be returned.
+
+    If the name is changed, the new name must be unique. If the llama name is not unique, a 409 will be returned.
+
+    The llama's version is sent in the ETag header. Send it back in the If-Match header to only update the llama
+    if nobody else has updated it since.
+    """
+    # Only check the name if it is being changed
+    if llama.name is not None:
+        existing_llama_by_name = llama_crud.get_llama_by_name(db, llama.name)
+        if existing_llama_by_name is not None and existing_llama_by_name.llama_id != llama_id:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Llama named {llama.name} already exists")
+
+    # Update the llama, and return it
+    return write_llama_update(db, llama, llama_id, if_match, response)
+
+
+def write_llama_update(
+    db: Session, llama: Union[LlamaCreate, LlamaPatch], llama_id: int, if_match: Optional[str], response: Response
+) -> Llama:
+    """
+    Writes an update to a llama, if it is still at the version in the If-Match header, and sets the ETag of the
+    response to the llama's new version.
+
+    :param Session db: The database session.
+    :param Union[LlamaCreate, LlamaPatch] llama: The llama, or the changes to make to it.
+    :param int llama_id: The ID of the llama to update.
+    :param Optional[str] if_match: The If-Match header, if it was sent.
+    :param Response response: The response.
+    :return: The updated llama.
+    :rtype: Llama
+    """
+    versions = None if if_match is None else parse_version_etags(if_match)
+    try:
+        updated_llama = llama_crud.update_llama(db, llama, llama_id, versions)
+    except IntegrityError as exc:
+        # Another llama was given the name after it was checked
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"Llama named {llama.name} already exists"
+        ) from exc
+
+    if updated_llama is None and if_match is not None:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The llama has been changed since the version in the If-Match header",
+        )
+    if updated_llama is None:
+        # The llama doesn't exist, or was deleted after it was checked
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Llama not found")
+
+    response.headers["ETag"] = make_version_etag(updated_llama.version)
+    return updated_llama
 
 
 @router.delete(
@@ -118,10 +257,11 @@ def update_llama(
 def delete_llama(
     llama_id: Annotated[int, Path(description="The llama's ID", examples=["1", "2"])],
     _: Annotated[User, Depends(get_current_user_from_api_token)],
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ) -> None:
     """
-    Delete a llama. If the llama does not exist, this will return a 404.
+    Delete a llama. If the llama does not exist, this will return a 404. The llama's picture is deleted as well.
     """
     # Get the llama by Id
     db_llama = llama_crud.get_llama_by_id(db, llama_id)
@@ -130,5 +270,11 @@ def delete_llama(
     if db_llama is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Llama not found")
 
-    # Delete the llama and return a 204
-    llama_crud.delete_llama(db, llama_id)
+    # Delete the llama and its picture
+    image_file_location = llama_crud.delete_llama(db, llama_id)
+
+    # Stop serving the old picture straight away, then delete the files once the response has been sent
+    delete_cached_llama_pictures(llama_id)
+    background_tasks.add_task(delete_llama_picture_variants, llama_id)
+    if image_file_location is not None:
+        background_tasks.add_task(delete_llama_picture_file, image_file_location)
@@ -0,0 +1,137 @@
+"""
+Runs the API in production, with one worker process for each CPU core.
+
+This uses gunicorn to manage uvicorn worker processes. Before any workers start, the database migrations are run
+once, and the app is loaded in the main process. Workers are forked from the main process, so they share the
+memory of the loaded app rather than each loading their own copy.
+
+Run this from the llama_store folder. The server is configured with environment variables - see the README for
+the full list.
+"""
+
+import os
+
+from alembic import command
+from alembic.config import Config
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+# The address to listen on
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", "8080"))
+
+# The number of worker processes. This defaults to one for each CPU core.
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", str(os.cpu_count() or 1)))
+
+# The event loop and HTTP parser used by each worker. auto uses uvloop and httptools if they are installed.
+SERVER_LOOP = os.environ.get("SERVER_LOOP", "auto")
+SERVER_HTTP = os.environ.get("SERVER_HTTP", "auto")
+
+# How long to keep idle connections open, in seconds
+SERVER_KEEP_ALIVE_SECONDS = int(os.environ.get("SERVER_KEEP_ALIVE_SECONDS", "5"))
+
+# The maximum number of connections waiting to be accepted
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", "2048"))
+
+# The maximum number of connections and tasks each worker handles at once. Beyond this, requests get a 503.
+SERVER_LIMIT_CONCURRENCY = (
+    int(os.environ["SERVER_LIMIT_CONCURRENCY"]) if "SERVER_LIMIT_CONCURRENCY" in os.environ else None
+)
+
+# Set to false to skip running the database migrations on startup
+SERVER_RUN_MIGRATIONS = os.environ.get("SERVER_RUN_MIGRATIONS", "true").lower() == "true"
+
+
+class LlamaStoreUvicornWorker(UvicornWorker):
+    """
+    A uvicorn worker with the event loop, HTTP parser, keep alive and concurrency settings from the environment.
+    """
+
+    CONFIG_KWARGS = {
+        "loop": SERVER_LOOP,
+        "http": SERVER_HTTP,
+        "timeout_keep_alive": SERVER_KEEP_ALIVE_SECONDS,
+        "limit_concurrency": SERVER_LIMIT_CONCURRENCY,
+    }
+
+
+def run_migrations() -> None:
+    """
+    Upgrades the database to the latest migration.
+    """
+    command.upgrade(Config("alembic.ini"), "head")
+
+
+def pre_fork(server, worker) -> None:
+    """
+    Runs in the main process before each worker is forked. Only one worker runs the background picture garbage
+    collection, so the first worker is picked to run it, along with any worker that replaces it.
+    """
+    worker.run_picture_gc = not any(
+        getattr(running_worker, "run_picture_gc", False) for running_worker in server.WORKERS.values()
+    )
+
+
+def post_fork(_, worker) -> None:
+    """
+    Runs in each worker after it is forked. Database connections can't be shared between processes, so the
+    worker drops the connections it got from the main process, without closing them, and opens its own.
+    Background picture garbage collection is turned off unless this worker was picked to run it.
+    """
+    # pylint: disable=import-outside-toplevel
+    from data import picture_gc
+    from data.database import engine
+
+    engine.dispose(close=False)
+    picture_gc.run_in_this_process = getattr(worker, "run_picture_gc", False)
+
+
+class LlamaStoreApplication(BaseApplication):  # pylint: disable=abstract-method
+    """
+    A gunicorn application that runs the llama store API.
+    """
+
+    def load_config(self) -> None:
+        """
+        Sets the gunicorn settings.
+        """
+        settings = {
+            "bind": f"{SERVER_HOST}:{SERVER_PORT}",
+            "workers": SERVER_WORKERS,
+            "worker_class": f"{__name__}.LlamaStoreUvicornWorker",
+            "keepalive": SERVER_KEEP_ALIVE_SECONDS,
+            "backlog": SERVER_BACKLOG,
+            "preload_app": True,
+            "pre_fork": pre_fork,
+            "post_fork": post_fork,
+        }
+        for key, value in settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        """
+        Loads the app in the main process, before the workers are forked.
+
+        :return: The app.
+        :rtype: FastAPI
+        """
+        import main  # pylint: disable=import-outside-toplevel
+
+        # Render the OpenAPI documents now, so every worker shares one copy
+        main.openapi_documents.render()
+        return main.app
+
+
+def run_server() -> None:
+    """
+    Runs the database migrations, then starts gunicorn, which forks the workers.
+    """
+    if SERVER_RUN_MIGRATIONS:
+        # Run the migrations once, before gunicorn starts, so workers never race to upgrade the database
+        run_migrations()
+
+    LlamaStoreApplication().run()
+
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,40 @@
+"""
+Helpers shared by the llama endpoint tests.
+
+These assume that the write setup tests have been run, so that there is a test client and API token.
+"""
+
+from typing import Dict, Optional
+
+import pytest
+
+
+def get_headers(if_match: Optional[str] = None, content_type: Optional[str] = None) -> Dict[str, str]:
+    """
+    Gets the headers for a request, with the API token and any If-Match and Content-Type headers.
+
+    :param Optional[str] if_match: The If-Match header, if the request is conditional.
+    :param Optional[str] content_type: The Content-Type header, if the body isn't plain JSON.
+    :return: The headers.
+    :rtype: Dict[str, str]
+    """
+    headers = {"Authorization": f"Bearer {pytest.api_token}"}
+    if if_match is not None:
+        headers["If-Match"] = if_match
+    if content_type is not None:
+        headers["Content-Type"] = content_type
+    return headers
+
+
+def create_llama(name: str) -> Dict:
+    """
+    Creates a brown llama, aged 3 and rated 3, and returns it.
+
+    :param str name: The name of the llama.
+    :return: The llama, as returned by the API.
+    :rtype: Dict
+    """
+    llama = {"name": name, "age": 3, "color": "brown", "rating": 3}
+    response = pytest.client.post("/llama", json=llama, headers=get_headers())
+    assert response.status_code == 201
+    return response.json()
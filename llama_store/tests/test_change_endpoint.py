@@ -0,0 +1,107 @@
+"""
+Integration tests for the change feed endpoint.
+
+These tests assume that the write setup tests have been run, so that there is a test client and API token.
+"""
+
+from typing import Dict, List, Tuple
+
+import pytest
+
+
+def get_changes(since: int, limit: int = 1000) -> Dict:
+    """
+    Gets a page of changes from the API.
+    """
+    response = pytest.client.get(
+        f"/changes?since={since}&limit={limit}", headers={"Authorization": f"Bearer {pytest.api_token}"}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def get_all_changes(since: int = 0) -> Tuple[List[Dict], int]:
+    """
+    Gets all the changes after a sequence number, a page at a time, along with the sequence number to carry on from.
+    """
+    changes = []
+    while True:
+        feed = get_changes(since)
+        changes += feed["changes"]
+        since = feed["nextSince"]
+        if not feed["hasMore"]:
+            return changes, since
+
+
+class TestChangeEndpoint:
+    """
+    Test the change feed endpoint. Tests in this fixture start at 401.
+    """
+
+    @pytest.mark.order(401)
+    def test_get_changes_without_an_api_token_gives_an_error(self):
+        """
+        Test that we get an error if we try to get the changes without an API token
+        """
+        assert pytest.client.get("/changes").status_code == 403
+
+    @pytest.mark.order(401)
+    def test_replaying_the_changes_gives_the_llamas(self):
+        """
+        Test that applying every change from the start gives the same llamas as getting them all
+        """
+        llamas = {}
+        for change in get_all_changes()[0]:
+            if change["entity"] == "llama" and change["operation"] == "deleted":
+                llamas.pop(change["llamaId"])
+            elif change["entity"] == "llama":
+                llamas[change["llamaId"]] = {"llamaId": change["llamaId"], **change["llama"]}
+
+        response = pytest.client.get("/llama", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        assert sorted(llamas.values(), key=lambda llama: llama["llamaId"]) == response.json()
+
+    @pytest.mark.order(401)
+    def test_get_changes_returns_the_writes_since_the_last_change(self):
+        """
+        Test that each write to a llama and its picture is returned in order, with nothing else
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+        since = get_all_changes()[1]
+        assert get_changes(since) == {"changes": [], "nextSince": since, "hasMore": False}
+
+        llama = {"name": "Change Llama", "age": 3, "color": "brown", "rating": 4}
+        llama_id = pytest.client.post("/llama", json=llama, headers=headers).json()["llamaId"]
+        with open("./tests/test_images/test_llama_1.png", "rb") as file:
+            response = pytest.client.post(f"/llama/{llama_id}/picture", content=file.read(), headers=headers)
+        assert response.status_code == 201
+        updated = {**llama, "age": 4}
+        assert pytest.client.put(f"/llama/{llama_id}", json=updated, headers=headers).status_code == 200
+        assert pytest.client.delete(f"/llama/{llama_id}", headers=headers).status_code == 204
+
+        changes, next_since = get_all_changes(since)
+        assert [(change["entity"], change["operation"], change["llamaId"]) for change in changes] == [
+            ("llama", "created", llama_id),
+            ("picture", "created", llama_id),
+            ("llama", "updated", llama_id),
+            ("picture", "deleted", llama_id),
+            ("llama", "deleted", llama_id),
+        ]
+        assert [change["seq"] for change in changes] == sorted(change["seq"] for change in changes)
+        assert changes[0]["llama"] == llama
+        assert changes[2]["llama"] == updated
+        assert "llama" not in changes[4]
+        assert next_since == changes[-1]["seq"]
+
+    @pytest.mark.order(401)
+    def test_get_changes_a_page_at_a_time(self):
+        """
+        Test that changes can be read a page at a time using the resume token
+        """
+        first_page = get_changes(0, limit=2)
+        assert len(first_page["changes"]) == 2
+        assert first_page["hasMore"]
+        assert first_page["nextSince"] == first_page["changes"][1]["seq"]
+
+        second_page = get_changes(first_page["nextSince"], limit=2)
+        assert second_page["changes"][0]["seq"] > first_page["nextSince"]
+        assert get_changes(0, limit=4)["changes"] == first_page["changes"] + second_page["changes"]
@@ -0,0 +1,143 @@
+"""
+Tests for the change stream.
+
+The broadcaster tests use changes of their own. The endpoint tests assume that the write setup tests have been run,
+so that there is a test client and API token.
+"""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from change_stream import ChangeBroadcaster, ChangeStreamResponse, format_change_event, stream_changes
+from models.change import Change
+
+
+def create_changes(*seqs: int) -> List[Change]:
+    """
+    Creates llama deleted changes with the given sequence numbers.
+    """
+    return [
+        Change(seq=seq, entity="llama", operation="deleted", llama_id=seq, changed_at="2026-10-19T00:00:00.000Z")
+        for seq in seqs
+    ]
+
+
+class TestChangeStream:
+    """
+    Test the change stream. Tests in this fixture start at 401.
+    """
+
+    def test_changes_are_published_to_every_subscriber(self):
+        """
+        Test that each subscriber gets every change after it subscribed
+        """
+
+        async def publish() -> None:
+            broadcaster = ChangeBroadcaster(queue_size=10)
+            broadcaster.last_seq = 1
+            first = broadcaster.subscribe()
+            broadcaster.publish(create_changes(2))
+            second = broadcaster.subscribe()
+            broadcaster.publish(create_changes(3))
+
+            assert (first.start_seq, second.start_seq) == (1, 2)
+            assert [first.queue.get_nowait().seq for _ in range(2)] == [2, 3]
+            assert second.queue.get_nowait().seq == 3
+            assert broadcaster.last_seq == 3
+
+        asyncio.run(publish())
+
+    def test_slow_subscribers_are_disconnected(self):
+        """
+        Test that a subscriber whose queue is full is disconnected, without holding up the others
+        """
+
+        async def publish() -> None:
+            broadcaster = ChangeBroadcaster(queue_size=2)
+            slow = broadcaster.subscribe()
+            fast = broadcaster.subscribe()
+            for change in create_changes(1, 2, 3):
+                broadcaster.publish([change])
+                fast.queue.get_nowait()
+
+            assert slow.overflowed.is_set()
+            assert not fast.overflowed.is_set()
+            assert broadcaster.subscribers == {fast}
+
+        asyncio.run(publish())
+
+    def test_the_response_is_closed_when_a_stuck_client_overflows(self):
+        """
+        Test that the connection is closed even if the client has stopped reading
+        """
+
+        async def stream() -> None:
+            broadcaster = ChangeBroadcaster(queue_size=1)
+            subscriber = broadcaster.subscribe()
+            subscriber.start_seq = 0
+            messages = []
+
+            async def send(message) -> None:
+                messages.append(message)
+                if message["type"] == "http.response.body":
+                    # The client never reads, so this send never finishes
+                    await asyncio.Event().wait()
+
+            async def receive():
+                await asyncio.Event().wait()
+
+            response = ChangeStreamResponse(broadcaster, subscriber, stream_changes(subscriber, None))
+            task = asyncio.create_task(response({"type": "http"}, receive, send))
+            await asyncio.sleep(0.1)
+            broadcaster.publish(create_changes(1, 2))
+            await asyncio.wait_for(task, 1)
+
+            assert messages[0]["headers"] and messages[-1]["more_body"]
+            assert not broadcaster.subscribers
+
+        asyncio.run(stream())
+
+    @pytest.mark.order(401)
+    def test_get_change_stream_without_an_api_token_gives_an_error(self):
+        """
+        Test that we get an error if we try to stream the changes without an API token
+        """
+        assert pytest.client.get("/changes/stream").status_code == 403
+
+    @pytest.mark.order(401)
+    def test_a_resumed_stream_sends_the_missed_changes_then_the_new_ones(self):
+        """
+        Test that a client resuming from an event ID gets the changes it missed from the change log, then the
+        changes from the broadcaster, without any being sent twice
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+        for name in ["Stream Llama 1", "Stream Llama 2"]:
+            llama = {"name": name, "age": 3, "color": "white", "rating": 5}
+            assert pytest.client.post("/llama", json=llama, headers=headers).status_code == 201
+        changes = pytest.client.get("/changes?since=0&limit=1000", headers=headers).json()["changes"]
+        latest_seq = changes[-1]["seq"]
+
+        async def stream() -> List[str]:
+            broadcaster = ChangeBroadcaster()
+            broadcaster.last_seq = latest_seq
+            subscriber = broadcaster.subscribe()
+            events = stream_changes(subscriber, latest_seq - 2)
+            received = [await anext(events) for _ in range(3)]
+
+            # The broadcaster passes on a change after the subscriber's start, so it is sent
+            broadcaster.publish(create_changes(latest_seq + 1))
+            received.append(await anext(events))
+            await events.aclose()
+            return received
+
+        events = asyncio.run(stream())
+        assert events[0] == "retry: 1000\n\n"
+        assert [event.split("\n")[0] for event in events[1:]] == [
+            f"id: {latest_seq - 1}",
+            f"id: {latest_seq}",
+            f"id: {latest_seq + 1}",
+        ]
+        assert '"name":"Stream Llama 2"' in events[2]
+        assert events[3] == format_change_event(create_changes(latest_seq + 1)[0])
@@ -0,0 +1,155 @@
+"""
+Tests for the response compression middleware.
+
+Most of these tests use a small app of their own, so the size and type of each response is known. The endpoint
+test assumes that the write setup tests have been run, so that there is a test client and API token.
+"""
+
+import gzip
+import threading
+
+import anyio
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response
+from fastapi.testclient import TestClient
+import pytest
+
+import compression
+from compression import CompressionMiddleware
+
+# A body big enough to be compressed
+LARGE_BODY = "llama " * 1000
+
+
+def create_client(**middleware_options) -> TestClient:
+    """
+    Creates a test client for an app with the compression middleware.
+    """
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, **middleware_options)
+
+    @app.get("/large")
+    def large() -> Response:
+        return PlainTextResponse(LARGE_BODY, headers={"ETag": '"large"'})
+
+    @app.get("/small")
+    def small() -> Response:
+        return PlainTextResponse("llama")
+
+    @app.get("/picture")
+    def picture() -> Response:
+        return Response(LARGE_BODY.encode(), media_type="image/png")
+
+    @app.get("/encoded")
+    def encoded() -> Response:
+        return Response(gzip.compress(LARGE_BODY.encode()), headers={"Content-Encoding": "gzip"})
+
+    return TestClient(app)
+
+
+class TestCompression:
+    """
+    Test the response compression middleware.
+    """
+
+    def test_large_responses_are_compressed_with_gzip(self, monkeypatch):
+        """
+        Test that a large response is compressed if the client accepts gzip, and its ETag is made weak
+        """
+        monkeypatch.setattr(compression, "brotli", None)
+        response = create_client().get("/large", headers={"Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert int(response.headers["content-length"]) < len(LARGE_BODY)
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"] == 'W/"large"'
+        assert response.text == LARGE_BODY
+
+    def test_large_responses_are_compressed_with_brotli_when_the_client_accepts_it(self):
+        """
+        Test that Brotli is preferred over gzip for clients that accept both
+        """
+        response = create_client().get("/large", headers={"Accept-Encoding": "gzip, br"})
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "br"
+        assert int(response.headers["content-length"]) < len(LARGE_BODY)
+        assert response.text == LARGE_BODY
+
+    @pytest.mark.parametrize(
+        "path,accept_encoding",
+        [("/large", "identity"), ("/small", "gzip"), ("/picture", "gzip"), ("/encoded", "gzip")],
+    )
+    def test_responses_are_not_compressed_when_they_should_not_be(self, path: str, accept_encoding: str):
+        """
+        Test that responses are not compressed if the client doesn't accept it, or if they are too small, pictures,
+        or already encoded
+        """
+        response = create_client().get(path, headers={"Accept-Encoding": accept_encoding})
+
+        assert response.status_code == 200
+        assert response.headers.get("content-encoding") == ("gzip" if path == "/encoded" else None)
+        assert response.content == (b"llama" if path == "/small" else LARGE_BODY.encode())
+
+        # Responses that could be compressed for another client vary by the Accept-Encoding header
+        assert response.headers.get("vary") == (None if path in ("/picture", "/encoded") else "Accept-Encoding")
+
+    def test_compressed_bodies_are_cached(self, monkeypatch):
+        """
+        Test that the same body is only compressed once
+        """
+        calls = []
+        original_compress = compression.compress
+
+        def counting_compress(body: bytes, coding: str, best: bool = False) -> bytes:
+            calls.append(coding)
+            return original_compress(body, coding, best)
+
+        monkeypatch.setattr(compression, "brotli", None)
+        monkeypatch.setattr(compression, "compress", counting_compress)
+        client = create_client()
+        for _ in range(3):
+            assert client.get("/large", headers={"Accept-Encoding": "gzip"}).text == LARGE_BODY
+        assert calls == ["gzip"]
+
+        # Without the cache, every response is compressed
+        client = create_client(cache_bytes=0)
+        for _ in range(3):
+            client.get("/large", headers={"Accept-Encoding": "gzip"})
+        assert calls == ["gzip"] * 4
+
+    def test_large_bodies_are_compressed_on_a_worker_thread(self, monkeypatch):
+        """
+        Test that bodies at least the thread minimum size are compressed on a worker thread, and smaller ones are
+        compressed on the event loop
+        """
+        threads = []
+        original_compress = compression.compress
+
+        def recording_compress(body: bytes, coding: str, best: bool = False) -> bytes:
+            threads.append(threading.current_thread() is threading.main_thread())
+            return original_compress(body, coding, best)
+
+        monkeypatch.setattr(compression, "brotli", None)
+        monkeypatch.setattr(compression, "compress", recording_compress)
+
+        async def compress_bodies() -> None:
+            middleware = CompressionMiddleware(None, cache_bytes=0, thread_minimum_size=len(LARGE_BODY))
+            assert gzip.decompress(await middleware.compress_body(LARGE_BODY.encode(), "gzip")) == LARGE_BODY.encode()
+            await middleware.compress_body(LARGE_BODY[:-1].encode(), "gzip")
+
+        anyio.run(compress_bodies)
+        assert threads == [False, True]
+
+    @pytest.mark.order(401)
+    def test_get_all_llamas_accepting_gzip_returns_a_compressed_list(self):
+        """
+        Test that the list of llamas is compressed by the API
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}", "Accept-Encoding": "gzip"}
+        response = pytest.client.get("/llama", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json()[0]["llamaId"] == 1
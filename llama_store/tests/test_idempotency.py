@@ -0,0 +1,219 @@
+"""
+Integration tests for idempotency keys on the endpoints that create llamas and pictures.
+
+These tests assume that the write setup tests have been run, so that there is a test client and API token.
+"""
+
+# pylint: disable=invalid-name
+
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy import select, update
+
+from data import idempotency
+from data.database import SessionLocal
+from data.schema import DBIdempotencyKey, DBLlama
+from routers import llama_picture_write
+
+
+def get_headers(idempotency_key: str, api_token: str = None) -> Dict[str, str]:
+    """
+    Gets the headers for a request with an idempotency key.
+    """
+    return {"Authorization": f"Bearer {api_token or pytest.api_token}", "Idempotency-Key": idempotency_key}
+
+
+def count_llamas_named(name: str) -> int:
+    """
+    Counts the llamas in the database with a name.
+    """
+    db = SessionLocal()
+    try:
+        return len(db.scalars(select(DBLlama.llama_id).where(DBLlama.name == name)).all())
+    finally:
+        db.close()
+
+
+class TestIdempotency:
+    """
+    Test idempotency keys. Tests in this fixture start at 401.
+    """
+
+    def test_claiming_a_key_gives_up_after_a_few_attempts(self):
+        """
+        Test that a key that keeps being given up and claimed by other requests gives a 409, rather than the claim
+        trying forever
+        """
+        attempts = []
+
+        class RacingSession:
+            """
+            A database session where the key is always claimed, and then given up before it can be read.
+            """
+
+            def execute(self, *_):
+                """
+                Runs a statement. Every insert conflicts with the key.
+                """
+                attempts.append(None)
+                return SimpleNamespace(rowcount=0)
+
+            def commit(self):
+                """
+                Commits nothing.
+                """
+
+            def get(self, *_, **__):
+                """
+                Gets the key, which has always been given up.
+                """
+                return None
+
+        with pytest.raises(HTTPException) as error:
+            idempotency.claim_idempotency_key(RacingSession(), b"key", b"request")
+        assert error.value.status_code == 409
+
+        # Two deletes of expired keys, then one insert for each attempt
+        assert len(attempts) == 2 + idempotency.IDEMPOTENCY_KEY_CLAIM_ATTEMPTS
+
+    @pytest.mark.order(401)
+    def test_keys_are_claimed_and_given_up_on_a_worker_thread(self, monkeypatch):
+        """
+        Test that the database work for a key is not run on the event loop
+        """
+        threads = []
+        original_claim = idempotency.claim_idempotency_key
+        original_release = idempotency.IdempotentRequest.release
+
+        def recording_claim(*args):
+            threads.append(threading.current_thread().name)
+            return original_claim(*args)
+
+        def recording_release(self):
+            threads.append(threading.current_thread().name)
+            original_release(self)
+
+        monkeypatch.setattr(idempotency, "claim_idempotency_key", recording_claim)
+        monkeypatch.setattr(idempotency.IdempotentRequest, "release", recording_release)
+
+        llama = {"name": "Threaded Idempotent Llama", "age": 3, "color": "brown", "rating": 4}
+        assert pytest.client.post("/llama", json=llama, headers=get_headers("threaded-key")).status_code == 201
+        assert len(threads) == 2
+        assert all(name.startswith("AnyIO worker thread") for name in threads)
+
+    @pytest.mark.order(401)
+    def test_a_retried_llama_gets_the_first_response(self):
+        """
+        Test that retrying a request to create a llama with the same key gets the llama created the first time,
+        rather than a 409, and doesn't create another llama
+        """
+        llama = {"name": "Idempotent Llama", "age": 3, "color": "brown", "rating": 4}
+        first = pytest.client.post("/llama", json=llama, headers=get_headers("create-llama"))
+        assert first.status_code == 201
+        assert "Idempotent-Replayed" not in first.headers
+
+        retry = pytest.client.post("/llama", json=llama, headers=get_headers("create-llama"))
+        assert retry.status_code == 201
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.json() == first.json()
+        assert count_llamas_named("Idempotent Llama") == 1
+
+        # Without the key, the retry is handled again, so it fails as the llama exists
+        assert pytest.client.post("/llama", json=llama, headers=get_headers("another-key")).status_code == 409
+
+    @pytest.mark.order(401)
+    def test_reusing_a_key_for_a_different_request_gives_an_error(self):
+        """
+        Test that a key can't be used for a request with a different body
+        """
+        llama = {"name": "Idempotent Llama 2", "age": 3, "color": "brown", "rating": 4}
+        assert pytest.client.post("/llama", json=llama, headers=get_headers("reused-key")).status_code == 201
+
+        response = pytest.client.post("/llama", json={**llama, "age": 4}, headers=get_headers("reused-key"))
+        assert response.status_code == 422
+        assert response.json() == {"detail": "This idempotency key was already used for a different request"}
+
+    @pytest.mark.order(401)
+    def test_a_failed_request_can_be_retried_with_the_same_key(self):
+        """
+        Test that a key isn't kept for a request that failed
+        """
+        llama = {"name": "Idempotent Llama 3", "age": 3, "color": "brown", "rating": 4}
+        assert pytest.client.post("/llama", json=llama, headers=get_headers("first-key")).status_code == 201
+
+        # The retry is handled again, rather than being told the first request is still being handled
+        duplicate = {**llama, "age": 5}
+        for _ in range(2):
+            response = pytest.client.post("/llama", json=duplicate, headers=get_headers("failing-key"))
+            assert response.status_code == 409
+            assert response.json() == {"detail": "Llama named Idempotent Llama 3 already exists"}
+
+        renamed = {**duplicate, "name": "Idempotent Llama 4"}
+        assert pytest.client.post("/llama", json=renamed, headers=get_headers("renamed-key")).status_code == 201
+
+    @pytest.mark.order(401)
+    def test_keys_belong_to_the_user_that_sent_them(self):
+        """
+        Test that the same key sent by another user is a different key
+        """
+        llama = {"name": "Idempotent Llama 5", "age": 3, "color": "brown", "rating": 4}
+        assert pytest.client.post("/llama", json=llama, headers=get_headers("user-key")).status_code == 201
+
+        user = {"email": "idempotent_user@example.com", "password": "Password123!"}
+        assert pytest.client.post("/user", json=user).status_code == 201
+        api_token = pytest.client.post("/token", json=user).json()["accessToken"]
+
+        response = pytest.client.post("/llama", json=llama, headers=get_headers("user-key", api_token))
+        assert response.status_code == 409
+        assert "Idempotent-Replayed" not in response.headers
+
+    @pytest.mark.order(401)
+    def test_a_retried_picture_is_not_processed_again(self, monkeypatch):
+        """
+        Test that retrying a picture upload with the same key gets the first response without the picture being
+        written again
+        """
+        llama = {"name": "Idempotent Picture Llama", "age": 3, "color": "brown", "rating": 4}
+        llama_id = pytest.client.post("/llama", json=llama, headers=get_headers("picture-llama")).json()["llamaId"]
+        with open("./tests/test_images/test_llama_1.png", "rb") as file:
+            picture = file.read()
+
+        first = pytest.client.post(f"/llama/{llama_id}/picture", content=picture, headers=get_headers("picture"))
+        assert first.status_code == 201
+
+        def fail(*_):
+            raise AssertionError("The picture was written again")
+
+        monkeypatch.setattr(llama_picture_write, "write_llama_picture_to_file", fail)
+        retry = pytest.client.post(f"/llama/{llama_id}/picture", content=picture, headers=get_headers("picture"))
+        assert retry.status_code == 201
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert retry.json() == first.json() == {"llamaId": llama_id}
+
+    @pytest.mark.order(401)
+    def test_expired_keys_are_deleted(self):
+        """
+        Test that an expired key is deleted the next time a key is used, so the request is handled again
+        """
+        llama = {"name": "Expiring Llama", "age": 3, "color": "brown", "rating": 4}
+        assert pytest.client.post("/llama", json=llama, headers=get_headers("expiring-key")).status_code == 201
+
+        db = SessionLocal()
+        try:
+            db.execute(update(DBIdempotencyKey).values(expires_at=int(time.time()) - 1))
+            db.commit()
+            key_count = len(db.scalars(select(DBIdempotencyKey.key_hash)).all())
+            assert key_count > 1
+
+            response = pytest.client.post("/llama", json=llama, headers=get_headers("expiring-key"))
+            assert response.status_code == 409
+            assert len(db.scalars(select(DBIdempotencyKey.key_hash)).all()) == max(
+                key_count - idempotency.IDEMPOTENCY_KEY_PURGE_BATCH_SIZE, 0
+            )
+        finally:
+            db.close()
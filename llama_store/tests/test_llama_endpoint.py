@@ -7,6 +7,8 @@ They also assume that the User integration tests have been run, so that there is
 valid user and API token.
 """
 
+import os
+
 import pytest
 
 from db_migrations.versions.first import ALL_LLAMAS
@@ -306,6 +308,45 @@ class TestLlamaEndpoints:
 
         assert response.status_code == 404
 
+    @pytest.mark.order(101)
+    def test_delete_llama_with_a_picture_deletes_the_picture(self):
+        """
+        Test that deleting a llama deletes its picture, so a new llama that reuses the ID doesn't get it
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+        response = pytest.client.post(
+            "/llama",
+            json={"name": "Picture Perfect Llama", "age": 10, "color": "white", "rating": 4},
+            headers=headers,
+        )
+        llama_id = response.json()["llamaId"]
+
+        with open("./tests/test_images/test_llama_1.png", "rb") as file:
+            response = pytest.client.post(
+                f"/llama/{llama_id}/picture",
+                content=file.read(),
+                headers=headers,
+            )
+        assert response.status_code == 201
+        assert os.path.exists(f".appdata/llama_store_data/pictures/{llama_id}.png")
+
+        response = pytest.client.delete(f"/llama/{llama_id}", headers=headers)
+        assert response.status_code == 204
+
+        # The picture file is deleted after the response is sent, which the test client waits for
+        assert not os.path.exists(f".appdata/llama_store_data/pictures/{llama_id}.png")
+
+        # Create a new llama, which gets the same ID, and check it has no picture
+        response = pytest.client.post(
+            "/llama",
+            json={"name": "Picture Perfect Llama", "age": 10, "color": "white", "rating": 4},
+            headers=headers,
+        )
+        assert response.json()["llamaId"] == llama_id
+
+        response = pytest.client.get(f"/llama/{llama_id}/picture", headers=headers)
+        assert response.status_code == 404
+
     @pytest.mark.order(101)
     def test_delete_llama_without_api_key_fails(self):
         """
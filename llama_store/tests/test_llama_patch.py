@@ -0,0 +1,152 @@
+"""
+Integration tests for patching llamas.
+
+These tests assume that the write setup tests have been run, so that there is a test client and API token.
+"""
+
+from typing import List
+
+import pytest
+from sqlalchemy import event
+
+from data.database import engine
+from tests.helpers import create_llama, get_headers
+
+# The content type for JSON merge patches
+MERGE_PATCH = "application/merge-patch+json"
+
+
+class TestLlamaPatch:
+    """
+    Test patching llamas. Tests in this fixture start at 401.
+    """
+
+    @pytest.mark.order(401)
+    def test_a_patch_only_writes_the_fields_it_changes(self):
+        """
+        Test that patching a llama's rating only updates the rating, without checking the name
+        """
+        llama = create_llama("Patched Llama")
+        statements: List[str] = []
+
+        def record_statement(*args) -> None:
+            statements.append(args[2])
+
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            response = pytest.client.patch(
+                f"/llama/{llama['llamaId']}", json={"rating": 5}, headers=get_headers(content_type=MERGE_PATCH)
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+
+        assert response.status_code == 200
+        assert response.json() == {**llama, "rating": 5}
+        assert response.headers["ETag"] == '"2"'
+
+        updates = [statement for statement in statements if statement.startswith("UPDATE llamas")]
+        assert updates == ["UPDATE llamas SET rating=?, version=(llamas.version + ?) WHERE llamas.llama_id = ?"]
+        assert not [statement for statement in statements if "llamas.name =" in statement]
+
+    @pytest.mark.order(401)
+    def test_a_patch_can_change_the_name(self):
+        """
+        Test that a llama can be renamed, but not to the name of another llama
+        """
+        llama = create_llama("Renamed Llama")
+        other = create_llama("Other Renamed Llama")
+
+        response = pytest.client.patch(
+            f"/llama/{llama['llamaId']}",
+            json={"name": "Renamed Llama 2", "age": 4},
+            headers=get_headers(content_type=MERGE_PATCH),
+        )
+        assert response.status_code == 200
+        assert response.json() == {**llama, "name": "Renamed Llama 2", "age": 4}
+
+        response = pytest.client.patch(
+            f"/llama/{llama['llamaId']}",
+            json={"name": "Renamed Llama 2"},
+            headers=get_headers(content_type=MERGE_PATCH),
+        )
+        assert response.status_code == 200
+
+        response = pytest.client.patch(
+            f"/llama/{llama['llamaId']}", json={"name": other["name"]}, headers=get_headers(content_type=MERGE_PATCH)
+        )
+        assert response.status_code == 409
+        assert response.json() == {"detail": "Llama named Other Renamed Llama already exists"}
+
+    @pytest.mark.order(401)
+    def test_an_empty_patch_changes_nothing(self):
+        """
+        Test that an empty patch returns the llama without bumping its version
+        """
+        llama = create_llama("Unpatched Llama")
+        response = pytest.client.patch(
+            f"/llama/{llama['llamaId']}", json={}, headers=get_headers(content_type=MERGE_PATCH)
+        )
+        assert response.status_code == 200
+        assert response.json() == llama
+        assert response.headers["ETag"] == '"1"'
+
+        response = pytest.client.patch(
+            f"/llama/{llama['llamaId']}", json={}, headers=get_headers(content_type=MERGE_PATCH, if_match='"2"')
+        )
+        assert response.status_code == 412
+
+    @pytest.mark.order(401)
+    def test_a_patch_with_an_old_etag_fails(self):
+        """
+        Test that a patch based on an old version of a llama gives a 412 and isn't made
+        """
+        llama = create_llama("Contended Patched Llama")
+        assert (
+            pytest.client.patch(
+                f"/llama/{llama['llamaId']}", json={"age": 4}, headers=get_headers(content_type=MERGE_PATCH)
+            ).status_code
+            == 200
+        )
+
+        response = pytest.client.patch(
+            f"/llama/{llama['llamaId']}",
+            json={"rating": 1},
+            headers=get_headers(content_type=MERGE_PATCH, if_match='"1"'),
+        )
+        assert response.status_code == 412
+
+        response = pytest.client.patch(
+            f"/llama/{llama['llamaId']}",
+            json={"rating": 1},
+            headers=get_headers(content_type=MERGE_PATCH, if_match='"2"'),
+        )
+        assert response.status_code == 200
+        assert response.json() == {**llama, "age": 4, "rating": 1}
+
+    @pytest.mark.order(401)
+    def test_patching_a_missing_llama_gives_an_error(self):
+        """
+        Test that patching a llama that doesn't exist gives a 404
+        """
+        response = pytest.client.patch(
+            "/llama/999999", json={"rating": 5}, headers=get_headers(content_type=MERGE_PATCH)
+        )
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Llama not found"}
+
+    @pytest.mark.order(401)
+    def test_a_patch_cannot_remove_a_field(self):
+        """
+        Test that setting a field to null gives a validation error, as every llama field is required
+        """
+        llama = create_llama("Nulled Llama")
+        for field in ["name", "age", "color", "rating"]:
+            response = pytest.client.patch(
+                f"/llama/{llama['llamaId']}", json={field: None}, headers=get_headers(content_type=MERGE_PATCH)
+            )
+            assert response.status_code == 422
+            assert response.json()["detail"][0]["loc"] == ["body", field]
+
+        response = pytest.client.get(f"/llama/{llama['llamaId']}", headers=get_headers())
+        assert response.json() == llama
+        assert response.headers["ETag"] == '"1"'
@@ -0,0 +1,72 @@
+"""
+Integration tests for the Llama store API.
+These tests test the /llama/pictures endpoint
+
+These tests assume a clean database. Run recreate-database.sh to clean up the database.
+They also assume that the User integration tests have been run, so that there is a
+valid user and API token.
+"""
+
+from io import BytesIO
+import zipfile
+
+import pytest
+
+
+class TestLlamaPictureArchiveEndpoints:
+    """
+    Test the llama picture archive endpoint. Tests in this fixture start at 201.
+    """
+
+    @pytest.mark.order(201)
+    def test_get_llama_pictures_without_an_api_token_gives_an_error(self):
+        """
+        Test that we get an error if we try to get the llama pictures without an API token
+        """
+        response = pytest.client.get("/llama/pictures")
+        assert response.status_code == 403
+
+    @pytest.mark.order(201)
+    def test_get_llama_pictures_by_id_returns_a_zip_of_the_pictures(self):
+        """
+        Test that we get a zip archive containing the pictures for the requested llamas
+        """
+        response = pytest.client.get(
+            "/llama/pictures?llama_id=1&llama_id=2&llama_id=100",
+            headers={"Authorization": f"Bearer {pytest.api_token}"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zip"
+
+        with zipfile.ZipFile(BytesIO(response.content)) as archive:
+            assert archive.namelist() == ["1.png", "2.png"]
+            for llama_id in [1, 2]:
+                with open(f"./db_migrations/llama_pictures/{llama_id}.png", "rb") as file:
+                    assert archive.read(f"{llama_id}.png") == file.read()
+
+    @pytest.mark.order(201)
+    def test_get_llama_pictures_by_color_only_returns_pictures_of_that_color(self):
+        """
+        Test that we can filter the pictures in the archive by the color of the llama
+        """
+        response = pytest.client.get(
+            "/llama/pictures?color=black&" + "&".join(f"llama_id={llama_id}" for llama_id in range(1, 7)),
+            headers={"Authorization": f"Bearer {pytest.api_token}"},
+        )
+        assert response.status_code == 200
+
+        with zipfile.ZipFile(BytesIO(response.content)) as archive:
+            assert archive.namelist() == ["4.png", "5.png"]
+
+    @pytest.mark.order(201)
+    def test_get_llama_pictures_with_no_matching_llamas_returns_an_empty_zip(self):
+        """
+        Test that we get an empty archive if no llamas match
+        """
+        response = pytest.client.get(
+            "/llama/pictures?llama_id=100", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+
+        with zipfile.ZipFile(BytesIO(response.content)) as archive:
+            assert archive.namelist() == []
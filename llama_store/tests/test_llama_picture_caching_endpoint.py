@@ -0,0 +1,236 @@
+"""
+Integration tests for the Llama store API.
+These tests test the HTTP caching and range support of the /llama/{llama_id}/picture endpoint
+
+These tests assume a clean database. Run recreate-database.sh to clean up the database.
+They also assume that the User integration tests have been run, so that there is a
+valid user and API token.
+"""
+
+# pylint: disable=duplicate-code
+
+import os
+
+import anyio
+import pytest
+
+from data import picture_memory_cache
+import http_caching
+
+
+class TestLlamaPictureCaching:
+    """
+    Test the caching headers, conditional requests and range requests for llama pictures.
+    Tests in this fixture start at 201.
+    """
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_returns_caching_headers(self):
+        """
+        Test that pictures are sent with the headers needed to cache them
+        """
+        response = pytest.client.get("/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        assert response.status_code == 200
+        assert response.headers["etag"].startswith('"')
+        assert "last-modified" in response.headers
+        assert response.headers["cache-control"] == "private, max-age=60"
+        assert response.headers["accept-ranges"] == "bytes"
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_a_matching_etag_returns_not_modified(self):
+        """
+        Test that we get a 304 if we already have the current picture
+        """
+        response = pytest.client.get("/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        etag = response.headers["etag"]
+
+        response = pytest.client.get(
+            "/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}", "If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+        response = pytest.client.get(
+            "/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}", "If-None-Match": '"stale"'}
+        )
+        assert response.status_code == 200
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_modified_since_it_was_cached_returns_not_modified(self):
+        """
+        Test that we get a 304 if the picture hasn't changed since the If-Modified-Since date
+        """
+        response = pytest.client.get("/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        last_modified = response.headers["last-modified"]
+
+        response = pytest.client.get(
+            "/llama/1/picture",
+            headers={"Authorization": f"Bearer {pytest.api_token}", "If-Modified-Since": last_modified},
+        )
+        assert response.status_code == 304
+
+        response = pytest.client.get(
+            "/llama/1/picture",
+            headers={
+                "Authorization": f"Bearer {pytest.api_token}",
+                "If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT",
+            },
+        )
+        assert response.status_code == 200
+
+    @pytest.mark.order(201)
+    @pytest.mark.parametrize("byte_range,start,end", [("0-99", 0, 100), ("100-", 100, None), ("-100", -100, None)])
+    def test_get_a_llama_picture_with_a_range_returns_part_of_the_picture(self, byte_range: str, start: int, end: int):
+        """
+        Test that we can get part of a picture using a byte range
+        """
+        with open("./db_migrations/llama_pictures/1.png", "rb") as file:
+            picture_bytes = file.read()
+
+        response = pytest.client.get(
+            "/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}", "Range": f"bytes={byte_range}"}
+        )
+        assert response.status_code == 206
+        assert response.content == picture_bytes[start:end]
+
+        first = start if start >= 0 else len(picture_bytes) + start
+        last = first + len(response.content) - 1
+        assert response.headers["content-range"] == f"bytes {first}-{last}/{len(picture_bytes)}"
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_a_range_past_the_end_gives_an_error(self):
+        """
+        Test that we get a 416 if the range starts after the end of the picture
+        """
+        response = pytest.client.get(
+            "/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}", "Range": "bytes=100000000-"}
+        )
+        assert response.status_code == 416
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_the_memory_cache_turned_on_caches_the_picture(self):
+        """
+        Test that small pictures are served from the memory cache, and that updating the picture removes it
+        """
+        picture_memory_cache.picture_cache.max_bytes = 10 * 1024 * 1024
+        try:
+            # Create a new llama with a picture
+            response = pytest.client.post(
+                "/llama",
+                json={
+                    "name": "Cached Picture Llama",
+                    "age": 5,
+                    "color": "brown",
+                    "rating": 4,
+                },
+                headers={"Authorization": f"Bearer {pytest.api_token}"},
+            )
+            llama_id = response.json()["llamaId"]
+
+            with open("./tests/test_images/test_llama_1.png", "rb") as file:
+                response = pytest.client.post(
+                    f"/llama/{llama_id}/picture",
+                    content=file.read(),
+                    headers={"Authorization": f"Bearer {pytest.api_token}"},
+                )
+            assert response.status_code == 201
+
+            # Get the thumbnail twice - the second time comes from the cache
+            url = f"/llama/{llama_id}/picture?size=thumbnail"
+            first_response = pytest.client.get(url, headers={"Authorization": f"Bearer {pytest.api_token}"})
+            assert first_response.status_code == 200
+            assert (llama_id, 64, 64, "png") in picture_memory_cache.picture_cache
+
+            second_response = pytest.client.get(url, headers={"Authorization": f"Bearer {pytest.api_token}"})
+            assert second_response.status_code == 200
+            assert second_response.content == first_response.content
+            assert second_response.headers["etag"] == first_response.headers["etag"]
+
+            # Conditional requests work from the cache
+            response = pytest.client.get(
+                url,
+                headers={
+                    "Authorization": f"Bearer {pytest.api_token}",
+                    "If-None-Match": first_response.headers["etag"],
+                },
+            )
+            assert response.status_code == 304
+
+            # Cached pictures are read again once they expire
+            cached = picture_memory_cache.picture_cache.get((llama_id, 64, 64, "png"))
+            picture_memory_cache.picture_cache.put((llama_id, 64, 64, "png"), cached._replace(expires_at=0), 1)
+            assert picture_memory_cache.get_cached_picture((llama_id, 64, 64, "png")) is None
+            response = pytest.client.get(url, headers={"Authorization": f"Bearer {pytest.api_token}"})
+            assert response.content == first_response.content
+            assert (llama_id, 64, 64, "png") in picture_memory_cache.picture_cache
+
+            # Updating the picture removes it from the cache
+            with open("./tests/test_images/test_llama_3.png", "rb") as file:
+                response = pytest.client.put(
+                    f"/llama/{llama_id}/picture",
+                    content=file.read(),
+                    headers={"Authorization": f"Bearer {pytest.api_token}"},
+                )
+            assert response.status_code == 200
+            assert (llama_id, 64, 64, "png") not in picture_memory_cache.picture_cache
+
+            response = pytest.client.get(url, headers={"Authorization": f"Bearer {pytest.api_token}"})
+            assert response.status_code == 200
+            assert response.content != first_response.content
+        finally:
+            picture_memory_cache.picture_cache.max_bytes = 0
+            picture_memory_cache.picture_cache.clear()
+
+    @pytest.mark.order(201)
+    @pytest.mark.parametrize(
+        "mode,header,expected",
+        [
+            ("x-accel-redirect", "x-accel-redirect", "/protected/pictures/1.png"),
+            ("x-sendfile", "x-sendfile", os.path.abspath(".appdata/llama_store_data/pictures/1.png")),
+        ],
+    )
+    def test_get_a_llama_picture_with_a_sendfile_mode_lets_the_proxy_send_it(
+        self, monkeypatch, mode: str, header: str, expected: str
+    ):
+        """
+        Test that with a sendfile mode set, the response tells the front proxy which file to send
+        """
+        monkeypatch.setattr(http_caching, "SENDFILE_MODE", mode)
+
+        response = pytest.client.get("/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        assert response.status_code == 200
+        assert response.headers[header] == expected
+        assert response.headers["content-type"] == "image/png"
+        assert "etag" in response.headers
+        assert response.content == b""
+
+        # Conditional requests are still answered by the API
+        response = pytest.client.get(
+            "/llama/1/picture",
+            headers={"Authorization": f"Bearer {pytest.api_token}", "If-None-Match": response.headers["etag"]},
+        )
+        assert response.status_code == 304
+
+    @pytest.mark.order(201)
+    def test_file_responses_use_zero_copy_send_if_the_server_supports_it(self):
+        """
+        Test that the file is handed to the server rather than read, when the server offers zero copy send
+        """
+        path = ".appdata/llama_store_data/pictures/1.png"
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async def receive():
+            return {"type": "http.request"}
+
+        response = http_caching.ZeroCopyFileResponse(path=path, media_type="image/png", stat_result=os.stat(path))
+        scope = {"type": "http", "method": "GET", "extensions": {http_caching.ZEROCOPY_EXTENSION: {}}}
+        anyio.run(response, scope, receive, send)
+
+        assert messages[0]["type"] == "http.response.start"
+        assert messages[1]["type"] == http_caching.ZEROCOPY_EXTENSION
+        assert messages[1]["offset"] == 0
+        assert messages[1]["count"] == os.path.getsize(path)
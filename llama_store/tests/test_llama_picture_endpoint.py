@@ -8,7 +8,14 @@ valid user and API token.
 """
 
 from io import BytesIO
+
+from PIL import Image
 import pytest
+from sqlalchemy.exc import IntegrityError
+
+from data import picture_variants
+from data.database import SessionLocal
+from data.schema import DBLlamaPicture
 
 
 def compare_bytes_to_file(content: bytes, filename: str) -> bool:
@@ -357,3 +364,232 @@ class TestLlamaPictureEndpoints:
         response = pytest.client.delete(f"/llama/{llama_id}/picture")
 
         assert response.status_code == 403
+
+    @pytest.mark.order(201)
+    @pytest.mark.parametrize("size,dimension", [("thumbnail", 64), ("small", 256), ("medium", 512)])
+    def test_get_a_llama_picture_with_a_named_size_returns_a_resized_picture(self, size: str, dimension: int):
+        """
+        Test that we can get a resized llama picture using a named size
+        """
+        response = pytest.client.get(
+            f"/llama/1/picture?size={size}", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/png"
+
+        image = Image.open(BytesIO(response.content))
+        assert image.format == "PNG"
+        assert max(image.size) == dimension
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_a_width_returns_a_resized_picture(self):
+        """
+        Test that we can get a resized llama picture using a width, and that the aspect ratio is kept
+        """
+        original = Image.open("./db_migrations/llama_pictures/1.png")
+
+        response = pytest.client.get(
+            "/llama/1/picture?width=100", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+
+        image = Image.open(BytesIO(response.content))
+        assert image.width == 100
+        assert image.height == round(original.height * 100 / original.width)
+
+    @pytest.mark.order(201)
+    def test_get_a_resized_llama_picture_bigger_than_the_variant_cache_returns_the_picture(self, monkeypatch, tmp_path):
+        """
+        Test that a resized picture too big for the variant cache is still sent, without being kept on disk
+        """
+        variant_cache = picture_variants.PictureVariantCache(str(tmp_path), 100, 1)
+        monkeypatch.setattr(picture_variants, "variant_cache", variant_cache)
+
+        for _ in range(2):
+            response = pytest.client.get(
+                "/llama/1/picture?width=120", headers={"Authorization": f"Bearer {pytest.api_token}"}
+            )
+            assert response.status_code == 200
+            assert Image.open(BytesIO(response.content)).width == 120
+            assert response.headers["etag"]
+
+        assert not list(tmp_path.iterdir())
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_a_size_and_a_width_gives_an_error(self):
+        """
+        Test that we can't mix named sizes with explicit dimensions
+        """
+        response = pytest.client.get(
+            "/llama/1/picture?size=small&width=100", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 400
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_accepting_webp_returns_a_webp_picture(self):
+        """
+        Test that we get a WebP picture if we ask for one in the Accept header
+        """
+        response = pytest.client.get(
+            "/llama/1/picture",
+            headers={"Authorization": f"Bearer {pytest.api_token}", "Accept": "image/webp,image/png;q=0.8,*/*;q=0.5"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/webp"
+        assert response.headers["vary"] == "Accept"
+
+        image = Image.open(BytesIO(response.content))
+        assert image.format == "WEBP"
+        assert image.size == Image.open("./db_migrations/llama_pictures/1.png").size
+
+    @pytest.mark.order(201)
+    @pytest.mark.parametrize("accept", ["*/*", "image/*", "image/png", "image/png,image/webp;q=0.5", "text/html"])
+    def test_get_a_llama_picture_without_accepting_webp_returns_a_png(self, accept: str):
+        """
+        Test that PNG stays the default unless the client prefers WebP
+        """
+        response = pytest.client.get(
+            "/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}", "Accept": accept}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/png"
+        assert response.headers["vary"] == "Accept"
+        assert compare_bytes_to_file(response.content, "./db_migrations/llama_pictures/1.png")
+
+    @pytest.mark.order(201)
+    def test_get_a_resized_llama_picture_accepting_webp_returns_a_resized_webp_picture(self):
+        """
+        Test that named sizes and WebP can be combined
+        """
+        response = pytest.client.get(
+            "/llama/1/picture?size=small",
+            headers={"Authorization": f"Bearer {pytest.api_token}", "Accept": "image/webp"},
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/webp"
+
+        image = Image.open(BytesIO(response.content))
+        assert image.format == "WEBP"
+        assert max(image.size) == 256
+
+    @pytest.mark.order(201)
+    def test_updating_a_llama_picture_updates_the_resized_picture(self):
+        """
+        Test that resized pictures are regenerated when the picture is updated
+        """
+        # Create a new llama
+        response = pytest.client.post(
+            "/llama",
+            json={
+                "name": "Picture Llama 7",
+                "age": 5,
+                "color": "brown",
+                "rating": 4,
+            },
+            headers={"Authorization": f"Bearer {pytest.api_token}"},
+        )
+
+        # Get the ID
+        llama_id = response.json()["llamaId"]
+
+        # Set the picture, and get a thumbnail of it
+        with open("./tests/test_images/test_llama_1.png", "rb") as file:
+            picture_bytes = file.read()
+
+        response = pytest.client.post(
+            f"/llama/{llama_id}/picture",
+            content=picture_bytes,
+            headers={
+                "Authorization": f"Bearer {pytest.api_token}",
+            },
+        )
+        assert response.status_code == 201
+
+        response = pytest.client.get(
+            f"/llama/{llama_id}/picture?size=thumbnail", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+        first_thumbnail = response.content
+
+        # Update to another llama picture
+        with open("./tests/test_images/test_llama_3.png", "rb") as file:
+            picture_bytes = file.read()
+
+        response = pytest.client.put(
+            f"/llama/{llama_id}/picture",
+            content=picture_bytes,
+            headers={
+                "Authorization": f"Bearer {pytest.api_token}",
+            },
+        )
+        assert response.status_code == 200
+
+        # Verify the thumbnail is of the new picture
+        response = pytest.client.get(
+            f"/llama/{llama_id}/picture?size=thumbnail", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+        assert response.content != first_thumbnail
+
+        expected = Image.open("./tests/test_images/test_llama_3.png")
+        expected.thumbnail((64, 64))
+        assert Image.open(BytesIO(response.content)).tobytes() == expected.tobytes()
+
+    @pytest.mark.order(201)
+    def test_updating_a_llama_picture_keeps_one_picture_per_llama(self):
+        """
+        Test that updating a picture replaces the existing row, and that a second row can't be added
+        """
+        # Create a new llama
+        response = pytest.client.post(
+            "/llama",
+            json={"name": "Picture Llama 8", "age": 5, "color": "brown", "rating": 4},
+            headers={"Authorization": f"Bearer {pytest.api_token}"},
+        )
+        llama_id = response.json()["llamaId"]
+
+        with open("./tests/test_images/test_llama_3.png", "rb") as file:
+            picture_bytes = file.read()
+
+        for _ in range(2):
+            response = pytest.client.put(
+                f"/llama/{llama_id}/picture",
+                content=picture_bytes,
+                headers={"Authorization": f"Bearer {pytest.api_token}"},
+            )
+            assert response.status_code == 200
+
+        session = SessionLocal()
+        try:
+            assert session.query(DBLlamaPicture).filter(DBLlamaPicture.llama_id == llama_id).count() == 1
+
+            session.add(DBLlamaPicture(llama_id=llama_id, image_file_location="duplicate.png"))
+            with pytest.raises(IntegrityError):
+                session.commit()
+        finally:
+            session.close()
+
+    @pytest.mark.order(201)
+    def test_changing_a_llama_picture_checks_the_llama_and_picture_exist(self):
+        """
+        Test the errors for creating, updating and deleting pictures for missing llamas or pictures
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+        with open("./tests/test_images/test_llama_1.png", "rb") as file:
+            picture_bytes = file.read()
+
+        # Llamas that don't exist
+        assert pytest.client.post("/llama/9999/picture", content=picture_bytes, headers=headers).status_code == 404
+        assert pytest.client.put("/llama/9999/picture", content=picture_bytes, headers=headers).status_code == 404
+        assert pytest.client.delete("/llama/9999/picture", headers=headers).status_code == 404
+
+        # A llama that already has a picture
+        assert pytest.client.post("/llama/1/picture", content=picture_bytes, headers=headers).status_code == 409
+
+        # A llama without a picture
+        response = pytest.client.post(
+            "/llama", json={"name": "Picture Llama 9", "age": 5, "color": "brown", "rating": 4}, headers=headers
+        )
+        response = pytest.client.delete(f"/llama/{response.json()['llamaId']}/picture", headers=headers)
+        assert response.status_code == 404
+        assert response.json() == {"detail": "Picture not found"}
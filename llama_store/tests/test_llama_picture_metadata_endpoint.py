@@ -0,0 +1,146 @@
+"""
+Integration tests for the Llama store API.
+These tests test the /llama/{llama_id}/picture/metadata endpoint
+
+These tests assume a clean database. Run recreate-database.sh to clean up the database.
+They also assume that the User integration tests have been run, so that there is a
+valid user and API token.
+"""
+
+# pylint: disable=duplicate-code
+
+import base64
+import hashlib
+from io import BytesIO
+
+from PIL import Image
+import pytest
+
+from data.files import delete_llama_picture_file, get_llama_picture_metadata, write_llama_picture_to_file
+
+
+def expected_metadata(llama_id: int, filename: str) -> dict:
+    """
+    Work out the metadata we expect for a picture file
+    """
+    with open(filename, "rb") as file:
+        body = file.read()
+
+    image = Image.open(BytesIO(body))
+    return {
+        "llamaId": llama_id,
+        "width": image.width,
+        "height": image.height,
+        "byteSize": len(body),
+        "contentHash": hashlib.sha256(body).hexdigest(),
+    }
+
+
+class TestLlamaPictureMetadataEndpoints:
+    """
+    Test the llama picture metadata endpoint. Tests in this fixture start at 201.
+    """
+
+    @pytest.mark.order(201)
+    def test_get_llama_picture_metadata_without_an_api_token_gives_an_error(self):
+        """
+        Test that we get an error if we try to get the picture metadata without an API token
+        """
+        response = pytest.client.get("/llama/1/picture/metadata")
+        assert response.status_code == 403
+
+    @pytest.mark.order(201)
+    @pytest.mark.parametrize("llama_id", [1, 2, 3, 4, 5, 6])
+    def test_get_llama_picture_metadata_returns_the_details_of_the_picture(self, llama_id: int):
+        """
+        Test that we get the details of the initial pictures, which are filled in by the database migration
+        """
+        response = pytest.client.get(
+            f"/llama/{llama_id}/picture/metadata", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+
+        metadata = response.json()
+        placeholder = metadata.pop("placeholder")
+        assert metadata == expected_metadata(llama_id, f"./db_migrations/llama_pictures/{llama_id}.png")
+
+        # The placeholder is a tiny PNG
+        assert placeholder.startswith("data:image/png;base64,")
+        image = Image.open(BytesIO(base64.b64decode(placeholder.removeprefix("data:image/png;base64,"))))
+        assert image.format == "PNG"
+        assert max(image.size) == 8
+
+    @pytest.mark.order(201)
+    def test_get_llama_picture_metadata_for_a_llama_that_doesnt_exist_returns_a_404(self):
+        """
+        Test that we get a 404 if the llama doesn't have a picture
+        """
+        response = pytest.client.get(
+            "/llama/100/picture/metadata", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 404
+
+    @pytest.mark.order(201)
+    def test_creating_a_llama_picture_records_the_details_of_the_picture(self):
+        """
+        Test that the details are recorded when a picture is uploaded, and updated when it changes
+        """
+        # Create a new llama
+        response = pytest.client.post(
+            "/llama",
+            json={
+                "name": "Metadata Llama",
+                "age": 5,
+                "color": "brown",
+                "rating": 4,
+            },
+            headers={"Authorization": f"Bearer {pytest.api_token}"},
+        )
+        llama_id = response.json()["llamaId"]
+
+        # Upload a jpeg, which is converted to a png
+        with open("./tests/test_images/test_llama_2.jpeg", "rb") as file:
+            response = pytest.client.post(
+                f"/llama/{llama_id}/picture",
+                content=file.read(),
+                headers={"Authorization": f"Bearer {pytest.api_token}"},
+            )
+        assert response.status_code == 201
+
+        response = pytest.client.get(
+            f"/llama/{llama_id}/picture/metadata", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+        metadata = response.json()
+        metadata.pop("placeholder")
+        assert metadata == expected_metadata(llama_id, "./tests/test_images/test_llama_2_converted.png")
+
+        # Update the picture, and check the details change
+        with open("./tests/test_images/test_llama_3.png", "rb") as file:
+            response = pytest.client.put(
+                f"/llama/{llama_id}/picture",
+                content=file.read(),
+                headers={"Authorization": f"Bearer {pytest.api_token}"},
+            )
+        assert response.status_code == 200
+
+        response = pytest.client.get(
+            f"/llama/{llama_id}/picture/metadata", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        metadata = response.json()
+        metadata.pop("placeholder")
+        assert metadata == expected_metadata(llama_id, "./tests/test_images/test_llama_3.png")
+
+    @pytest.mark.order(201)
+    def test_writing_a_picture_returns_the_details_of_the_stored_picture(self):
+        """
+        Test that the details returned when a picture is written match the details read back from the stored file
+        """
+        with open("./tests/test_images/test_llama_1.png", "rb") as file:
+            body = file.read()
+
+        location, metadata = write_llama_picture_to_file(999, body)
+        try:
+            assert metadata == get_llama_picture_metadata(999, location)
+        finally:
+            delete_llama_picture_file(location)
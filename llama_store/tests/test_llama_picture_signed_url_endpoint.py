@@ -0,0 +1,88 @@
+"""
+Integration tests for the Llama store API.
+These tests test signed URLs for the /llama/{llama_id}/picture endpoint
+
+These tests assume a clean database. Run recreate-database.sh to clean up the database.
+They also assume that the User integration tests have been run, so that there is a
+valid user and API token.
+"""
+
+from io import BytesIO
+import time
+
+from PIL import Image
+import pytest
+
+from data.picture_signing import create_picture_signature, get_picture_url_expiry
+from tests.test_llama_picture_endpoint import compare_bytes_to_file
+
+
+class TestLlamaPictureSignedUrlEndpoints:
+    """
+    Test getting llama pictures with signed URLs. Tests in this fixture start at 201.
+    """
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_a_signed_url_returns_the_picture_without_an_api_token(self):
+        """
+        Test that a signed picture URL from a llama can be used to get the picture without an API token
+        """
+        response = pytest.client.get(
+            "/llama/1?include_picture_urls=true", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+        picture_url = response.json()["pictureUrl"]
+        assert picture_url.startswith("http://testserver/llama/1/picture?expires=")
+
+        response = pytest.client.get(picture_url)
+        assert response.status_code == 200
+        assert response.headers["cache-control"].startswith("public, max-age=")
+        assert compare_bytes_to_file(response.content, "./db_migrations/llama_pictures/1.png")
+
+        # Signed URLs work with the other picture options
+        response = pytest.client.get(f"{picture_url}&size=thumbnail")
+        assert response.status_code == 200
+        assert max(Image.open(BytesIO(response.content)).size) == 64
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_an_invalid_signed_url_gives_an_error(self):
+        """
+        Test that tampered, expired, or other llamas' signed picture URLs are rejected
+        """
+        expires = get_picture_url_expiry()
+        signature = create_picture_signature(1, expires)
+
+        # A signature for a different llama
+        response = pytest.client.get(f"/llama/2/picture?expires={expires}&signature={signature}")
+        assert response.status_code == 401
+
+        # A changed expiry time
+        response = pytest.client.get(f"/llama/1/picture?expires={expires + 1}&signature={signature}")
+        assert response.status_code == 401
+
+        # An expired URL
+        expired = int(time.time()) - 1
+        response = pytest.client.get(
+            f"/llama/1/picture?expires={expired}&signature={create_picture_signature(1, expired)}"
+        )
+        assert response.status_code == 401
+
+    @pytest.mark.order(201)
+    def test_get_all_llamas_with_picture_urls_only_includes_urls_for_llamas_with_pictures(self):
+        """
+        Test that picture URLs are only included when asked for, and only for llamas with a picture
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+        response = pytest.client.post(
+            "/llama", json={"name": "Picture Llama 10", "age": 5, "color": "brown", "rating": 4}, headers=headers
+        )
+        llama_id = response.json()["llamaId"]
+        assert "pictureUrl" not in response.json()
+
+        response = pytest.client.get("/llama", headers=headers)
+        assert all("pictureUrl" not in llama for llama in response.json())
+
+        response = pytest.client.get("/llama?include_picture_urls=true", headers=headers)
+        llamas = {llama["llamaId"]: llama for llama in response.json()}
+        assert "pictureUrl" not in llamas[llama_id]
+        assert llamas[1]["pictureUrl"].startswith("http://testserver/llama/1/picture?expires=")
@@ -0,0 +1,146 @@
+"""
+Tests for filtering, sorting and paging the list of llamas.
+
+The column tests use llamas of their own. The endpoint tests assume that the write setup tests have been run, so
+that there is a test client and API token.
+"""
+
+from typing import List
+
+import numpy
+import pytest
+
+from data import llama_columns, replica
+from data.llama_columns import LlamaColumns
+from models.llama import LlamaQuery, LlamaSort
+
+# Llamas for the column tests, as rows of llama ID, name, age, color, rating and version
+ROWS = [
+    (1, "Bernie", 4, "brown", 5, 1),
+    (2, "Dottie", 6, "white", 4, 3),
+    (5, "Élan", 4, "gray", 3, 1),
+    (7, "Alpaca Al", 9, "brown", 4, 2),
+    (8, "", 2, "black", 1, 1),
+    (9, "Bern", 6, "brown", 4, 1),
+]
+
+# Queries to check both ways of selecting rows with
+QUERIES = [LlamaQuery(sort=sort) for sort in LlamaSort] + [
+    LlamaQuery(color="brown", min_rating=4, sort="-age"),
+    LlamaQuery(min_age=4, max_age=6, max_rating=4, sort="name"),
+    LlamaQuery(color="gray", max_age=1),
+]
+
+# Query strings for the endpoint tests
+QUERY_STRINGS = [
+    "",
+    "color=brown",
+    "min_age=3&max_age=6&sort=-rating",
+    "min_rating=4&sort=name",
+    "sort=-age&offset=2&limit=3",
+    "sort=-llamaId&limit=1",
+    "offset=1000",
+]
+
+
+def get_llama_ids(query: LlamaQuery) -> List[int]:
+    """
+    Gets the IDs of the llamas in ROWS that match a query.
+    """
+    return [llama.llama_id for llama in LlamaColumns(ROWS).query(query)[1]]
+
+
+class TestLlamaColumns:
+    """
+    Test the in-memory llama columns.
+    """
+
+    @pytest.mark.parametrize("numpy_module", [numpy, None])
+    def test_llamas_are_filtered_sorted_and_paged(self, monkeypatch, numpy_module):
+        """
+        Test that queries get the right llamas, in the right order, using NumPy and using pure Python
+        """
+        monkeypatch.setattr(llama_columns, "get_numpy", lambda: numpy_module)
+
+        assert get_llama_ids(LlamaQuery()) == [1, 2, 5, 7, 8, 9]
+        assert get_llama_ids(LlamaQuery(color="brown")) == [1, 7, 9]
+        assert get_llama_ids(LlamaQuery(sort="-age")) == [7, 2, 9, 1, 5, 8]
+        assert get_llama_ids(LlamaQuery(sort="name")) == [8, 7, 9, 1, 2, 5]
+        assert get_llama_ids(LlamaQuery(min_rating=4, sort="-rating", offset=1, limit=2)) == [2, 7]
+        assert LlamaColumns(ROWS).query(LlamaQuery(max_age=4, limit=1))[0] == 3
+
+    def test_numpy_selects_the_same_rows_as_python(self):
+        """
+        Test that the vectorized filter and sort match the pure Python ones
+        """
+        assert llama_columns.get_numpy() is numpy
+        columns = LlamaColumns(ROWS)
+        for query in QUERIES:
+            assert [int(row) for row in columns.select_rows_vectorized(query)] == list(columns.select_rows(query))
+
+    def test_llamas_are_found_by_id_and_name(self):
+        """
+        Test getting single llamas from the columns
+        """
+        columns = LlamaColumns(ROWS)
+
+        llama = columns.get_llama_by_id(5)
+        assert (llama.llama_id, llama.name, llama.age, llama.color, llama.rating, llama.version) == ROWS[2]
+        assert columns.get_llama_by_id(2).version == 3
+        assert columns.get_llama_by_id(3) is None
+        assert columns.get_llama_by_id(10) is None
+
+        assert columns.get_llama_by_name("Bern").llama_id == 9
+        assert columns.get_llama_by_name("").llama_id == 8
+        assert columns.get_llama_by_name("Élan").llama_id == 5
+        assert columns.get_llama_by_name("ern") is None
+
+
+class TestLlamaQueryEndpoint:
+    """
+    Test filtering, sorting and paging llamas with the API. Tests in this fixture start at 401.
+    """
+
+    @pytest.mark.order(401)
+    def test_get_llamas_with_a_filter_returns_the_matching_page(self):
+        """
+        Test that the llamas are filtered, sorted and paged, with the total count in a header
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+        all_llamas = pytest.client.get("/llama", headers=headers).json()
+
+        response = pytest.client.get("/llama?color=brown&min_rating=4&sort=-age&limit=2", headers=headers)
+        assert response.status_code == 200
+
+        expected = sorted(
+            (llama for llama in all_llamas if llama["color"] == "brown" and llama["rating"] >= 4),
+            key=lambda llama: -llama["age"],
+        )
+        assert response.json() == expected[:2]
+        assert response.headers["x-total-count"] == str(len(expected))
+
+    @pytest.mark.order(401)
+    @pytest.mark.parametrize("query_string", ["sort=age-", "min_rating=6", "offset=-1", "limit=0", "color=pink"])
+    def test_get_llamas_with_a_bad_query_gives_an_error(self, query_string: str):
+        """
+        Test that invalid query parameters are rejected
+        """
+        response = pytest.client.get(f"/llama?{query_string}", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        assert response.status_code == 422
+
+    @pytest.mark.order(401)
+    def test_a_read_replica_returns_the_same_llamas_as_the_database(self, monkeypatch):
+        """
+        Test that the in-memory columns give the same results as the database for each query
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+        from_database = [pytest.client.get(f"/llama?{query}", headers=headers) for query in QUERY_STRINGS]
+
+        monkeypatch.setattr(replica, "READ_REPLICA", True)
+        monkeypatch.setattr(replica.read_replica, "snapshot", None)
+        assert replica.read_replica.refresh()
+
+        for query, expected in zip(QUERY_STRINGS, from_database):
+            response = pytest.client.get(f"/llama?{query}", headers=headers)
+            assert response.json() == expected.json(), query
+            assert response.headers["x-total-count"] == expected.headers["x-total-count"], query
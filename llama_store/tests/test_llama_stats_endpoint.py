@@ -0,0 +1,133 @@
+"""
+Integration tests for the llama statistics endpoint.
+
+These tests assume that the write setup tests have been run, so that there is a test client and API token. They
+work out the expected statistics from the list of llamas, so they don't depend on which llamas exist.
+"""
+
+from math import ceil
+from typing import Dict, List
+
+import pytest
+
+from data import replica
+from data.llama_stats import get_percentile
+
+
+def get_all_llamas() -> List[Dict]:
+    """
+    Gets all the llamas from the API.
+    """
+    return pytest.client.get("/llama", headers={"Authorization": f"Bearer {pytest.api_token}"}).json()
+
+
+def get_stats() -> Dict:
+    """
+    Gets the llama statistics from the API.
+    """
+    response = pytest.client.get("/llama/stats", headers={"Authorization": f"Bearer {pytest.api_token}"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def get_expected_stats(llamas: List[Dict]) -> Dict:
+    """
+    Works out the statistics for a list of llamas by scanning them all.
+    """
+    ages = sorted(llama["age"] for llama in llamas)
+    return {
+        "llamaCount": len(llamas),
+        "colorCounts": {
+            color: len([llama for llama in llamas if llama["color"] == color])
+            for color in ["brown", "white", "black", "gray"]
+        },
+        "ratingCounts": {
+            str(rating): len([llama for llama in llamas if llama["rating"] == rating]) for rating in range(1, 6)
+        },
+        "averageRating": sum(llama["rating"] for llama in llamas) / len(llamas),
+        "age": {
+            "minimum": ages[0],
+            "p25": ages[ceil(0.25 * len(ages)) - 1],
+            "median": ages[ceil(0.5 * len(ages)) - 1],
+            "p75": ages[ceil(0.75 * len(ages)) - 1],
+            "p90": ages[ceil(0.9 * len(ages)) - 1],
+            "p99": ages[ceil(0.99 * len(ages)) - 1],
+            "maximum": ages[-1],
+            "mean": sum(ages) / len(ages),
+        },
+    }
+
+
+class TestLlamaStatsEndpoint:
+    """
+    Test the llama statistics endpoint. Tests in this fixture start at 401.
+    """
+
+    def test_percentiles_use_the_nearest_rank(self):
+        """
+        Test working out percentiles from the number of llamas of each age
+        """
+        age_counts = [(1, 1), (3, 2), (8, 1)]
+        assert [get_percentile(age_counts, 4, percentile) for percentile in [0, 25, 50, 75, 99, 100]] == [
+            1,
+            1,
+            3,
+            3,
+            8,
+            8,
+        ]
+
+    @pytest.mark.order(401)
+    def test_get_llama_stats_without_an_api_token_gives_an_error(self):
+        """
+        Test that we get an error if we try to get the statistics without an API token
+        """
+        assert pytest.client.get("/llama/stats").status_code == 403
+
+    @pytest.mark.order(401)
+    def test_get_llama_stats_matches_the_llamas(self):
+        """
+        Test that the statistics match the llamas
+        """
+        assert get_stats() == get_expected_stats(get_all_llamas())
+
+    @pytest.mark.order(401)
+    def test_llama_stats_are_kept_up_to_date_as_llamas_are_written(self):
+        """
+        Test that creating, updating and deleting llamas updates the statistics
+        """
+        headers = {"Authorization": f"Bearer {pytest.api_token}"}
+
+        response = pytest.client.post(
+            "/llama", json={"name": "Stats Llama", "age": 97, "color": "black", "rating": 1}, headers=headers
+        )
+        assert response.status_code == 201
+        llama_id = response.json()["llamaId"]
+        assert get_stats() == get_expected_stats(get_all_llamas())
+        assert get_stats()["age"]["maximum"] == 97
+
+        response = pytest.client.put(
+            f"/llama/{llama_id}",
+            json={"name": "Stats Llama", "age": 98, "color": "white", "rating": 2},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert get_stats() == get_expected_stats(get_all_llamas())
+        assert get_stats()["age"]["maximum"] == 98
+
+        assert pytest.client.delete(f"/llama/{llama_id}", headers=headers).status_code == 204
+        assert get_stats() == get_expected_stats(get_all_llamas())
+        assert get_stats()["age"]["maximum"] < 97
+
+    @pytest.mark.order(401)
+    def test_a_read_replica_serves_the_same_stats(self, monkeypatch):
+        """
+        Test that a read replica gets the statistics along with the llamas
+        """
+        expected = get_stats()
+
+        monkeypatch.setattr(replica, "READ_REPLICA", True)
+        monkeypatch.setattr(replica.read_replica, "snapshot", None)
+        assert replica.read_replica.refresh()
+
+        assert get_stats() == expected
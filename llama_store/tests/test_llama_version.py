@@ -0,0 +1,94 @@
+"""
+Tests for llama versions, and conditional updates with If-Match.
+
+The endpoint tests assume that the write setup tests have been run, so that there is a test client and API token.
+"""
+
+import pytest
+
+from http_caching import make_version_etag, parse_version_etags
+from tests.helpers import create_llama, get_headers
+
+
+class TestLlamaVersion:
+    """
+    Test llama versions. Tests in this fixture start at 401.
+    """
+
+    def test_version_etags_are_parsed(self):
+        """
+        Test that the versions are read from an If-Match header
+        """
+        assert parse_version_etags(make_version_etag(12)) == [12]
+        assert parse_version_etags('"1", W/"2" , "x", 3, ""') == [1, 2]
+        assert parse_version_etags(" * ") is None
+
+    @pytest.mark.order(401)
+    def test_each_update_changes_the_etag(self):
+        """
+        Test that a llama's ETag starts at its first version, and changes each time it is updated
+        """
+        llama_id = create_llama("Versioned Llama")["llamaId"]
+        response = pytest.client.get(f"/llama/{llama_id}", headers=get_headers())
+        assert response.headers["ETag"] == '"1"'
+        assert "version" not in response.json()
+
+        llama = {"name": "Versioned Llama", "age": 4, "color": "brown", "rating": 3}
+        response = pytest.client.put(f"/llama/{llama_id}", json=llama, headers=get_headers())
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"2"'
+        assert pytest.client.get(f"/llama/{llama_id}", headers=get_headers()).headers["ETag"] == '"2"'
+
+    @pytest.mark.order(401)
+    def test_an_update_with_the_current_etag_is_made(self):
+        """
+        Test that an update is made if the If-Match header has the llama's current ETag, including a weak one
+        """
+        llama_id = create_llama("Matching Llama")["llamaId"]
+        etag = pytest.client.get(f"/llama/{llama_id}", headers=get_headers()).headers["ETag"]
+
+        llama = {"name": "Matching Llama", "age": 5, "color": "gray", "rating": 4}
+        response = pytest.client.put(f"/llama/{llama_id}", json=llama, headers=get_headers(if_match=etag))
+        assert response.status_code == 200
+        assert response.json() == {"llamaId": llama_id, **llama}
+
+        llama["rating"] = 5
+        response = pytest.client.put(
+            f"/llama/{llama_id}", json=llama, headers=get_headers(if_match=f'"7", W/{response.headers["ETag"]}')
+        )
+        assert response.status_code == 200
+
+    @pytest.mark.order(401)
+    def test_an_update_with_an_old_etag_fails(self):
+        """
+        Test that an update based on an old version of a llama gives a 412 and isn't made, so the second of two
+        clients updating the same version of a llama doesn't overwrite the first
+        """
+        llama_id = create_llama("Contended Llama")["llamaId"]
+        etag = pytest.client.get(f"/llama/{llama_id}", headers=get_headers()).headers["ETag"]
+
+        first = {"name": "Contended Llama", "age": 4, "color": "brown", "rating": 3}
+        assert (
+            pytest.client.put(f"/llama/{llama_id}", json=first, headers=get_headers(if_match=etag)).status_code == 200
+        )
+
+        second = {"name": "Contended Llama", "age": 3, "color": "brown", "rating": 1}
+        response = pytest.client.put(f"/llama/{llama_id}", json=second, headers=get_headers(if_match=etag))
+        assert response.status_code == 412
+        assert response.json() == {"detail": "The llama has been changed since the version in the If-Match header"}
+
+        response = pytest.client.get(f"/llama/{llama_id}", headers=get_headers())
+        assert response.json() == {"llamaId": llama_id, **first}
+        assert response.headers["ETag"] == '"2"'
+
+    @pytest.mark.order(401)
+    def test_a_conditional_update_does_not_create_a_llama(self):
+        """
+        Test that an update with an If-Match header gives a 412 if the llama doesn't exist, rather than creating it
+        """
+        llama = {"name": "Missing Llama", "age": 4, "color": "brown", "rating": 3}
+        response = pytest.client.put("/llama/999999", json=llama, headers=get_headers(if_match="*"))
+        assert response.status_code == 412
+
+        response = pytest.client.get("/llama", headers=get_headers())
+        assert "Missing Llama" not in [llama["name"] for llama in response.json()]
@@ -0,0 +1,88 @@
+"""
+Integration tests for the Llama store API.
+These tests test the /openapi.json and /openapi.yaml endpoints
+
+These tests assume that the write setup tests have been run, so that there is a test client.
+"""
+
+import json
+
+import pytest
+import yaml
+
+from http_caching import choose_content_encoding
+
+
+class TestOpenAPIEndpoints:
+    """
+    Test the OpenAPI spec endpoints. Tests in this fixture start at 401.
+    """
+
+    @pytest.mark.order(401)
+    @pytest.mark.parametrize("path,media_type", [("/openapi.json", "application/json"), ("/openapi.yaml", "text/yaml")])
+    def test_get_the_openapi_spec_returns_the_spec_with_an_etag(self, path: str, media_type: str):
+        """
+        Test that the spec is returned without an API token, with an ETag
+        """
+        response = pytest.client.get(path, headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith(media_type)
+        assert "content-encoding" not in response.headers
+        assert response.headers["etag"].startswith('"')
+        assert response.headers["vary"] == "Accept-Encoding"
+
+        spec = json.loads(response.content) if path.endswith(".json") else yaml.safe_load(response.content)
+        assert spec["info"]["title"] == "Llama Store API"
+        assert spec["servers"][0]["url"] == "http://localhost:8080"
+
+        # Every format a picture can be sent in is documented
+        picture_content = spec["paths"]["/llama/{llama_id}/picture"]["get"]["responses"]["200"]["content"]
+        assert set(picture_content) == {"image/png", "image/webp", "image/avif"}
+
+    @pytest.mark.order(401)
+    def test_get_the_openapi_spec_with_a_matching_etag_returns_not_modified(self):
+        """
+        Test that we get a 304 if we already have the current spec
+        """
+        response = pytest.client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+        etag = response.headers["etag"]
+
+        response = pytest.client.get("/openapi.json", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert not response.content
+
+    @pytest.mark.order(401)
+    def test_get_the_openapi_spec_accepting_gzip_returns_a_compressed_spec(self):
+        """
+        Test that the spec is compressed if the client accepts gzip, with a different ETag to the uncompressed spec
+        """
+        response = pytest.client.get("/openapi.json", headers={"Accept-Encoding": "identity"})
+        compressed_response = pytest.client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+
+        assert compressed_response.status_code == 200
+        assert compressed_response.headers["content-encoding"] == "gzip"
+        assert int(compressed_response.headers["content-length"]) < int(response.headers["content-length"])
+        assert compressed_response.headers["etag"] != response.headers["etag"]
+
+        # The test client decompresses the response
+        assert compressed_response.content == response.content
+
+    @pytest.mark.order(401)
+    @pytest.mark.parametrize(
+        "header,expected",
+        [
+            (None, "identity"),
+            ("gzip", "gzip"),
+            ("gzip, br", "br"),
+            ("br;q=0.5, gzip", "gzip"),
+            ("gzip;q=0", "identity"),
+            ("*", "br"),
+            ("deflate", "identity"),
+        ],
+    )
+    def test_choosing_a_content_encoding_uses_the_accept_encoding_header(self, header: str, expected: str):
+        """
+        Test that the content coding with the highest quality value is chosen, using server order for ties
+        """
+        assert choose_content_encoding(header, ["br", "gzip"]) == expected
@@ -0,0 +1,110 @@
+"""
+Integration tests for the llama picture garbage collector.
+
+These tests assume that the Llama picture integration tests have been run, so that llama 1 has a picture.
+"""
+
+# pylint: disable=invalid-name
+
+import os
+import time
+
+import pytest
+from sqlalchemy import text
+
+from data.database import SessionLocal
+from data.picture_gc import PictureGarbageCollector
+from data.schema import DBLlamaPicture
+from data.storage import ROOT_PATH
+
+
+class TestPictureGarbageCollection:
+    """
+    Test the picture garbage collector.
+    Tests in this fixture start at 301.
+    """
+
+    @pytest.mark.order(301)
+    def test_garbage_collection_removes_orphaned_rows_and_files(self):
+        """
+        Test that rows without a llama, and old files without a row, are removed
+        """
+        # A picture file with no row, old enough to be collected
+        orphaned_file = f"{ROOT_PATH}/9001.png"
+        with open(orphaned_file, "wb") as file:
+            file.write(b"x" * 100)
+        an_hour_ago = time.time() - 3600
+        os.utime(orphaned_file, (an_hour_ago, an_hour_ago))
+
+        # A picture row and file for a llama that doesn't exist
+        orphaned_row_file = f"{ROOT_PATH}/9002.png"
+        with open(orphaned_row_file, "wb") as file:
+            file.write(b"x" * 50)
+
+        db = SessionLocal()
+        try:
+            # Foreign keys stop this happening now, so turn them off to add a row like those left by older versions
+            db.execute(text("PRAGMA foreign_keys=OFF"))
+            db.add(DBLlamaPicture(llama_id=9002, image_file_location=orphaned_row_file))
+            db.commit()
+            db.execute(text("PRAGMA foreign_keys=ON"))
+
+            # Use a small batch size to check the collector keeps its place between batches
+            collector = PictureGarbageCollector(min_file_age=60, batch_size=1)
+            assert collector.collect(db)
+            assert db.query(DBLlamaPicture).filter(DBLlamaPicture.llama_id == 9002).first() is None
+        finally:
+            db.close()
+
+        assert not os.path.exists(orphaned_file)
+        assert not os.path.exists(orphaned_row_file)
+        # Earlier tests may have left their own orphans behind, which are also collected
+        assert collector.stats.rows_deleted >= 1
+        assert collector.stats.files_deleted >= 2
+        assert collector.stats.bytes_reclaimed >= 150
+        assert collector.stats.passes == 1
+
+        # Pictures for llamas that exist are left alone
+        response = pytest.client.get("/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        assert response.status_code == 200
+
+    @pytest.mark.order(301)
+    def test_garbage_collection_leaves_new_files(self):
+        """
+        Test that files without a row are left alone if they are new, as they may be part way through an upload
+        """
+        new_file = f"{ROOT_PATH}/9003.png"
+        with open(new_file, "wb") as file:
+            file.write(b"x" * 100)
+
+        db = SessionLocal()
+        try:
+            collector = PictureGarbageCollector(min_file_age=60)
+            assert collector.collect(db)
+        finally:
+            db.close()
+
+        assert os.path.exists(new_file)
+        os.remove(new_file)
+
+    @pytest.mark.order(301)
+    def test_garbage_collection_dry_run_deletes_nothing(self):
+        """
+        Test that a dry run counts orphans without deleting them
+        """
+        orphaned_file = f"{ROOT_PATH}/9004.png"
+        with open(orphaned_file, "wb") as file:
+            file.write(b"x" * 100)
+        an_hour_ago = time.time() - 3600
+        os.utime(orphaned_file, (an_hour_ago, an_hour_ago))
+
+        db = SessionLocal()
+        try:
+            collector = PictureGarbageCollector(min_file_age=60, dry_run=True)
+            assert collector.collect(db)
+        finally:
+            db.close()
+
+        assert os.path.exists(orphaned_file)
+        assert collector.stats.bytes_reclaimed == 100
+        os.remove(orphaned_file)
@@ -0,0 +1,248 @@
+"""
+Tests for the llama picture storage backends.
+The S3 backend is tested against an in-memory stand-in for an S3 compatible object store, so these tests don't
+need boto3 or a running object store.
+
+The endpoint tests assume that the Llama picture integration tests have been run, so that llama 1 has a picture.
+"""
+
+# pylint: disable=duplicate-code
+
+from datetime import datetime, timezone
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from data import storage as storage_module
+from data.storage import FileSystemStorage, S3Storage
+from routers import llama_picture_read
+
+
+class FakeClientError(Exception):
+    """
+    A stand-in for the botocore ClientError.
+    """
+
+    def __init__(self, code: str) -> None:
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeNoSuchKey(FakeClientError):
+    """
+    A stand-in for the NoSuchKey error raised by get_object.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("NoSuchKey")
+
+
+class FakeS3Client:
+    """
+    An in-memory stand-in for an S3 client, with just the calls used by the S3 storage backend.
+    """
+
+    exceptions = SimpleNamespace(ClientError=FakeClientError, NoSuchKey=FakeNoSuchKey)
+
+    def __init__(self) -> None:
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType):  # pylint: disable=invalid-name,unused-argument
+        """
+        Store an object.
+        """
+        self.objects[(Bucket, Key)] = (Body, datetime.now(timezone.utc))
+
+    def get_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        """
+        Get an object as a stream.
+        """
+        if (Bucket, Key) not in self.objects:
+            raise FakeNoSuchKey()
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def head_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        """
+        Get the size and last modified time of an object.
+        """
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError("404")
+        body, last_modified = self.objects[(Bucket, Key)]
+        return {"ContentLength": len(body), "LastModified": last_modified}
+
+    def delete_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        """
+        Delete an object.
+        """
+        self.objects.pop((Bucket, Key), None)
+
+    def list_objects_v2(self, Bucket, Prefix, StartAfter, MaxKeys):  # pylint: disable=invalid-name
+        """
+        List objects in order of key.
+        """
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        keys = [key for key in keys if key > StartAfter][:MaxKeys]
+        contents = [
+            {"Key": key, "Size": len(self.objects[(Bucket, key)][0]), "LastModified": self.objects[(Bucket, key)][1]}
+            for key in keys
+        ]
+        return {"Contents": contents} if contents else {}
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):  # pylint: disable=invalid-name
+        """
+        Make a fake presigned URL.
+        """
+        return f"https://objects.example.com/{Params['Bucket']}/{Params['Key']}?method={method}&expires={ExpiresIn}"
+
+
+class TestPictureStorage:
+    """
+    Test the picture storage backends.
+    Tests in this fixture start at 201.
+    """
+
+    @pytest.mark.order(201)
+    def test_file_system_storage_stores_reads_and_deletes_pictures(self, tmp_path):
+        """
+        Test the file system backend
+        """
+        storage = FileSystemStorage(str(tmp_path / "pictures"))
+
+        location = storage.put("1.png", b"llama")
+        assert location == f"{tmp_path}/pictures/1.png"
+        assert storage.local_path(location) == location
+        assert storage.presigned_url(location, 60) is None
+
+        with storage.open(location) as file:
+            assert file.read() == b"llama"
+        assert storage.stat(location).size == 5
+
+        storage.put("2.png", b"alpaca")
+        assert [name for name, _ in storage.list_pictures()] == [location, f"{tmp_path}/pictures/2.png"]
+        assert [name for name, _ in storage.list_pictures(start_after=location)] == [f"{tmp_path}/pictures/2.png"]
+
+        storage.delete(location)
+        assert storage.stat(location) is None
+
+        # Deleting again does nothing
+        storage.delete(location)
+
+    @pytest.mark.order(201)
+    def test_file_system_storage_lists_the_folder_once_for_each_walk(self, monkeypatch, tmp_path):
+        """
+        Test that paging through the pictures reads the folder once, at the start of the walk, and leaves out
+        temporary files
+        """
+        storage = FileSystemStorage(str(tmp_path))
+        for name in ["1.png", "2.png", "3.png", "4.png.1.2.tmp", "5.png"]:
+            (tmp_path / name).write_bytes(b"llama")
+
+        scans = []
+        original_scandir = storage_module.os.scandir
+
+        def counting_scandir(path):
+            scans.append(path)
+            return original_scandir(path)
+
+        monkeypatch.setattr(storage_module.os, "scandir", counting_scandir)
+
+        locations = []
+        page = storage.list_pictures(limit=2)
+        while page:
+            locations.extend(location for location, _ in page)
+            page = storage.list_pictures(start_after=locations[-1], limit=2)
+
+        assert locations == [f"{tmp_path}/{name}" for name in ["1.png", "2.png", "3.png", "5.png"]]
+        assert len(scans) == 1
+
+        # The next walk lists the folder again, so it sees new pictures
+        (tmp_path / "6.png").write_bytes(b"llama")
+        assert len(storage.list_pictures()) == 5
+        assert len(scans) == 2
+
+    @pytest.mark.order(201)
+    def test_file_system_storage_removes_the_temporary_file_if_a_write_fails(self, tmp_path, monkeypatch):
+        """
+        Test that a failed write doesn't leave a temporary file behind, or replace the existing picture
+        """
+        storage = FileSystemStorage(str(tmp_path))
+        location = storage.put("1.png", b"llama")
+
+        def fail(*_):
+            raise OSError("The disk is full")
+
+        monkeypatch.setattr(storage_module.os, "replace", fail)
+        with pytest.raises(OSError):
+            storage.put("1.png", b"alpaca")
+
+        assert [entry.name for entry in tmp_path.iterdir()] == ["1.png"]
+        with storage.open(location) as file:
+            assert file.read() == b"llama"
+
+    @pytest.mark.order(201)
+    def test_s3_storage_stores_reads_and_deletes_pictures(self):
+        """
+        Test the S3 backend against the in-memory stand-in
+        """
+        storage = S3Storage(bucket="llamas", prefix="pictures/", client=FakeS3Client())
+
+        location = storage.put("1.png", b"llama")
+        assert location == "pictures/1.png"
+        assert storage.local_path(location) is None
+        assert storage.presigned_url(location, 60).startswith("https://objects.example.com/llamas/pictures/1.png")
+
+        with storage.open(location) as file:
+            assert file.read() == b"llama"
+        assert storage.stat(location).size == 5
+
+        storage.put("2.png", b"alpaca")
+        assert [name for name, _ in storage.list_pictures(limit=1)] == [location]
+        assert [name for name, _ in storage.list_pictures(start_after=location)] == ["pictures/2.png"]
+
+        storage.delete(location)
+        assert storage.stat(location) is None
+        with pytest.raises(FileNotFoundError):
+            storage.open(location)
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_from_s3_storage_streams_the_picture(self, monkeypatch):
+        """
+        Test that pictures that are not on the local file system are streamed from the storage
+        """
+        with open(".appdata/llama_store_data/pictures/1.png", "rb") as file:
+            picture = file.read()
+
+        client = FakeS3Client()
+        storage = S3Storage(bucket="llamas", client=client)
+        client.put_object(
+            Bucket="llamas", Key=".appdata/llama_store_data/pictures/1.png", Body=picture, ContentType="image/png"
+        )
+        monkeypatch.setattr(llama_picture_read, "get_picture_storage", lambda: storage)
+
+        response = pytest.client.get("/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        assert response.status_code == 200
+        assert response.content == picture
+        assert "etag" in response.headers
+
+        response = pytest.client.get(
+            "/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}", "Range": "bytes=10-19"}
+        )
+        assert response.status_code == 206
+        assert response.content == picture[10:20]
+        assert response.headers["content-range"] == f"bytes 10-19/{len(picture)}"
+
+    @pytest.mark.order(201)
+    def test_get_a_llama_picture_with_redirects_turned_on_redirects_to_the_storage(self, monkeypatch):
+        """
+        Test that we are redirected to a presigned URL for the full size picture if redirects are turned on
+        """
+        storage = S3Storage(bucket="llamas", client=FakeS3Client())
+        monkeypatch.setattr(llama_picture_read, "get_picture_storage", lambda: storage)
+        monkeypatch.setattr(llama_picture_read, "REDIRECT_TO_STORAGE", True)
+
+        response = pytest.client.get(
+            "/llama/1/picture", headers={"Authorization": f"Bearer {pytest.api_token}"}, follow_redirects=False
+        )
+        assert response.status_code == 307
+        assert response.headers["location"].startswith("https://objects.example.com/llamas/")
@@ -0,0 +1,98 @@
+"""
+Tests for the cache of resized and transcoded llama pictures.
+"""
+
+import os
+import threading
+
+import pytest
+
+from data import picture_variants
+from data.picture_variants import PictureVariantCache
+
+# A stored picture to make variants of
+SOURCE_FILE = "./db_migrations/llama_pictures/1.png"
+
+
+class TestPictureVariants:
+    """
+    Test the picture variant cache.
+    """
+
+    def test_variants_are_written_through_a_temporary_file_named_after_the_process(self, monkeypatch, tmp_path):
+        """
+        Test that the temporary file for a variant is named after the process as well as the thread, as workers
+        forked from the same process can have the same thread ID
+        """
+        variant_cache = PictureVariantCache(str(tmp_path), 1024 * 1024, 1)
+        replaced = []
+        original_replace = os.replace
+
+        def recording_replace(source: str, destination: str) -> None:
+            replaced.append((source, threading.get_ident()))
+            original_replace(source, destination)
+
+        monkeypatch.setattr(picture_variants.os, "replace", recording_replace)
+        variant = variant_cache.get_variant(1, SOURCE_FILE, 32, None, "png")
+
+        assert [os.path.basename(name) for name, _ in replaced] == [f"1_32x0.png.{os.getpid()}.{replaced[0][1]}.tmp"]
+        assert [entry.name for entry in tmp_path.iterdir()] == ["1_32x0.png"]
+        assert variant.file_name == f"{tmp_path}/1_32x0.png"
+
+    def test_a_variant_that_fails_to_be_written_leaves_no_temporary_file(self, monkeypatch, tmp_path):
+        """
+        Test that the temporary file for a variant is removed if the variant can't be moved into place
+        """
+        variant_cache = PictureVariantCache(str(tmp_path), 1024 * 1024, 1)
+
+        def fail(*_):
+            raise OSError("The disk is full")
+
+        monkeypatch.setattr(picture_variants.os, "replace", fail)
+        with pytest.raises(OSError):
+            variant_cache.get_variant(1, SOURCE_FILE, 32, None, "png")
+
+        assert not list(tmp_path.iterdir())
+
+    def test_invalidating_a_llama_leaves_temporary_files_alone(self, tmp_path):
+        """
+        Test that invalidating a llama's variants only deletes finished variants, and not the temporary files that
+        other threads are writing
+        """
+        variant_cache = PictureVariantCache(str(tmp_path), 1024 * 1024, 1)
+        for name in ["1_32x0.png", "1_32x0.png.1.2.tmp", "2_32x0.png"]:
+            (tmp_path / name).write_bytes(b"llama")
+
+        variant_cache.invalidate(1)
+        assert sorted(entry.name for entry in tmp_path.iterdir()) == ["1_32x0.png.1.2.tmp", "2_32x0.png"]
+
+    def test_a_variant_of_an_old_picture_is_not_cached(self, monkeypatch, tmp_path):
+        """
+        Test that a variant that was being generated when the llama's variants were invalidated is sent to the
+        requests waiting for it, but isn't added to the cache
+        """
+        variant_cache = PictureVariantCache(str(tmp_path), 1024 * 1024, 1)
+        started, invalidated = threading.Event(), threading.Event()
+        original_encode = picture_variants._encode_variant  # pylint: disable=protected-access
+
+        def slow_encode(*args) -> bytes:
+            started.set()
+            invalidated.wait(5)
+            return original_encode(*args)
+
+        monkeypatch.setattr(picture_variants, "_encode_variant", slow_encode)
+        results = []
+        request = threading.Thread(
+            target=lambda: results.append(variant_cache.get_variant(1, SOURCE_FILE, 32, None, "png"))
+        )
+        request.start()
+        assert started.wait(5)
+        variant_cache.invalidate(1)
+        invalidated.set()
+        request.join(5)
+
+        assert results[0].file_name is None and results[0].body
+        assert not list(tmp_path.iterdir())
+
+        # The next request generates the variant of the new picture, and caches it
+        assert variant_cache.get_variant(1, SOURCE_FILE, 32, None, "png").file_name == f"{tmp_path}/1_32x0.png"
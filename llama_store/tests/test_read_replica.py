@@ -0,0 +1,115 @@
+"""
+Tests for read replica mode.
+
+These tests turn on read replica mode for the app the other tests use, so they can check what is read from memory.
+They assume that the write setup tests have been run, so that there is a test client and API token.
+"""
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+
+from data import replica
+from data.database import SessionLocal, engine, get_database_url
+from data.replica import get_change_version
+
+
+def get_current_change_version() -> int:
+    """
+    Gets the change version from the database.
+    """
+    session = SessionLocal()
+    try:
+        return get_change_version(session)
+    finally:
+        session.close()
+
+
+class TestReadReplica:
+    """
+    Test read replica mode. Tests in this fixture start at 401.
+    """
+
+    @pytest.mark.order(401)
+    def test_writing_to_the_database_bumps_the_change_version(self):
+        """
+        Test that the triggers bump the change version when a llama is created
+        """
+        version = get_current_change_version()
+
+        response = pytest.client.post(
+            "/llama",
+            json={"name": "Replica Llama 1", "age": 3, "color": "gray", "rating": 5},
+            headers={"Authorization": f"Bearer {pytest.api_token}"},
+        )
+        assert response.status_code == 201
+
+        assert get_current_change_version() > version
+
+    @pytest.mark.order(401)
+    def test_a_read_replica_serves_llamas_without_running_sql(self, monkeypatch):
+        """
+        Test that once the snapshot is loaded, getting llamas doesn't run any SQL, including checking the API token
+        """
+        monkeypatch.setattr(replica, "READ_REPLICA", True)
+        monkeypatch.setattr(replica.read_replica, "snapshot", None)
+        assert replica.read_replica.refresh()
+
+        statements = []
+
+        def record_statement(*args) -> None:
+            statements.append(args[2])
+
+        event.listen(engine, "before_cursor_execute", record_statement)
+        try:
+            headers = {"Authorization": f"Bearer {pytest.api_token}"}
+            response = pytest.client.get("/llama", headers=headers)
+            assert response.status_code == 200
+            assert "Replica Llama 1" in [llama["name"] for llama in response.json()]
+
+            response = pytest.client.get("/llama/1?include_picture_urls=true", headers=headers)
+            assert response.status_code == 200
+            assert "pictureUrl" in response.json()
+        finally:
+            event.remove(engine, "before_cursor_execute", record_statement)
+
+        assert not statements
+
+    @pytest.mark.order(401)
+    def test_a_read_replica_reloads_when_the_change_version_changes(self, monkeypatch):
+        """
+        Test that the snapshot is only reloaded when something has been written
+        """
+        monkeypatch.setattr(replica, "READ_REPLICA", True)
+        monkeypatch.setattr(replica.read_replica, "snapshot", None)
+        assert replica.read_replica.refresh()
+        assert not replica.read_replica.refresh()
+
+        # Write a llama as the writer would, then check the replica picks it up
+        session = SessionLocal()
+        try:
+            session.execute(
+                text("INSERT INTO llamas (name, age, color, rating) VALUES ('Replica Llama 2', 4, 'white', 3)")
+            )
+            session.commit()
+        finally:
+            session.close()
+
+        assert replica.read_replica.refresh()
+        response = pytest.client.get("/llama", headers={"Authorization": f"Bearer {pytest.api_token}"})
+        assert "Replica Llama 2" in [llama["name"] for llama in response.json()]
+
+    def test_a_read_replica_opens_the_database_read_only(self):
+        """
+        Test that the read replica database URL can't be written to
+        """
+        assert get_database_url(read_only=True, immutable=True).endswith("?mode=ro&immutable=1&uri=true")
+
+        read_only_engine = create_engine(get_database_url(read_only=True))
+        try:
+            with read_only_engine.connect() as connection:
+                assert connection.execute(text("SELECT COUNT(*) FROM llamas")).scalar() > 0
+                with pytest.raises(OperationalError, match="readonly database"):
+                    connection.execute(text("DELETE FROM llamas"))
+        finally:
+            read_only_engine.dispose()
@@ -24,6 +24,17 @@ class TestReadonlyLlamaPictureEndpoints:
         )
         assert response.status_code == 200
 
+    @pytest.mark.order(2001)
+    def test_get_llama_pictures_with_an_api_token_returns_the_pictures(self):
+        """
+        Test that we can get the llama picture archive with an API token
+        """
+        response = pytest.readonly_client.get(
+            "/llama/pictures?llama_id=1", headers={"Authorization": f"Bearer {pytest.api_token}"}
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zip"
+
     @pytest.mark.order(2001)
     def test_create_a_new_llama_with_an_api_key_fails_with_endpoint_not_found(self):
         """
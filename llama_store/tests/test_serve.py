@@ -0,0 +1,99 @@
+"""
+Tests for the production launcher settings.
+"""
+
+from types import SimpleNamespace
+
+import serve
+from data import picture_gc
+from data.database import engine
+from serve import LlamaStoreApplication, LlamaStoreUvicornWorker
+
+
+class TestServe:
+    """
+    Test the gunicorn and uvicorn settings used by the production launcher.
+    """
+
+    def test_the_app_is_preloaded_with_the_llama_store_worker(self):
+        """
+        Test that the app is loaded before the workers are forked, and the workers use the tuned uvicorn settings
+        """
+        application = LlamaStoreApplication()
+
+        assert application.cfg.preload_app
+        assert application.cfg.workers == serve.SERVER_WORKERS
+        assert application.cfg.worker_class is LlamaStoreUvicornWorker
+        assert application.cfg.bind == [f"{serve.SERVER_HOST}:{serve.SERVER_PORT}"]
+        assert application.cfg.backlog == serve.SERVER_BACKLOG
+        assert application.cfg.keepalive == serve.SERVER_KEEP_ALIVE_SECONDS
+
+    def test_the_worker_uses_the_server_settings(self):
+        """
+        Test that the uvicorn worker settings come from the environment variables
+        """
+        assert LlamaStoreUvicornWorker.CONFIG_KWARGS == {
+            "loop": serve.SERVER_LOOP,
+            "http": serve.SERVER_HTTP,
+            "timeout_keep_alive": serve.SERVER_KEEP_ALIVE_SECONDS,
+            "limit_concurrency": serve.SERVER_LIMIT_CONCURRENCY,
+        }
+
+    def test_the_migrations_run_before_the_workers_are_forked(self, monkeypatch):
+        """
+        Test that the migrations are run before gunicorn starts, as gunicorn forks the workers when it starts
+        """
+        calls = []
+        monkeypatch.setattr(serve, "SERVER_RUN_MIGRATIONS", True)
+        monkeypatch.setattr(serve, "run_migrations", lambda: calls.append("migrations"))
+        monkeypatch.setattr(LlamaStoreApplication, "run", lambda _: calls.append("gunicorn"))
+
+        serve.run_server()
+        assert calls == ["migrations", "gunicorn"]
+
+        # The migrations can be turned off
+        monkeypatch.setattr(serve, "SERVER_RUN_MIGRATIONS", False)
+        serve.run_server()
+        assert calls == ["migrations", "gunicorn", "gunicorn"]
+
+    def test_each_worker_drops_the_database_connections_of_the_main_process(self, monkeypatch):
+        """
+        Test that a forked worker disposes of the connection pool it got from the main process, without closing
+        the connections the main process is still using
+        """
+        dispose_calls = []
+
+        def record_dispose(close: bool) -> None:
+            dispose_calls.append(close)
+
+        monkeypatch.setattr(engine, "dispose", record_dispose)
+        monkeypatch.setattr(picture_gc, "run_in_this_process", True)
+
+        serve.post_fork(SimpleNamespace(WORKERS={}), SimpleNamespace(run_picture_gc=True))
+        assert dispose_calls == [False]
+        assert LlamaStoreApplication().cfg.post_fork is serve.post_fork
+
+    def test_only_one_worker_runs_picture_garbage_collection(self, monkeypatch):
+        """
+        Test that the first worker is picked to run the picture garbage collection, and that another worker is
+        picked if it is replaced
+        """
+        monkeypatch.setattr(engine, "dispose", lambda close: None)
+        monkeypatch.setattr(picture_gc, "run_in_this_process", True)
+        server = SimpleNamespace(WORKERS={})
+        workers = [SimpleNamespace() for _ in range(3)]
+        for pid, worker in enumerate(workers):
+            serve.pre_fork(server, worker)
+            server.WORKERS[pid] = worker
+        assert [worker.run_picture_gc for worker in workers] == [True, False, False]
+
+        serve.post_fork(server, workers[1])
+        assert not picture_gc.run_in_this_process
+        serve.post_fork(server, workers[0])
+        assert picture_gc.run_in_this_process
+
+        # When the worker running the garbage collection exits, the worker that replaces it runs it
+        del server.WORKERS[0]
+        replacement = SimpleNamespace()
+        serve.pre_fork(server, replacement)
+        assert replacement.run_picture_gc
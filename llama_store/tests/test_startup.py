@@ -0,0 +1,94 @@
+"""
+Tests that starting the API doesn't import the slow dependencies that are only needed by some requests.
+
+Each test starts the API in a new process, as the other tests have already imported everything.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# The modules that should only be imported when they are first used
+LAZY_MODULES = ["PIL.Image", "yaml", "jose", "passlib.context", "uvicorn"]
+
+# Imports the app, then prints which of the given modules have been imported
+CHECK_IMPORTS_CODE = """
+import json
+import sys
+
+import main
+
+print(json.dumps([module for module in sys.argv[1:] if module in sys.modules]))
+"""
+
+# Imports the app, then starts it, and prints whether the OpenAPI spec was generated at each step
+CHECK_OPENAPI_CODE = """
+import asyncio
+import json
+
+import main
+
+rendered = [main.app.openapi_schema is not None]
+
+
+async def start():
+    async with main.lifespan(main.app):
+        rendered.append(main.openapi_documents._documents is not None)
+
+
+asyncio.run(start())
+print(json.dumps(rendered))
+"""
+
+
+def get_modules_imported_at_startup(allow_write: bool, modules: list) -> list:
+    """
+    Starts the API in a new process, and gets which of the given modules were imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", CHECK_IMPORTS_CODE, *modules],
+        env={**os.environ, "ALLOW_WRITE": str(allow_write).lower()},
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+class TestStartup:
+    """
+    Test what is imported when the API starts.
+    """
+
+    @pytest.mark.parametrize("allow_write", [True, False])
+    def test_starting_the_api_does_not_import_slow_dependencies(self, allow_write: bool):
+        """
+        Test that the slow dependencies are not imported when the API starts
+        """
+        assert not get_modules_imported_at_startup(allow_write, LAZY_MODULES)
+
+    def test_starting_the_api_in_read_only_mode_does_not_import_the_write_routers(self):
+        """
+        Test that the write routers are only imported in write mode
+        """
+        write_routers = ["routers.llama_write", "routers.llama_picture_write"]
+        assert not get_modules_imported_at_startup(False, write_routers)
+        assert get_modules_imported_at_startup(True, write_routers) == write_routers
+
+    def test_the_openapi_documents_are_rendered_when_the_api_starts_rather_than_when_it_is_imported(self):
+        """
+        Test that importing the app doesn't generate the OpenAPI spec, and starting it renders the documents before
+        it accepts requests
+        """
+        result = subprocess.run(
+            [sys.executable, "-c", CHECK_OPENAPI_CODE],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        assert json.loads(result.stdout.strip().splitlines()[-1]) == [False, True]
@@ -6,10 +6,8 @@
 cd llama_store
 
 # Create the read-only specs in JSON and YAML
-python3 export_openapi.py main:app --out ../read-only-spec.json
-python3 export_openapi.py main:app --out ../read-only-spec.yaml
+python3 export_openapi.py main:app --out ../read-only-spec.json --out ../read-only-spec.yaml
 
 # Create the read/write specs
 export ALLOW_WRITE=true
-python3 export_openapi.py main:app --out ../spec.json
-python3 export_openapi.py main:app --out ../spec.yaml
+python3 export_openapi.py main:app --out ../spec.json --out ../spec.yaml
@@ -4,6 +4,9 @@ cd /workspaces/llama-store/llama_store
 # Delete the llama pictures
 rm .appdata/llama_store_data/pictures/*
 
+# Delete the resized llama pictures
+rm -rf .appdata/llama_store_data/variants
+
 # Delete the database file
 rm .appdata/sql_app.db
 